@@ -0,0 +1,279 @@
+"""
+Archives as conversion sources.
+
+convert_archive() reads the members of a ZIP or TAR archive (plain, gz,
+bz2 or xz) one after another and converts each to every requested format
+it supports. A gzip, bzip2 or xz file that holds a single file rather
+than a tar counts as an archive with one member.
+
+Members are not extracted next to the archive. Each is streamed into the
+same RAM-backed scratch space that conversion chains use (/dev/shm).
+Where there is none (Windows, macOS) they are staged in the temporary
+directory instead, which is on disk. Members are staged in windows of
+window_bytes, or half the free scratch space if that is less (Docker gives
+/dev/shm 64 MB by default), and each window runs as one parallel
+ConversionEngine batch. The staged copies are then deleted, so scratch
+use stays around one window whatever the archive size. A member that does
+not fit in the scratch space fails on its own. A TAR is read as a stream,
+with no seeking back.
+
+Outputs go to <output_directory>/<archive name>/<member path>. They can
+instead be appended to an output archive (.zip, .tar, .tar.gz/.tgz,
+.tar.bz2, .tar.xz) as each one finishes. The output archive is written
+under a .part name and renamed once complete.
+"""
+import bz2
+import copy
+import errno
+import gzip
+import lzma
+import os
+import posixpath
+import shutil
+import tarfile
+import tempfile
+import zipfile
+from conversion_engine import ConversionResult
+from conversion_metrics import base_record
+from conversion_planner import scratch_root
+from format_sniffer import resolve_format
+from utils import get_supported_formats
+
+ARCHIVE_FORMATS = {'.zip', '.tar', '.gz', '.bz2', '.xz'}
+_COMPRESSED_STREAMS = {'.gz': gzip.open, '.bz2': bz2.open, '.xz': lzma.open}
+DEFAULT_WINDOW_BYTES = 512 * 1024 * 1024
+# Part of the free scratch space one window may take; the rest is left for
+# outputs and the intermediates of conversion chains
+SCRATCH_SHARE = 0.5
+# Also bounds the number of staged members, so thousands of tiny files still run in batches
+WINDOW_MEMBERS = 256
+COPY_CHUNK_SIZE = 1024 * 1024
+# Outputs that are compressed already are stored in an output ZIP as they are
+_STORED_FORMATS = {'.jpg', '.jpeg', '.png', '.gif', '.webp', '.mp3', '.ogg', '.m4a', '.mp4', '.mkv', '.mov',
+                   '.avi', '.webm', '.docx', '.xlsx', '.pptx', '.zip', '.gz', '.flac'}
+
+
+def is_archive(path):
+    return resolve_format(path) in ARCHIVE_FORMATS
+
+
+def archive_stem(path):
+    name = os.path.basename(path)
+    for suffix in ('.tar.gz', '.tar.bz2', '.tar.xz', '.tgz'):
+        if name.lower().endswith(suffix):
+            return name[:-len(suffix)]
+    return os.path.splitext(name)[0]
+
+
+def _safe_member_name(name):
+    """The member path with absolute prefixes and '..' removed, so outputs stay inside their directory."""
+    parts = [part for part in posixpath.normpath(name.replace('\\', '/')).split('/')
+             if part not in ('', '.', '..')]
+    return '/'.join(parts)
+
+
+def iter_members(archive_path):
+    """
+    Yields (member_name, file object, size) for the regular files of an
+    archive, in archive order. size is None for a lone compressed file. Each
+    file object is only valid until the next one is requested.
+    """
+    archive_format = resolve_format(archive_path)
+    if archive_format == '.zip':
+        with zipfile.ZipFile(archive_path) as archive:
+            for info in archive.infolist():
+                if info.is_dir():
+                    continue
+                with archive.open(info) as member:
+                    yield info.filename, member, info.file_size
+        return
+    try:
+        # Stream mode: members are read in order and nothing is seeked
+        archive = tarfile.open(archive_path, mode='r|*')
+    except tarfile.ReadError:
+        opener = _COMPRESSED_STREAMS.get(archive_format)
+        if opener is None:
+            raise ValueError(f"{os.path.basename(archive_path)} is not a readable archive.")
+        with opener(archive_path, 'rb') as member:
+            yield archive_stem(archive_path), member, None
+        return
+    with archive:
+        for info in archive:
+            if not info.isfile():
+                continue
+            member = archive.extractfile(info)
+            if member is not None:
+                with member:
+                    yield info.name, member, info.size
+
+
+class ArchiveWriter:
+    """Appends files to a new ZIP or TAR; the archive appears under its name once close() succeeds."""
+
+    def __init__(self, path):
+        self.path = path
+        self._part = path + '.part'
+        name = os.path.basename(path).lower()
+        if name.endswith('.zip'):
+            self._zip = zipfile.ZipFile(self._part, 'w', zipfile.ZIP_DEFLATED, allowZip64=True)
+            self._tar = None
+            return
+        mode = 'w|'
+        for suffixes, compression in ((('.tar.gz', '.tgz'), 'gz'), (('.tar.bz2',), 'bz2'), (('.tar.xz',), 'xz')):
+            if name.endswith(suffixes):
+                mode = 'w|' + compression
+        if mode == 'w|' and not name.endswith('.tar'):
+            raise ValueError(f"Cannot write {os.path.basename(path)}: use .zip, .tar, .tar.gz, .tar.bz2 or .tar.xz.")
+        self._zip = None
+        self._tar = tarfile.open(self._part, mode)
+
+    def add(self, file_path, arcname):
+        if self._zip is not None:
+            stored = os.path.splitext(arcname)[1].lower() in _STORED_FORMATS
+            self._zip.write(file_path, arcname, zipfile.ZIP_STORED if stored else zipfile.ZIP_DEFLATED)
+        else:
+            self._tar.add(file_path, arcname, recursive=False)
+
+    def close(self, keep=True):
+        (self._zip or self._tar).close()
+        if keep:
+            os.replace(self._part, self.path)
+        else:
+            try:
+                os.remove(self._part)
+            except OSError:
+                pass
+
+
+def _targets(input_format, supported_formats):
+    for formats in supported_formats.values():
+        if input_format in formats:
+            return formats[input_format]
+    return []
+
+
+def _window_limit(scratch, window_bytes):
+    return max(1, min(window_bytes, int(shutil.disk_usage(scratch).free * SCRATCH_SHARE)))
+
+
+def convert_archive(archive_path, output_formats, engine, output_directory=None, writer=None, prefix=None,
+                    on_result=None, on_skipped=None, should_stop=None, window_bytes=DEFAULT_WINDOW_BYTES):
+    """
+    Converts every member of archive_path to each of output_formats it
+    supports, with engine. Outputs go to output_directory (under a folder
+    named after the archive) or, when writer (an ArchiveWriter) is given,
+    into that archive under prefix.
+    on_result(result, member_name) is called for every conversion, and
+    on_skipped(member_name, input_format, output_format) for every format
+    a member cannot be converted to. Results name their input as <archive_path>/<member> and,
+    with a writer, their output as <output archive>/<entry>. Returns the
+    list of results.
+    """
+    if should_stop is None:
+        should_stop = lambda: False
+    supported_formats = get_supported_formats()
+    if output_directory is None:
+        output_directory = engine.output_directory
+    if writer is None:
+        output_root = os.path.join(output_directory, prefix if prefix is not None else archive_stem(archive_path))
+    scratch = tempfile.mkdtemp(prefix=f'pxconvert-archive-{os.getpid()}-', dir=scratch_root())
+    results = []
+    window = []
+    staged_bytes = 0
+    limit = _window_limit(scratch, window_bytes)
+
+    def output_path_for(name, output_format, staging):
+        stem = os.path.splitext(posixpath.basename(name))[0]
+        if writer is not None:
+            return os.path.join(staging, 'out', stem + output_format)
+        return os.path.join(output_root, *posixpath.dirname(name).split('/'), stem + output_format)
+
+    def member_failed(name, staging, error):
+        # The member's content was never read, so its targets come from its extension
+        supported = _targets(os.path.splitext(name)[1].lower(), supported_formats)
+        input_path = os.path.join(archive_path, *name.split('/'))
+        for output_format in [f for f in output_formats if f in supported] or output_formats:
+            output_path = output_path_for(name, output_format, staging)
+            result = ConversionResult(len(results), input_path, output_path, error,
+                                      metrics=base_record(input_path, output_path, 'failed', error))
+            results.append(result)
+            if on_result:
+                on_result(result, name)
+
+    def run_window():
+        jobs = [(path, output_format, output_path) for path, _, output_format, output_path in window]
+        names = [name for _, name, _, _ in window]
+        # Renamed copies: the engine still links duplicate members from the originals
+        renamed = {}
+
+        def finished(result, *_):
+            result = renamed[result.index] = copy.copy(result)
+            name = names[result.index]
+            result.input_path = os.path.join(archive_path, *name.split('/'))
+            if writer is not None and result.ok:
+                arcname = posixpath.join(prefix or '', posixpath.dirname(name),
+                                         os.path.basename(result.output_path))
+                try:
+                    writer.add(result.output_path, arcname)
+                    result.output_path = os.path.join(writer.path, *arcname.split('/'))
+                except OSError as e:
+                    result.error = f"Could not add {arcname} to {os.path.basename(writer.path)}: {e}"
+            if on_result:
+                on_result(result, name)
+
+        try:
+            results.extend(renamed.get(result.index, result)
+                           for result in engine.run(jobs, on_result=finished, should_stop=should_stop))
+        finally:
+            for path in {path for path, _, _, _ in window}:
+                shutil.rmtree(os.path.dirname(path), ignore_errors=True)
+            window.clear()
+
+    try:
+        for number, (member_name, member, size) in enumerate(iter_members(archive_path)):
+            if should_stop():
+                break
+            name = _safe_member_name(member_name)
+            if not name:
+                continue
+            if window and size is not None and staged_bytes + size > limit:
+                # Make room first rather than run out of scratch space halfway through the member
+                run_window()
+                staged_bytes = 0
+            if not window:
+                limit = _window_limit(scratch, window_bytes)
+            staging = os.path.join(scratch, str(number))
+            os.mkdir(staging)
+            staged = os.path.join(staging, posixpath.basename(name))
+            try:
+                with open(staged, 'wb') as f:
+                    shutil.copyfileobj(member, f, COPY_CHUNK_SIZE)
+            except OSError as e:
+                if e.errno != errno.ENOSPC:
+                    raise
+                shutil.rmtree(staging, ignore_errors=True)
+                member_failed(name, staging, f"Not enough scratch space to stage {name}: {e.strerror}")
+                continue
+            input_format = resolve_format(staged)
+            supported = _targets(input_format, supported_formats)
+            targets = [output_format for output_format in output_formats if output_format in supported]
+            if on_skipped:
+                for output_format in output_formats:
+                    if output_format not in supported:
+                        on_skipped(name, input_format, output_format)
+            if not targets:
+                shutil.rmtree(staging, ignore_errors=True)
+                continue
+            for output_format in targets:
+                output_path = output_path_for(name, output_format, staging)
+                os.makedirs(os.path.dirname(output_path), exist_ok=True)
+                window.append((staged, name, output_format, output_path))
+            staged_bytes += os.path.getsize(staged)
+            if staged_bytes >= limit or len(window) >= WINDOW_MEMBERS:
+                run_window()
+                staged_bytes = 0
+        if window and not should_stop():
+            run_window()
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+    return results
@@ -0,0 +1,278 @@
+"""
+Constant-memory audio transcoding.
+
+One ffmpeg process decodes the source to PCM WAV on its stdout, and the
+encoder reads it from a pipe, so only a pipe buffer's worth of audio is in
+flight at any time, whatever the duration. The commands match the ones
+pydub runs in AudioSegment.from_file()/export(), so plain format changes
+produce byte-for-byte the same files as the in-memory path.
+
+stream_transcode_many() fans one decode out to several targets: every
+PCM chunk is written to one encoder process per target, and the encoders
+run side by side.
+
+When the job's progress is followed, it is measured against the source
+duration: by the encoder's -progress output, or by the PCM bytes relayed
+through Python.
+"""
+import os
+import struct
+import subprocess
+import tempfile
+import wave
+from conversion_metrics import report_progress
+from ffmpeg_tools import ffmpeg_command, follow_progress, probe, progress_duration, streams_of_type
+
+CHUNK_SIZE = 256 * 1024
+
+# Same encoder defaults as pydub's AudioSegment.DEFAULT_CODECS
+DEFAULT_CODECS = {"ogg": "libvorbis"}
+
+
+def pcm_codec_for(input_path):
+    """
+    Picks the PCM sample format the decoder emits, using the same rules as
+    pydub: keep the source bit depth, but treat lossy planar float sources as
+    16-bit.
+    """
+    if input_path.lower().endswith('.wav'):
+        try:
+            with wave.open(input_path, 'rb') as wav:
+                bits = wav.getsampwidth() * 8
+            return 'pcm_u8' if bits == 8 else f'pcm_s{bits}le'
+        except (wave.Error, EOFError):
+            pass
+    try:
+        streams = streams_of_type(probe(input_path), 'audio')
+    except RuntimeError:
+        streams = []
+    if not streams:
+        return 'pcm_s16le'
+    stream = streams[0]
+    if stream.get('sample_fmt') == 'fltp' and stream.get('codec_name') in ['mp3', 'mp4', 'aac', 'webm', 'ogg']:
+        bits = 16
+    else:
+        bits = int(stream.get('bits_per_sample') or 16)
+    return 'pcm_u8' if bits == 8 else f'pcm_s{bits}le'
+
+
+def _read_exact(stream, size):
+    data = b''
+    while len(data) < size:
+        chunk = stream.read(size - len(data))
+        if not chunk:
+            raise RuntimeError("Unexpected end of decoded audio stream.")
+        data += chunk
+    return data
+
+
+def _read_wav_header(stream, raw=None):
+    """
+    Consumes a WAV header from a pipe and returns (channels, sample_width,
+    frame_rate). The header bytes are appended to raw when it is a list.
+    """
+    if raw is None:
+        raw = []
+    riff = _read_exact(stream, 12)
+    raw.append(riff)
+    if riff[:4] != b'RIFF' or riff[8:12] != b'WAVE':
+        raise RuntimeError("Decoder did not produce WAV data.")
+    fmt = None
+    while True:
+        chunk_header = _read_exact(stream, 8)
+        raw.append(chunk_header)
+        chunk_id, chunk_size = struct.unpack('<4sI', chunk_header)
+        if chunk_id == b'data':
+            break
+        body = _read_exact(stream, chunk_size + (chunk_size & 1))
+        raw.append(body)
+        if chunk_id == b'fmt ':
+            fmt = struct.unpack('<HHIIHH', body[:16])
+    if fmt is None:
+        raise RuntimeError("Decoded WAV stream has no format chunk.")
+    _, channels, frame_rate, _, _, bits = fmt
+    return channels, bits // 8, frame_rate
+
+
+def _decoder_command(input_path):
+    # pydub's in-memory path drops the source tags; without -map_metadata the WAV muxer would pass them on
+    return ffmpeg_command('-i', input_path, '-map_metadata', '-1', '-acodec', pcm_codec_for(input_path), '-vn',
+                          '-f', 'wav', 'pipe:1')
+
+
+def _check(process, stderr, what):
+    if process.returncode != 0:
+        message = stderr.decode('utf-8', 'replace').strip() if stderr else ''
+        raise RuntimeError(f"ffmpeg {what} failed: {message or f'exit code {process.returncode}'}")
+
+
+def stream_transcode(input_path, output_path, output_format=None):
+    """
+    Transcodes input_path to output_path without ever holding more than a
+    pipe buffer of PCM in memory. output_format defaults to the output
+    extension.
+    """
+    if output_format is None:
+        output_format = os.path.splitext(output_path)[1][1:].lower()
+    duration = progress_duration(input_path)
+    # stderr goes to files that are read once the process exits; a source
+    # that logs more than a pipe buffer of errors would otherwise stall ffmpeg
+    decoder_log = tempfile.TemporaryFile()
+    encoder_log = None
+    encoder = None
+    try:
+        decoder = subprocess.Popen(_decoder_command(input_path),
+                                   stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=decoder_log)
+        try:
+            if output_format == 'wav':
+                _relay_to_wav(decoder.stdout, output_path, duration)
+            else:
+                command = _encoder_command(output_path, output_format, progress=bool(duration))
+                encoder_log = tempfile.TemporaryFile()
+                # The encoder reads straight from the decoder's stdout; no copy passes through Python.
+                encoder = subprocess.Popen(command, stdin=decoder.stdout,
+                                           stdout=subprocess.PIPE if duration else subprocess.DEVNULL,
+                                           stderr=encoder_log)
+                decoder.stdout.close()
+                if duration:
+                    follow_progress(encoder.stdout, duration)
+                    encoder.stdout.close()
+                encoder.wait()
+            decoder.wait()
+        except BaseException:
+            for process in (decoder, encoder):
+                if process is not None:
+                    process.kill()
+                    process.wait()
+            raise
+        _check(decoder, _read_log(decoder_log), "decoder")
+        if encoder is not None:
+            _check(encoder, _read_log(encoder_log), "encoder")
+    finally:
+        for log in (decoder_log, encoder_log):
+            if log is not None:
+                log.close()
+
+
+def _read_log(log):
+    log.seek(0)
+    return log.read()
+
+
+def _encoder_command(output_path, output_format, progress=False):
+    # With progress, the encoder reports how much of the stream it has written on its stdout
+    command = ffmpeg_command(*(('-progress', 'pipe:1', '-nostats') if progress else ()),
+                             '-f', 'wav', '-i', 'pipe:0', '-map_metadata', '-1')
+    codec = DEFAULT_CODECS.get(output_format)
+    if codec is not None:
+        command += ['-acodec', codec]
+    return command + ['-f', output_format, output_path]
+
+
+def stream_transcode_many(input_path, output_paths):
+    """
+    Transcodes input_path to every path in output_paths from a single decode
+    and returns one exception (or None) per output path. A target whose
+    encoder fails does not stop the others.
+    """
+    errors = [None] * len(output_paths)
+    duration = progress_duration(input_path)
+    decoder_log = tempfile.TemporaryFile()
+    decoder = subprocess.Popen(_decoder_command(input_path),
+                               stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=decoder_log)
+    encoders = {}
+    wav_outputs = {}
+    try:
+        raw = []
+        channels, sample_width, frame_rate = _read_wav_header(decoder.stdout, raw)
+        header = b''.join(raw)
+        expected_bytes = duration * frame_rate * channels * sample_width if duration else None
+        relayed = 0
+        for number, output_path in enumerate(output_paths):
+            output_format = os.path.splitext(output_path)[1][1:].lower()
+            if output_format == 'wav':
+                out = wave.open(output_path, 'wb')
+                out.setnchannels(channels)
+                out.setsampwidth(sample_width)
+                out.setframerate(frame_rate)
+                wav_outputs[number] = out
+                continue
+            # stderr goes to a file: nothing reads it until the end, and a
+            # full pipe would stall the encoder and with it every other target
+            stderr = tempfile.TemporaryFile()
+            encoder = subprocess.Popen(_encoder_command(output_path, output_format), stdin=subprocess.PIPE,
+                                       stdout=subprocess.DEVNULL, stderr=stderr)
+            encoders[number] = (encoder, stderr)
+        live = dict(encoders)
+        for number, (encoder, _) in list(live.items()):
+            try:
+                encoder.stdin.write(header)
+            except BrokenPipeError:
+                del live[number]
+        while True:
+            chunk = decoder.stdout.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            relayed += len(chunk)
+            if expected_bytes:
+                report_progress(relayed / expected_bytes)
+            for out in wav_outputs.values():
+                out.writeframesraw(chunk)
+            for number, (encoder, _) in list(live.items()):
+                try:
+                    encoder.stdin.write(chunk)
+                except BrokenPipeError:
+                    # The encoder exited early; its error is read below
+                    del live[number]
+        decoder.wait()
+    except BaseException:
+        decoder.kill()
+        decoder.wait()
+        decoder_log.close()
+        for encoder, stderr in encoders.values():
+            encoder.kill()
+            encoder.wait()
+            stderr.close()
+        for out in wav_outputs.values():
+            out.close()
+        raise
+    for out in wav_outputs.values():
+        out.close()
+    for number, (encoder, stderr) in encoders.items():
+        try:
+            encoder.stdin.close()
+        except BrokenPipeError:
+            pass
+        encoder.wait()
+        try:
+            _check(encoder, _read_log(stderr), "encoder")
+        except RuntimeError as e:
+            errors[number] = e
+        finally:
+            stderr.close()
+    try:
+        _check(decoder, _read_log(decoder_log), "decoder")
+    except RuntimeError as e:
+        errors = [e] * len(output_paths)
+    finally:
+        decoder_log.close()
+    return errors
+
+
+def _relay_to_wav(stream, output_path, duration=None):
+    # pydub writes WAV output with the wave module, so do the same chunk by chunk
+    channels, sample_width, frame_rate = _read_wav_header(stream)
+    expected_bytes = duration * frame_rate * channels * sample_width if duration else None
+    relayed = 0
+    with wave.open(output_path, 'wb') as out:
+        out.setnchannels(channels)
+        out.setsampwidth(sample_width)
+        out.setframerate(frame_rate)
+        while True:
+            chunk = stream.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            out.writeframesraw(chunk)
+            relayed += len(chunk)
+            if expected_bytes:
+                report_progress(relayed / expected_bytes)
@@ -0,0 +1,403 @@
+"""
+Performance benchmarks for every supported conversion.
+
+    python -m benchmark --size small --output bench.json
+    python -m benchmark --size small --compare bench.json
+
+Fixtures are synthesized locally (text, DOCX, PDF, images, and audio/video
+through FFmpeg's built-in generators) and cached per size preset. Every
+(input, output) pair from get_supported_formats() is converted in a fresh
+child process, so the reported peak RSS belongs to that conversion alone.
+Results are written as JSON; --compare flags pairs that became slower or
+bigger than a stored baseline and exits with status 1.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+EXIT_OK = 0
+EXIT_REGRESSIONS = 1
+EXIT_USAGE = 2
+
+SIZES = {
+    'small': {'text_mb': 1, 'docx_paragraphs': 300, 'pdf_pages': 5, 'image_mp': 1,
+              'audio_seconds': 10, 'video_seconds': 4},
+    'medium': {'text_mb': 32, 'docx_paragraphs': 5000, 'pdf_pages': 40, 'image_mp': 16,
+               'audio_seconds': 180, 'video_seconds': 30},
+    'large': {'text_mb': 512, 'docx_paragraphs': 50000, 'pdf_pages': 200, 'image_mp': 100,
+              'audio_seconds': 1800, 'video_seconds': 180},
+}
+SEED = 1234
+DEFAULT_TOLERANCE = 0.15
+# Differences below this are treated as timer noise
+MIN_SECONDS_DELTA = 0.05
+MIN_RSS_DELTA_MB = 5
+
+_WORDS = ('lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor '
+          'incididunt ut labore et dolore magna aliqua convert format pixel frame sample').split()
+
+
+def default_fixture_dir(size):
+    from conversion_cache import default_cache_dir
+    return os.path.join(default_cache_dir(), 'bench-fixtures', size)
+
+
+def _text_lines(rng):
+    while True:
+        yield ' '.join(rng.choice(_WORDS) for _ in range(rng.randint(4, 30))) + '\n'
+
+
+def make_text(path, size_mb):
+    rng = random.Random(SEED)
+    target = int(size_mb * 1024 * 1024)
+    written = 0
+    with open(path, 'w', encoding='utf-8', newline='\n') as f:
+        lines = _text_lines(rng)
+        while written < target:
+            chunk = ''.join(next(lines) for _ in range(2000))
+            f.write(chunk)
+            written += len(chunk)
+
+
+def make_docx(path, paragraphs):
+    from docx import Document
+    rng = random.Random(SEED)
+    lines = _text_lines(rng)
+    document = Document()
+    document.add_heading('Benchmark document', 0)
+    for index in range(paragraphs):
+        if index % 100 == 0:
+            document.add_heading(f'Section {index // 100 + 1}', 1)
+        document.add_paragraph(next(lines).strip() + ' ' + next(lines).strip())
+        if index % 250 == 125:
+            table = document.add_table(rows=4, cols=3)
+            for row in table.rows:
+                for cell in row.cells:
+                    cell.text = next(lines).strip()
+    document.save(path)
+
+
+def make_pdf(path, pages):
+    from text_pdf_engine import convert_text_to_pdf
+    rng = random.Random(SEED)
+    lines = _text_lines(rng)
+    source = path + '.txt'
+    with open(source, 'w', encoding='utf-8') as f:
+        for _ in range(pages * 41):
+            f.write(next(lines))
+    try:
+        convert_text_to_pdf(source, path, {'text_pdf_workers': 1})
+    finally:
+        os.remove(source)
+
+
+def make_image(path, megapixels):
+    from PIL import Image
+    width = int((megapixels * 1_000_000 * 4 / 3) ** 0.5)
+    height = int(megapixels * 1_000_000 / width)
+    # Deterministic detail in every channel so encoders cannot shortcut flat areas
+    fractal = Image.effect_mandelbrot((width, height), (-2.0, -1.25, 1.0, 1.25), 64)
+    gradient = Image.linear_gradient('L').resize((width, height))
+    noise = Image.effect_noise((width, height), 32)
+    image = Image.merge('RGB', (fractal, gradient, noise))
+    if path.lower().endswith('.gif'):
+        image = image.quantize(256)
+    image.save(path)
+
+
+def make_audio(path, seconds, source_wav):
+    from ffmpeg_tools import run_ffmpeg
+    if not os.path.exists(source_wav):
+        run_ffmpeg('-f', 'lavfi', '-i', f'sine=frequency=440:sample_rate=44100:duration={seconds}',
+                   '-f', 'lavfi', '-i', f'anoisesrc=color=pink:sample_rate=44100:duration={seconds}:seed={SEED}',
+                   '-filter_complex', '[0:a][1:a]amerge=inputs=2[a]', '-map', '[a]',
+                   '-c:a', 'pcm_s16le', source_wav)
+    if path != source_wav:
+        run_ffmpeg('-i', source_wav, path)
+
+
+def make_video(path, seconds):
+    from ffmpeg_tools import run_ffmpeg
+    from video_engine import TARGET_ENCODERS
+    video_encoder, audio_encoder = TARGET_ENCODERS.get(os.path.splitext(path)[1].lower(), ('libx264', 'aac'))
+    run_ffmpeg('-f', 'lavfi', '-i', f'testsrc2=size=1280x720:rate=30:duration={seconds}',
+               '-f', 'lavfi', '-i', f'sine=frequency=440:duration={seconds}',
+               '-c:v', video_encoder, '-c:a', audio_encoder, '-shortest', path)
+
+
+def make_fixture(input_ext, fixture_dir, size):
+    """Returns the path of the fixture for input_ext, generating it if needed."""
+    from converter_registry import AUDIO_EXTENSIONS, IMAGE_EXTENSIONS, TEXT_EXTENSIONS, VIDEO_EXTENSIONS
+    params = SIZES[size]
+    path = os.path.join(fixture_dir, 'fixture' + input_ext)
+    if os.path.exists(path):
+        return path
+    os.makedirs(fixture_dir, exist_ok=True)
+    partial = os.path.join(fixture_dir, 'partial' + input_ext)
+    if input_ext in TEXT_EXTENSIONS:
+        if input_ext != '.txt':
+            shutil.copyfile(make_fixture('.txt', fixture_dir, size), partial)
+        else:
+            make_text(partial, params['text_mb'])
+    elif input_ext == '.docx':
+        make_docx(partial, params['docx_paragraphs'])
+    elif input_ext == '.pdf':
+        make_pdf(partial, params['pdf_pages'])
+    elif input_ext == '.xlsx':
+        from spreadsheet_engine import convert_csv_to_xlsx
+        convert_csv_to_xlsx(make_fixture('.csv', fixture_dir, size), partial)
+    elif input_ext in IMAGE_EXTENSIONS:
+        make_image(partial, params['image_mp'])
+    elif input_ext in AUDIO_EXTENSIONS:
+        make_audio(partial, params['audio_seconds'], os.path.join(fixture_dir, 'source.wav'))
+    elif input_ext in VIDEO_EXTENSIONS:
+        make_video(partial, params['video_seconds'])
+    else:
+        raise ValueError(f"No fixture generator for {input_ext}")
+    os.replace(partial, path)
+    return path
+
+
+def _own_peak_kb():
+    # On Linux ru_maxrss survives exec, so a child would report the benchmark
+    # parent's peak; VmHWM belongs to the current address space only.
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def _peak_rss_mb():
+    if resource is None:
+        return None
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    scale = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    own_kb = _own_peak_kb()
+    own = own_kb / 1024 if own_kb is not None else resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale
+    return round(max(own, children), 1)
+
+
+def run_one(input_path, output_path):
+    """Converts one file in this process and returns its measurements."""
+    from file_converter import FileConverter
+    converter = FileConverter()
+    record = {'ok': True, 'error': None}
+    start = time.perf_counter()
+    try:
+        converter.convert(input_path, output_path)
+    except Exception as e:
+        record.update(ok=False, error=str(e))
+    record['seconds'] = round(time.perf_counter() - start, 4)
+    record['output_bytes'] = os.path.getsize(output_path) if os.path.exists(output_path) else 0
+    record['peak_rss_mb'] = _peak_rss_mb()
+    return record
+
+
+def measure(input_path, output_ext, repeat):
+    """Runs the conversion repeat times, each in a fresh interpreter."""
+    runs = []
+    work_dir = tempfile.mkdtemp(prefix='pxbench-')
+    try:
+        output_path = os.path.join(work_dir, 'output' + output_ext)
+        for _ in range(repeat):
+            result = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), '--run-one', input_path, output_path],
+                stdin=subprocess.DEVNULL, capture_output=True, text=True,
+                cwd=os.path.dirname(os.path.abspath(__file__)),
+            )
+            # Some libraries print to stdout on import; the record is the last line
+            lines = result.stdout.strip().splitlines()
+            try:
+                runs.append(json.loads(lines[-1]))
+            except (IndexError, ValueError):
+                runs.append({'ok': False, 'error': result.stderr.strip()[-500:] or 'no result',
+                             'seconds': None, 'output_bytes': 0, 'peak_rss_mb': None})
+            if not runs[-1]['ok']:
+                break
+            os.remove(output_path)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    failed = [run for run in runs if not run['ok']]
+    if failed:
+        return failed[0]
+    rss = [run['peak_rss_mb'] for run in runs if run['peak_rss_mb'] is not None]
+    return {
+        'ok': True,
+        'error': None,
+        'seconds': round(statistics.median(run['seconds'] for run in runs), 4),
+        'output_bytes': runs[-1]['output_bytes'],
+        'peak_rss_mb': max(rss) if rss else None,
+    }
+
+
+def selected_pairs(supported_formats, only=None):
+    pairs = []
+    for category, entries in supported_formats.items():
+        for input_ext, targets in entries.items():
+            for output_ext in targets:
+                if only and not any(_matches(pattern, category, input_ext, output_ext) for pattern in only):
+                    continue
+                pairs.append((category, input_ext, output_ext))
+    return pairs
+
+
+def _matches(pattern, category, input_ext, output_ext):
+    pattern = pattern.lower()
+    if ':' in pattern:
+        source, target = pattern.split(':', 1)
+        return source in ('', input_ext) and target in ('', output_ext)
+    return pattern in (category.lower(), input_ext)
+
+
+def run_benchmarks(size, fixture_dir, repeat=1, only=None, log=None):
+    from file_converter import FileConverter
+    from utils import get_supported_formats
+    log = log or (lambda message: None)
+    results = []
+    for category, input_ext, output_ext in selected_pairs(get_supported_formats(), only):
+        record = {'category': category, 'input': input_ext, 'output': output_ext}
+        try:
+            input_path = make_fixture(input_ext, fixture_dir, size)
+        except Exception as e:
+            record.update(ok=False, skipped=True, error=f"fixture: {e}")
+            log(f"{input_ext} -> {output_ext}: skipped ({e})")
+            results.append(record)
+            continue
+        input_bytes = os.path.getsize(input_path)
+        record['input_bytes'] = input_bytes
+        record.update(measure(input_path, output_ext, repeat))
+        if record['ok'] and record['seconds']:
+            record['mb_per_s'] = round(input_bytes / (1024 * 1024) / record['seconds'], 3)
+            record['files_per_s'] = round(1 / record['seconds'], 3)
+            log(f"{input_ext} -> {output_ext}: {record['seconds']:.3f}s "
+                f"{record['mb_per_s']:.2f} MB/s {record['peak_rss_mb']} MB RSS")
+        else:
+            log(f"{input_ext} -> {output_ext}: failed ({record['error']})")
+        results.append(record)
+    return {
+        'meta': {
+            'size': size,
+            'params': SIZES[size],
+            'repeat': repeat,
+            'converter_version': FileConverter.VERSION,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        },
+        'results': results,
+    }
+
+
+def compare(current, baseline, tolerance=DEFAULT_TOLERANCE):
+    """
+    Returns a list of regression records for pairs that are slower, use more
+    memory, or fail where the baseline succeeded.
+    """
+    previous = {(r['input'], r['output']): r for r in baseline.get('results', [])}
+    regressions = []
+    for record in current.get('results', []):
+        key = (record['input'], record['output'])
+        before = previous.get(key)
+        if before is None or not before.get('ok'):
+            continue
+        if not record.get('ok'):
+            if not record.get('skipped'):
+                regressions.append({'input': key[0], 'output': key[1], 'metric': 'ok',
+                                    'baseline': True, 'current': False, 'error': record.get('error')})
+            continue
+        checks = [('seconds', MIN_SECONDS_DELTA), ('peak_rss_mb', MIN_RSS_DELTA_MB)]
+        for metric, min_delta in checks:
+            old, new = before.get(metric), record.get(metric)
+            if old is None or new is None:
+                continue
+            if new > old * (1 + tolerance) and new - old > min_delta:
+                regressions.append({'input': key[0], 'output': key[1], 'metric': metric,
+                                    'baseline': old, 'current': new,
+                                    'change': round(new / old - 1, 3) if old else None})
+    return regressions
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="benchmark",
+        description="Benchmark every supported conversion on synthetic fixtures.",
+    )
+    parser.add_argument("--size", choices=sorted(SIZES), default="small", help="Fixture size preset.")
+    parser.add_argument("--output", "-o", help="Write the JSON results to this file (default: stdout).")
+    parser.add_argument("--compare", metavar="BASELINE",
+                        help="Compare against a stored results file and exit 1 on regressions.")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help="Allowed relative slowdown or memory growth (default 0.15).")
+    parser.add_argument("--repeat", type=int, default=1,
+                        help="Runs per pair; the median time is reported.")
+    parser.add_argument("--only", action="append",
+                        help="Limit to a category, an input extension or a pair like .png:.jpg (repeatable).")
+    parser.add_argument("--fixtures", help="Fixture directory (default: inside the cache directory).")
+    parser.add_argument("--run-one", nargs=2, metavar=("INPUT", "OUTPUT"), help=argparse.SUPPRESS)
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+
+    if args.run_one:
+        print(json.dumps(run_one(*args.run_one)))
+        return EXIT_OK
+    if args.repeat < 1:
+        parser.error("--repeat must be at least 1")
+
+    baseline = None
+    if args.compare:
+        try:
+            with open(args.compare, 'r', encoding='utf-8') as f:
+                baseline = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"benchmark: cannot read baseline {args.compare}: {e}", file=sys.stderr)
+            return EXIT_USAGE
+
+    fixture_dir = args.fixtures or default_fixture_dir(args.size)
+    report = run_benchmarks(args.size, fixture_dir, args.repeat, args.only,
+                            log=lambda message: print(f"benchmark: {message}", file=sys.stderr))
+
+    status = EXIT_OK
+    if baseline is not None:
+        report['regressions'] = compare(report, baseline, args.tolerance)
+        for regression in report['regressions']:
+            print(f"benchmark: REGRESSION {regression['input']} -> {regression['output']} "
+                  f"{regression['metric']}: {regression['baseline']} -> {regression['current']}",
+                  file=sys.stderr)
+        print(f"benchmark: {len(report['regressions'])} regressions against {args.compare}", file=sys.stderr)
+        if report['regressions']:
+            status = EXIT_REGRESSIONS
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,190 @@
+import hashlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+DEFAULT_MAX_MB = 2048
+DEFAULT_MAX_BYTES = DEFAULT_MAX_MB * 1024 * 1024
+HASH_CHUNK_SIZE = 1024 * 1024
+# Linux FICLONE ioctl: share the source extents instead of copying data (btrfs, xfs, ...)
+_FICLONE = 0x40049409
+
+
+def default_cache_dir():
+    if sys.platform == 'win32':
+        base = os.environ.get('LOCALAPPDATA') or os.path.expanduser('~')
+    else:
+        base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'px-converter-pro')
+
+
+def cache_from_settings(settings_manager):
+    """Returns the ConversionCache configured in settings, or None if it is disabled."""
+    if not settings_manager.get('cache_enabled', True):
+        return None
+    return ConversionCache(
+        settings_manager.get('cache_dir') or None,
+        int(settings_manager.get('cache_max_mb', DEFAULT_MAX_MB)) * 1024 * 1024,
+        settings_manager.get('cache_link_mode', 'auto'),
+    )
+
+
+def hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(HASH_CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def make_key(content_hash, output_ext, version, options=None):
+    payload = json.dumps({
+        'content': content_hash,
+        'to': output_ext.lower(),
+        'version': version,
+        'options': options or {},
+    }, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def _reflink(source, destination):
+    import fcntl
+    with open(source, 'rb') as src, open(destination, 'wb') as dst:
+        fcntl.ioctl(dst.fileno(), _FICLONE, src.fileno())
+
+
+def link_file(source, destination, link_mode='auto'):
+    """
+    Materialises source at destination. link_mode is one of:
+      - "auto": reflink when the filesystem supports it, otherwise copy
+      - "reflink", "hardlink" or "copy": use only that method, falling back to a copy
+    Hard links share the cache entry's inode, so they are only used on request.
+    """
+    if os.path.lexists(destination):
+        os.remove(destination)
+    if link_mode in ('auto', 'reflink') and sys.platform.startswith('linux'):
+        try:
+            _reflink(source, destination)
+            return 'reflink'
+        except OSError:
+            if os.path.lexists(destination):
+                os.remove(destination)
+    if link_mode == 'hardlink':
+        try:
+            os.link(source, destination)
+            return 'hardlink'
+        except OSError:
+            # e.g. cache and output on different filesystems
+            pass
+    shutil.copyfile(source, destination)
+    return 'copy'
+
+
+class ConversionCache:
+    """
+    Persistent, content-addressed store of converted outputs.
+
+    Entries are keyed by the input's SHA-256, the target extension and the
+    converter version/options, and live in objects/<xx>/<key><ext>. The
+    modification time of an entry is bumped on every hit, so eviction drops
+    the least recently used entries once the cache grows past max_bytes.
+    """
+
+    def __init__(self, cache_dir=None, max_bytes=DEFAULT_MAX_BYTES, link_mode='auto'):
+        self.cache_dir = cache_dir or default_cache_dir()
+        self.objects_dir = os.path.join(self.cache_dir, 'objects')
+        self.max_bytes = max_bytes
+        self.link_mode = link_mode
+        self.hits = 0
+        self.misses = 0
+        self._total_bytes = None
+
+    def _object_path(self, key, output_ext):
+        return os.path.join(self.objects_dir, key[:2], key + output_ext.lower())
+
+    def lookup(self, key, output_ext):
+        path = self._object_path(key, output_ext)
+        if os.path.exists(path):
+            self.hits += 1
+            os.utime(path)
+            return path
+        self.misses += 1
+        return None
+
+    def materialize(self, key, output_ext, output_path):
+        """Returns True if the cached output was placed at output_path."""
+        path = self.lookup(key, output_ext)
+        if path is None:
+            return False
+        link_file(path, output_path, self.link_mode)
+        return True
+
+    def store(self, key, output_path):
+        _, output_ext = os.path.splitext(output_path)
+        path = self._object_path(key, output_ext)
+        if os.path.exists(path):
+            return path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        os.close(fd)
+        try:
+            # Never hard-link into the cache: editing the output would corrupt the entry
+            link_file(output_path, tmp_path, 'auto')
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        if self._total_bytes is not None:
+            self._total_bytes += os.path.getsize(path)
+        self.evict()
+        return path
+
+    def _entries(self):
+        entries = []
+        if not os.path.isdir(self.objects_dir):
+            return entries
+        for bucket in os.scandir(self.objects_dir):
+            if not bucket.is_dir():
+                continue
+            for entry in os.scandir(bucket.path):
+                if entry.is_file() and not entry.name.endswith('.tmp'):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    def evict(self):
+        if self._total_bytes is not None and self._total_bytes <= self.max_bytes:
+            return
+        entries = self._entries()
+        self._total_bytes = sum(size for _, size, _ in entries)
+        if self._total_bytes <= self.max_bytes:
+            return
+        for _, size, path in sorted(entries):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self._total_bytes -= size
+            if self._total_bytes <= self.max_bytes:
+                break
+
+    def clear(self):
+        if os.path.isdir(self.objects_dir):
+            shutil.rmtree(self.objects_dir)
+        self._total_bytes = 0
+
+    def stats(self):
+        entries = self._entries()
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'entries': len(entries),
+            'bytes': sum(size for _, size, _ in entries),
+            'max_bytes': self.max_bytes,
+        }
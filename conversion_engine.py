@@ -0,0 +1,613 @@
+import glob
+import multiprocessing
+import os
+import shutil
+import signal
+import tempfile
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from conversion_cache import hash_file, link_file, make_key
+from conversion_metrics import MetricsSummary, base_record, measure_conversion, measure_fanout
+from converter_registry import get_fanout_backend
+from file_converter import FileConverter
+from format_sniffer import resolve_format
+from job_scheduler import JobScheduler, estimate_cost
+from utils import get_supported_formats
+
+# Video jobs already spawn ffmpeg processes of their own, so by default only a
+# couple of them run side by side. Every other category is bounded by the
+# overall worker count alone.
+DEFAULT_CATEGORY_LIMITS = {"Video": 2}
+# How often the pool path looks at progress, timeouts and cancel requests
+POLL_SECONDS = 0.2
+
+_IN_FLIGHT = object()
+
+
+def get_category(input_path, supported_formats=None):
+    """
+    Returns the category name (Images, Audio, Video, Documents) for a file,
+    or "Other" if its detected format is not listed in the supported formats.
+    """
+    if supported_formats is None:
+        supported_formats = get_supported_formats()
+    ext = resolve_format(input_path)
+    for category, formats in supported_formats.items():
+        if ext in formats:
+            return category
+    return "Other"
+
+
+def build_output_path(input_path, output_format, output_directory):
+    base_name = os.path.basename(input_path)
+    output_filename = f"{os.path.splitext(base_name)[0]}{output_format}"
+    return os.path.join(output_directory, output_filename)
+
+
+class ConversionResult:
+    def __init__(self, index, input_path, output_path, error=None, cached=False, metrics=None):
+        self.index = index
+        self.input_path = input_path
+        self.output_path = output_path
+        self.error = error
+        # True when the output was reused from the cache or an identical job
+        self.cached = cached
+        # Per-job record from conversion_metrics
+        self.metrics = metrics
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    def to_dict(self):
+        return {
+            "input": self.input_path,
+            "output": self.output_path,
+            "ok": self.ok,
+            "cached": self.cached,
+            "error": self.error,
+            "metrics": self.metrics,
+        }
+
+
+class _Job:
+    def __init__(self, index, input_path, output_format, output_path, category):
+        self.index = index
+        self.input_path = input_path
+        self.output_format = output_format
+        self.output_path = output_path
+        self.category = category
+        # Content-derived key; jobs sharing a key produce identical output
+        self.key = None
+        # Other targets of the same input, converted from this job's decode
+        self.fanout = []
+        # Estimated peak memory and run time of the job with its fan-out (see job_scheduler)
+        self.memory_mb = 0.0
+        self.cpu_seconds = 0.0
+
+
+# Each pool process keeps a single FileConverter for its whole lifetime.
+_worker_converter = None
+# Shared with the parent, one slot per job: the fraction done and the pid of
+# the process running it. Plain shared memory without locks, so killing a
+# worker halfway through an update cannot block anyone else.
+_worker_progress = None
+_worker_pids = None
+
+
+def _init_worker(converter_options, progress=None, pids=None):
+    global _worker_converter, _worker_progress, _worker_pids
+    _worker_converter = FileConverter(converter_options)
+    _worker_progress = progress
+    _worker_pids = pids
+    if hasattr(os, 'setpgid'):
+        # A process group of its own, so killing a job also kills the ffmpeg
+        # (or nested pool) processes it started
+        os.setpgid(0, 0)
+
+
+def _job_progress(token):
+    _worker_pids[token] = os.getpid()
+
+    def report(fraction):
+        _worker_progress[token] = fraction
+    return report
+
+
+def _convert_job(token, input_path, output_path):
+    return measure_conversion(_worker_converter, input_path, output_path, _job_progress(token))
+
+
+def _convert_fanout_job(token, input_path, output_paths):
+    return measure_fanout(_worker_converter, input_path, output_paths, _job_progress(token))
+
+
+def _kill_worker(pid):
+    try:
+        if hasattr(os, 'killpg'):
+            os.killpg(pid, signal.SIGKILL)
+        else:
+            # Windows: child processes of the worker are not reached
+            os.kill(pid, signal.SIGTERM)
+    except OSError:
+        pass
+
+
+def _remove_partial_outputs(output_paths, pid):
+    """
+    Deletes what a killed worker left behind: half-written outputs and its
+    scratch directories, which backends name after the worker's pid
+    (.pxconvert-<pid>-* next to the output, pxconvert-chain-<pid>-* for
+    conversion chains).
+    """
+    leftovers = []
+    for output_path in output_paths:
+        leftovers.append(output_path)
+        directory = os.path.dirname(os.path.abspath(output_path))
+        leftovers.extend(glob.glob(os.path.join(directory, f'.pxconvert-{pid}-*')))
+    for directory in {'/dev/shm', tempfile.gettempdir()}:
+        leftovers.extend(glob.glob(os.path.join(directory, f'pxconvert-chain-{pid}-*')))
+    for path in leftovers:
+        try:
+            if os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+            elif os.path.lexists(path):
+                os.remove(path)
+        except OSError as e:
+            print(f"Could not remove {path}: {e}")
+
+
+def _failed_outcomes(group, error, error_class):
+    outcomes = []
+    for member in group:
+        metrics = base_record(member.input_path, member.output_path, 'failed', error)
+        metrics['error_class'] = error_class
+        outcomes.append((error, metrics))
+    return outcomes
+
+
+class _PoolRun:
+    """One executor of a ConversionPool and whether a job on it was killed on purpose."""
+
+    def __init__(self, executor):
+        self.executor = executor
+        self.killed = False
+
+
+class ConversionPool:
+    """
+    A spawn process pool of FileConverter workers for callers that schedule
+    jobs themselves, like ConversionEngine and conversion_server. Each job
+    runs in one of `slots` slots, through which the worker shares its
+    progress and pid, so the caller can poll either without locking.
+
+    kill() stops a job together with its child processes. That breaks the
+    pool: every job on it then fails with BrokenProcessPool, and broken()
+    cleans up after each of them, starts a fresh pool and tells the caller
+    whether the job only went down with a killed one and should run again.
+    """
+
+    def __init__(self, converter_options, slots, max_workers=None):
+        self.converter_options = dict(converter_options or {})
+        self.max_workers = max_workers or slots
+        self._context = multiprocessing.get_context("spawn")
+        self.progress = self._context.RawArray('d', slots)
+        self.pids = self._context.RawArray('q', slots)
+        self._runs = [None] * slots
+        self._run = None
+        self.restart()
+
+    def restart(self):
+        if self._run is not None:
+            self._run.executor.shutdown(wait=False, cancel_futures=True)
+        self._run = _PoolRun(ProcessPoolExecutor(max_workers=self.max_workers, mp_context=self._context,
+                                                 initializer=_init_worker,
+                                                 initargs=(self.converter_options, self.progress, self.pids)))
+
+    @property
+    def killed(self):
+        """True when a job on the current pool was killed, which leaves it broken."""
+        return self._run.killed
+
+    def shutdown(self, wait=True):
+        self._run.executor.shutdown(wait=wait, cancel_futures=True)
+
+    def submit(self, slot, input_path, output_paths):
+        """
+        Converts input_path in slot and returns a concurrent.futures.Future.
+        output_paths is one path, or a list of paths for a fan-out job.
+        """
+        self.progress[slot] = 0.0
+        self.pids[slot] = 0
+        self._runs[slot] = self._run
+        if isinstance(output_paths, str):
+            return self._run.executor.submit(_convert_job, slot, input_path, output_paths)
+        return self._run.executor.submit(_convert_fanout_job, slot, input_path, list(output_paths))
+
+    def started(self, slot):
+        """True once a worker has picked up the job in slot."""
+        return self.pids[slot] != 0
+
+    def kill(self, slot):
+        """Kills the job in slot; returns False if no worker has picked it up yet."""
+        pid = self.pids[slot]
+        if not pid:
+            return False
+        self._runs[slot].killed = True
+        _kill_worker(pid)
+        return True
+
+    def clean_up(self, slot, output_paths):
+        """Kills whatever is left of the job in slot and removes its partial outputs."""
+        pid = self.pids[slot]
+        if pid:
+            _kill_worker(pid)
+            _remove_partial_outputs(output_paths, pid)
+
+    def broken(self, slot, output_paths):
+        """
+        Handles a BrokenProcessPool from the job in slot. Returns True when
+        the pool broke because a job was killed on purpose.
+        """
+        run = self._runs[slot]
+        if run is self._run:
+            self.restart()
+        # The pool terminated the worker, but not the processes it started
+        self.clean_up(slot, output_paths)
+        return run.killed
+
+
+class ConversionEngine:
+    """
+    Runs a batch of (input_path, output_format) jobs either in-process, one
+    after another, or on a process pool. Both paths go through the same
+    FileConverter, so their outputs are identical.
+
+    Jobs whose input content and target format match are converted once per
+    batch; with a ConversionCache they are also reused across batches. Jobs
+    that convert the same input to different formats of a fan-out capable
+    backend run as one task that decodes the input once.
+
+    Every result carries a metrics record. Records are appended to
+    metrics_log when one is given and aggregated in self.summary.
+
+    On the pool, jobs start longest first, and only while their estimated
+    memory fits in memory_budget_mb next to the jobs already running (see
+    job_scheduler); self.summary then reports queue depth and budget use.
+
+    On the pool, a job that runs longer than job_timeout seconds is killed
+    together with its child processes, its partial output is removed and it
+    fails with a TimeoutError. cancel() does the same to every running job.
+    A cancellable engine (or one with a timeout) always uses the pool, since
+    only a separate process can be stopped in the middle of a file.
+    """
+
+    def __init__(self, output_directory, max_workers=1, category_limits=None,
+                 cache=None, converter_options=None, metrics_log=None, job_timeout=None, cancellable=False,
+                 memory_budget_mb=None):
+        self.output_directory = output_directory
+        self.max_workers = max(1, int(max_workers or 1))
+        self.category_limits = dict(DEFAULT_CATEGORY_LIMITS)
+        if category_limits:
+            self.category_limits.update(category_limits)
+        self.cache = cache
+        self.converter_options = dict(converter_options or {})
+        self.metrics_log = metrics_log
+        self.job_timeout = float(job_timeout) if job_timeout else None
+        self.cancellable = cancellable
+        # None or 0: half of the physical memory
+        self.memory_budget_mb = memory_budget_mb or None
+        self.summary = MetricsSummary()
+        self.supported_formats = get_supported_formats()
+        self._cancelled = False
+
+    def cancel(self):
+        """
+        Stops the current run, or the next one if none is running: running
+        jobs are killed and their partial outputs removed, and no further job
+        starts. May be called from any thread. Only a cancellable engine can
+        stop a job halfway; otherwise the run ends once the current job is
+        done.
+        """
+        self._cancelled = True
+
+    def run(self, jobs, on_started=None, on_result=None, should_stop=None, on_progress=None):
+        """
+        Converts every (input_path, output_format) job and returns the results
+        in job order. A job may carry its output path as a third item;
+        otherwise it goes to the output directory. on_started is
+        called as on_started(index, total, input_path) when a job begins and
+        on_result as on_result(result, completed, total) when it ends.
+        on_progress(index, fraction) reports how far a running job has got,
+        for backends that can tell.
+        Jobs that were never started because should_stop() returned True, and
+        jobs killed by cancel(), are left out of the returned list.
+        """
+        if should_stop is None:
+            should_stop = lambda: False
+        jobs = [
+            _Job(index, job[0], job[1],
+                 job[2] if len(job) > 2 else build_output_path(job[0], job[1], self.output_directory),
+                 get_category(job[0], self.supported_formats))
+            for index, job in enumerate(jobs)
+        ]
+        self._assign_keys(jobs)
+        self._on_started = on_started
+        self._on_result = on_result
+        self._on_progress = on_progress
+        self._total = len(jobs)
+        jobs = self._group_fanout(jobs)
+        self._results = []
+        self.summary = MetricsSummary()
+        self._leaders = {}
+        self._followers = {}
+        isolated = self.cancellable or self.job_timeout is not None
+        try:
+            if not isolated and (self.max_workers == 1 or len(jobs) <= 1):
+                self._run_serial(jobs, should_stop)
+            elif jobs:
+                self._run_parallel(jobs, should_stop)
+        finally:
+            # Cleared when the run ends, not when it starts, so a cancel() made just before is not lost
+            self._cancelled = False
+        return sorted(self._results, key=lambda result: result.index)
+
+    def _assign_keys(self, jobs):
+        # Without a cache only jobs that could be duplicates (same size and
+        # target) are worth hashing.
+        if self.cache is None:
+            groups = {}
+            for job in jobs:
+                try:
+                    size = os.path.getsize(job.input_path)
+                except OSError:
+                    continue
+                groups.setdefault((size, job.output_format), []).append(job)
+            candidates = [job for group in groups.values() if len(group) > 1 for job in group]
+        else:
+            candidates = jobs
+        hashes = {}
+        for job in candidates:
+            path = os.path.realpath(job.input_path)
+            try:
+                if path not in hashes:
+                    hashes[path] = hash_file(path)
+            except OSError:
+                continue
+            job.key = make_key(hashes[path], job.output_format, FileConverter.VERSION,
+                               FileConverter.cache_options(self.converter_options, job.output_format))
+
+    def _group_fanout(self, jobs):
+        """Moves every job that can share an earlier job's decode into that job's fanout list."""
+        heads = {}
+        scheduled = []
+        for job in jobs:
+            backend = get_fanout_backend(resolve_format(job.input_path), job.output_format)
+            if backend is not None:
+                group = (os.path.realpath(job.input_path), backend.name)
+                head = heads.get(group)
+                if head is None:
+                    heads[group] = job
+                elif all(member.output_format != job.output_format for member in [head] + head.fanout):
+                    head.fanout.append(job)
+                    continue
+            scheduled.append(job)
+        return scheduled
+
+    def _begin_group(self, job):
+        """Begins job and its fan-out siblings; returns the ones that still have to be converted."""
+        return [member for member in [job] + job.fanout if self._begin(member)]
+
+    def _complete_group(self, group, outcomes):
+        for member, (error, metrics) in zip(group, outcomes):
+            self._complete(member, error, metrics)
+
+    def _begin(self, job):
+        """Announces a job and returns True if it still has to be converted."""
+        if self._on_started:
+            self._on_started(job.index, self._total, job.input_path)
+        if job.key is None:
+            return True
+        leader = self._leaders.get(job.key)
+        if leader is _IN_FLIGHT:
+            self._followers[job.key].append(job)
+            return False
+        if leader is not None:
+            self._finish_follower(job, leader)
+            return False
+        if self.cache is not None and self._materialize(job):
+            result = ConversionResult(job.index, job.input_path, job.output_path, cached=True,
+                                      metrics=base_record(job.input_path, job.output_path, 'cached'))
+            self._leaders[job.key] = result
+            self._record(result)
+            return False
+        self._leaders[job.key] = _IN_FLIGHT
+        self._followers[job.key] = []
+        return True
+
+    def _materialize(self, job):
+        # Treated as a miss; the conversion then fails on its own if the output path is unusable
+        try:
+            return self.cache.materialize(job.key, job.output_format, job.output_path)
+        except OSError as e:
+            print(f"Could not use the cached copy for {job.output_path}: {e}")
+            return False
+
+    def _complete(self, job, error=None, metrics=None):
+        if metrics is None:
+            metrics = base_record(job.input_path, job.output_path, 'failed' if error else 'converted', error)
+        result = ConversionResult(job.index, job.input_path, job.output_path, error, metrics=metrics)
+        if job.key is not None:
+            if result.ok and self.cache is not None:
+                try:
+                    self.cache.store(job.key, job.output_path)
+                except OSError as e:
+                    print(f"Could not cache {job.output_path}: {e}")
+            self._leaders[job.key] = result
+        self._record(result)
+        for follower in self._followers.pop(job.key, []):
+            self._finish_follower(follower, result)
+
+    def _finish_follower(self, job, leader):
+        error = leader.error
+        if error is None and os.path.abspath(job.output_path) != os.path.abspath(leader.output_path):
+            try:
+                link_file(leader.output_path, job.output_path,
+                          self.cache.link_mode if self.cache is not None else 'auto')
+            except OSError as e:
+                error = f"Failed to copy {os.path.basename(leader.output_path)}: {e}"
+        metrics = base_record(job.input_path, job.output_path, 'failed' if error else 'cached', error)
+        self._record(ConversionResult(job.index, job.input_path, job.output_path, error,
+                                      cached=error is None, metrics=metrics))
+
+    def _record(self, result):
+        self._results.append(result)
+        self.summary.add(result.metrics)
+        if self.metrics_log is not None:
+            try:
+                self.metrics_log.append(result.metrics)
+            except OSError as e:
+                print(f"Could not write metrics: {e}")
+        if self._on_result:
+            self._on_result(result, len(self._results), self._total)
+
+    def _report_progress(self, group, fraction):
+        if self._on_progress:
+            for member in group:
+                self._on_progress(member.index, fraction)
+
+    def _run_serial(self, jobs, should_stop):
+        converter = FileConverter(self.converter_options)
+        for job in jobs:
+            if should_stop() or self._cancelled:
+                break
+            group = self._begin_group(job)
+            if not group:
+                continue
+            progress = (lambda fraction, group=group: self._report_progress(group, fraction)) \
+                if self._on_progress else None
+            try:
+                if len(group) == 1:
+                    outcomes = [measure_conversion(converter, job.input_path, group[0].output_path, progress)]
+                else:
+                    outcomes = measure_fanout(converter, job.input_path,
+                                              [member.output_path for member in group], progress)
+            except BaseException:
+                # Interrupted halfway (Ctrl+C): do not leave truncated outputs behind
+                _remove_partial_outputs([member.output_path for member in group], os.getpid())
+                raise
+            self._complete_group(group, outcomes)
+
+    def _run_parallel(self, jobs, should_stop):
+        scheduler = JobScheduler(self.memory_budget_mb, self.category_limits)
+        for job in jobs:
+            job.memory_mb, job.cpu_seconds = estimate_cost(
+                job.input_path, [member.output_format for member in [job] + job.fanout], self.converter_options)
+            scheduler.push(job)
+        self.summary.scheduler = scheduler
+        # Groups whose worker went down with a killed job, to run again first
+        requeued = deque()
+
+        # Slots are indexed by the group's first job index
+        pool = ConversionPool(self.converter_options, self._total, min(self.max_workers, len(jobs)))
+        in_flight = {}
+        try:
+            self._drive_pool(pool, in_flight, scheduler, requeued, should_stop)
+        except BaseException:
+            # Ctrl+C or a failing callback: the workers live in process
+            # groups of their own, so they must not be left running
+            for group in in_flight.values():
+                pool.clean_up(group[0].index, [member.output_path for member in group])
+            raise
+        finally:
+            pool.shutdown()
+
+    def _drive_pool(self, pool, in_flight, scheduler, requeued, should_stop):
+        """Feeds the pool until the work runs out."""
+        started = {}
+        reported = {}
+        while True:
+            while not should_stop() and not self._cancelled and len(in_flight) < self.max_workers:
+                if requeued:
+                    if not scheduler.can_admit(requeued[0][0]):
+                        break
+                    group = requeued.popleft()
+                    scheduler.admit(group[0])
+                else:
+                    job = scheduler.pop()
+                    if job is None:
+                        break
+                    group = self._begin_group(job)
+                    if not group:
+                        scheduler.release(job)
+                        continue
+                    # The reservation is released through the group's first member
+                    group[0].memory_mb = job.memory_mb
+                output_paths = group[0].output_path if len(group) == 1 \
+                    else [member.output_path for member in group]
+                in_flight[pool.submit(group[0].index, group[0].input_path, output_paths)] = group
+
+            if not in_flight:
+                return
+
+            done, _ = wait(in_flight, timeout=POLL_SECONDS, return_when=FIRST_COMPLETED)
+            now = time.monotonic()
+            killed = {}
+            for future, group in in_flight.items():
+                token = group[0].index
+                if future in done:
+                    continue
+                if not pool.started(token):
+                    # Not picked up by a worker yet
+                    if self._cancelled:
+                        future.cancel()
+                    continue
+                started.setdefault(token, now)
+                if pool.progress[token] != reported.get(token):
+                    reported[token] = pool.progress[token]
+                    self._report_progress(group, pool.progress[token])
+                if self._cancelled:
+                    killed[future] = None
+                elif self.job_timeout is not None and now - started[token] > self.job_timeout:
+                    killed[future] = f"Timed out after {self.job_timeout:g} seconds"
+            for future in killed:
+                pool.kill(in_flight[future][0].index)
+            if killed:
+                # A dead worker breaks the whole pool; every other running job
+                # comes back with BrokenProcessPool and is run again
+                wait(in_flight)
+                done = set(in_flight)
+
+            for future in done:
+                group = in_flight.pop(future)
+                token = group[0].index
+                started.pop(token, None)
+                reported.pop(token, None)
+                scheduler.release(group[0])
+                if future.cancelled():
+                    continue
+                output_paths = [member.output_path for member in group]
+                if future in killed and future.exception() is not None:
+                    pool.broken(token, output_paths)
+                    if killed[future] is not None:
+                        self._complete_group(group, _failed_outcomes(group, killed[future], 'TimeoutError'))
+                    continue
+                try:
+                    outcomes = future.result()
+                    if len(group) == 1:
+                        outcomes = [outcomes]
+                except BrokenProcessPool as e:
+                    if pool.broken(token, output_paths):
+                        # Went down with a killed job; run it again
+                        requeued.append(group)
+                        continue
+                    # The pool itself failed (e.g. a worker process died)
+                    outcomes = _failed_outcomes(group, str(e) or type(e).__name__, type(e).__name__)
+                except Exception as e:
+                    outcomes = _failed_outcomes(group, str(e) or type(e).__name__, type(e).__name__)
+                self._complete_group(group, outcomes)
+            if pool.killed:
+                # Every killed job had finished anyway, but its worker is gone
+                pool.restart()
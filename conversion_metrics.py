@@ -0,0 +1,314 @@
+"""
+Per-conversion metrics.
+
+measure_conversion() runs one FileConverter conversion and returns a
+record with the backend, input/output sizes, stage timings, peak memory
+and outcome. Backends mark their decode/encode/write phases with stage();
+time no stage claims (including pipelines such as ffmpeg, where the
+phases overlap) is counted as encode. Backends that can tell how far
+they have got call report_progress() with the fraction done, which the
+engine turns into in-file progress.
+
+MetricsLog appends records to a size-rotated JSON-lines file, and
+MetricsSummary aggregates them into live throughput and latency figures.
+"""
+import json
+import logging
+import logging.handlers
+import os
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+STAGES = ('decode', 'encode', 'write')
+DEFAULT_LOG_MAX_MB = 10
+DEFAULT_LOG_BACKUPS = 3
+# Latency samples kept per format pair for the percentiles
+SUMMARY_WINDOW = 1000
+
+_local = threading.local()
+
+
+@contextmanager
+def stage(name):
+    """Adds the time spent in the block to the current job's stage name."""
+    stages = getattr(_local, 'stages', None)
+    if stages is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        stages[name] = stages.get(name, 0.0) + time.perf_counter() - start
+
+
+def progress_enabled():
+    """True when someone listens to report_progress(), so backends can skip work only it needs."""
+    return getattr(_local, 'progress', None) is not None
+
+
+def report_progress(fraction):
+    """Reports that the current job is fraction (0.0 to 1.0) done."""
+    progress = getattr(_local, 'progress', None)
+    if progress is None:
+        return
+    sink, start, span = progress
+    sink(start + span * min(1.0, max(0.0, fraction)))
+
+
+@contextmanager
+def progress_span(start, end):
+    """Maps report_progress() calls in the block onto [start, end] of the current range."""
+    progress = getattr(_local, 'progress', None)
+    if progress is None:
+        yield
+        return
+    sink, outer_start, outer_span = progress
+    _local.progress = (sink, outer_start + outer_span * start, outer_span * (end - start))
+    try:
+        yield
+    finally:
+        _local.progress = progress
+
+
+def _reset_peak_rss():
+    # Linux (4.0+) resets VmHWM when "5" is written to clear_refs
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def _peak_rss_kb():
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    if resource is None:
+        return None
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+def _children_peak_kb():
+    if resource is None:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+def _size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return None
+
+
+def base_record(input_path, output_path, outcome, error=None):
+    """A record for a job that did not run a converter (cache hits, duplicates, failures)."""
+    from conversion_planner import plan_for
+    from format_sniffer import resolve_format
+    input_format = resolve_format(input_path)
+    output_format = os.path.splitext(output_path)[1].lower()
+    conversion_plan = plan_for(input_format, output_format)
+    return {
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'input': input_path,
+        'output': output_path,
+        'input_format': input_format,
+        'output_format': output_format,
+        'backend': conversion_plan.backend_name if conversion_plan is not None else None,
+        'input_bytes': _size(input_path),
+        'output_bytes': _size(output_path) if outcome != 'failed' else None,
+        'stages': dict.fromkeys(STAGES, 0.0),
+        'total_seconds': 0.0,
+        'peak_rss_mb': None,
+        # 'job' when the high-water mark could be reset before the job, else the process lifetime
+        'peak_rss_scope': None,
+        'outcome': outcome,
+        'error_class': None,
+        'error': error,
+    }
+
+
+def measure_conversion(converter, input_path, output_path, progress=None):
+    """
+    Converts input_path with converter and returns (error, record); error
+    is None on success. Exceptions are captured rather than raised so the
+    record can travel back from a pool process. progress, if given, is
+    called with the fraction done whenever the backend reports it.
+    """
+    def run():
+        converter.convert(input_path, output_path)
+        return [None]
+
+    return _measure(run, input_path, [output_path], progress)[0]
+
+
+def measure_fanout(converter, input_path, output_paths, progress=None):
+    """
+    Converts input_path to all of output_paths with one shared decode and
+    returns one (error, record) per output. The shared time is split evenly
+    between the records, which carry the group size as 'fanout'.
+    """
+    def run():
+        return converter.convert_many(input_path, output_paths)
+
+    outcomes = _measure(run, input_path, output_paths, progress)
+    for _, record in outcomes:
+        record['fanout'] = len(output_paths)
+    return outcomes
+
+
+def _measure(run, input_path, output_paths, progress=None):
+    errors = [None] * len(output_paths)
+    children_before = _children_peak_kb()
+    measured_peak = _reset_peak_rss()
+    _local.stages = {}
+    _local.progress = (progress, 0.0, 1.0) if progress is not None else None
+    start = time.perf_counter()
+    try:
+        errors = run()
+    except Exception as e:
+        errors = [e] * len(output_paths)
+    finally:
+        total = time.perf_counter() - start
+        stages = _local.stages
+        _local.stages = None
+        _local.progress = None
+    peak = _peak_rss_kb()
+    children_after = _children_peak_kb()
+    if children_after > children_before:
+        # A helper process (ffmpeg) of this job set a new high-water mark
+        peak = max(peak or 0, children_after)
+
+    share = len(output_paths)
+    claimed = sum(stages.values())
+    outcomes = []
+    for output_path, e in zip(output_paths, errors):
+        error = str(e) if e is not None else None
+        record = base_record(input_path, output_path, 'failed' if error else 'converted', error)
+        for name, seconds in stages.items():
+            record['stages'][name] = round(seconds / share, 6)
+        record['stages']['encode'] = round(record['stages'].get('encode', 0.0)
+                                           + max(0.0, total - claimed) / share, 6)
+        record['total_seconds'] = round(total / share, 6)
+        record['peak_rss_mb'] = round(peak / 1024, 1) if peak is not None else None
+        record['peak_rss_scope'] = 'job' if measured_peak else 'process'
+        record['error_class'] = type(e.__cause__ or e).__name__ if e is not None else None
+        outcomes.append((error, record))
+    return outcomes
+
+
+def default_log_path():
+    if os.name == 'nt':
+        base = os.environ.get('LOCALAPPDATA') or os.path.expanduser('~')
+    else:
+        base = os.environ.get('XDG_STATE_HOME') or os.path.join(os.path.expanduser('~'), '.local', 'state')
+    return os.path.join(base, 'px-converter-pro', 'metrics.jsonl')
+
+
+class MetricsLog:
+    """Appends one JSON object per line, rotating the file at max_bytes."""
+
+    def __init__(self, path=None, max_bytes=DEFAULT_LOG_MAX_MB * 1024 * 1024, backup_count=DEFAULT_LOG_BACKUPS):
+        self.path = path or default_log_path()
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        # A private logger keeps these records out of the root logging tree
+        self._logger = logging.Logger('px-converter-pro.metrics')
+        handler = logging.handlers.RotatingFileHandler(
+            self.path, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8', delay=True)
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        self._logger.addHandler(handler)
+
+    def append(self, record):
+        self._logger.info(json.dumps(record))
+
+    def close(self):
+        for handler in list(self._logger.handlers):
+            handler.close()
+            self._logger.removeHandler(handler)
+
+
+def metrics_log_from_settings(settings_manager):
+    """Returns a MetricsLog configured from the settings, or None if disabled."""
+    if not settings_manager.get('metrics_enabled', True):
+        return None
+    max_mb = settings_manager.get('metrics_log_max_mb', DEFAULT_LOG_MAX_MB)
+    try:
+        return MetricsLog(settings_manager.get('metrics_log'),
+                          int(max_mb * 1024 * 1024),
+                          settings_manager.get('metrics_log_backups', DEFAULT_LOG_BACKUPS))
+    except OSError as e:
+        print(f"Metrics log disabled: {e}")
+        return None
+
+
+def _percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * (len(sorted_values) - 1)))))
+    return sorted_values[index]
+
+
+class MetricsSummary:
+    """Running totals and per-format latency percentiles for a batch."""
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.files = 0
+        self.failed = 0
+        self.cached = 0
+        # Input bytes of converted jobs only; cached and failed ones would inflate the throughput
+        self.bytes_in = 0
+        self.latencies = {}
+        # Set by the engine when a JobScheduler feeds the batch: queue depth and memory budget use
+        self.scheduler = None
+
+    def add(self, record):
+        self.files += 1
+        if record['outcome'] == 'failed':
+            self.failed += 1
+        elif record['outcome'] == 'cached':
+            self.cached += 1
+        if record['outcome'] == 'converted':
+            self.bytes_in += record.get('input_bytes') or 0
+            pair = f"{record['input_format']}->{record['output_format']}"
+            self.latencies.setdefault(pair, deque(maxlen=SUMMARY_WINDOW)).append(record['total_seconds'])
+
+    def snapshot(self):
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        formats = {}
+        for pair, samples in self.latencies.items():
+            ordered = sorted(samples)
+            formats[pair] = {
+                'count': len(ordered),
+                'p50': round(_percentile(ordered, 0.50), 4),
+                'p95': round(_percentile(ordered, 0.95), 4),
+            }
+        snapshot = {
+            'files': self.files,
+            'failed': self.failed,
+            'cached': self.cached,
+            'elapsed_seconds': round(elapsed, 3),
+            'files_per_s': round(self.files / elapsed, 3),
+            'mb_per_s': round(self.bytes_in / (1024 * 1024) / elapsed, 3),
+            'formats': formats,
+        }
+        if self.scheduler is not None:
+            snapshot['scheduler'] = self.scheduler.snapshot()
+        return snapshot
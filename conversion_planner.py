@@ -0,0 +1,250 @@
+"""
+Multi-hop conversion planning.
+
+The registered backends form a directed graph over extensions. Pairs
+with a direct backend always use it, so lossy formats are never
+re-encoded along the way. For the others plan() finds the cheapest chain
+of backends with Dijkstra's algorithm. Edge costs are seconds per MB,
+measured from the metrics log when there are enough samples and
+estimated otherwise, plus a fixed per-hop charge so shorter chains win
+ties.
+
+run_plan() executes a chain. Intermediate files go to a scratch
+directory on a RAM-backed filesystem (/dev/shm) when there is one, since
+the backends read and write by path. The directory is removed when the
+chain finishes.
+"""
+import bisect
+import heapq
+import json
+import os
+import shutil
+import tempfile
+import threading
+from conversion_metrics import progress_span
+from converter_registry import _backends, get_backend, get_supported_formats as _direct_formats, same_format
+
+# Estimated seconds per MB for each backend, used until the metrics log has
+# enough samples for a pair
+DEFAULT_COSTS = {
+    'text_copy': 0.05,
+    'text_to_pdf': 0.3,
+    'text_to_docx': 0.2,
+    'spreadsheet': 1.0,
+    'docx_to_pdf': 0.5,
+    'pdf_to_docx': 3.0,
+    'image': 0.5,
+    'audio': 2.0,
+    'video': 10.0,
+}
+UNKNOWN_COST = 5.0
+HOP_COST = 1.0
+MIN_SAMPLES = 3
+MAX_HOPS = 3
+
+_measured = {}
+_lock = threading.Lock()
+
+
+class ConversionPlan:
+    """A chain of (input_ext, output_ext, backend) steps and its total cost."""
+
+    def __init__(self, steps, cost):
+        self.steps = steps
+        self.cost = cost
+
+    @property
+    def backend_name(self):
+        return '+'.join(backend.name for _, _, backend in self.steps)
+
+    def __len__(self):
+        return len(self.steps)
+
+    def __repr__(self):
+        route = ' -> '.join([self.steps[0][0]] + [output_ext for _, output_ext, _ in self.steps])
+        return f"ConversionPlan({route}, cost={self.cost:.2f})"
+
+
+def load_measured_costs(log_path=None):
+    """
+    Returns {(input_ext, output_ext): seconds per MB} from the median of the
+    successful conversions in the metrics log. Re-read only when the log
+    changes.
+    """
+    return load_measured('seconds_per_mb', log_path)
+
+
+def load_measured(field, log_path=None):
+    """
+    Returns {(input_ext, output_ext): median} of a per-conversion figure in
+    the metrics log: 'seconds_per_mb', or 'peak_rss_mb' (only records whose
+    peak was measured for the job alone). Pairs with fewer than MIN_SAMPLES
+    successful conversions are left out.
+    The engine appends to the log after every job, so only the lines added
+    since the last call are parsed; a rotated log is read from the start.
+    """
+    if log_path is None:
+        from conversion_metrics import default_log_path
+        log_path = default_log_path()
+    try:
+        stat = os.stat(log_path)
+    except OSError:
+        return {}
+    with _lock:
+        state = _measured.get(log_path)
+        if state is not None and state['key'] == (stat.st_size, stat.st_mtime_ns):
+            return state['medians'][field]
+        if state is None or state['inode'] != stat.st_ino or stat.st_size < state['offset']:
+            state = {'inode': stat.st_ino, 'offset': 0, 'samples': {'seconds_per_mb': {}, 'peak_rss_mb': {}}}
+        try:
+            with open(log_path, 'rb') as f:
+                f.seek(state['offset'])
+                data = f.read()
+        except OSError:
+            return {}
+        # A line still being written is left for the next call
+        data = data[:data.rfind(b'\n') + 1]
+        state['offset'] += len(data)
+        for line in data.splitlines():
+            _add_samples(state['samples'], line)
+        state['medians'] = {name: {pair: values[len(values) // 2] for pair, values in pairs.items()
+                                   if len(values) >= MIN_SAMPLES}
+                            for name, pairs in state['samples'].items()}
+        state['key'] = (stat.st_size, stat.st_mtime_ns)
+        _measured[log_path] = state
+        return state['medians'][field]
+
+
+def _add_samples(samples, line):
+    try:
+        record = json.loads(line)
+    except ValueError:
+        return
+    size = record.get('input_bytes')
+    if record.get('outcome') != 'converted' or not size:
+        return
+    pair = (record['input_format'], record['output_format'])
+    if record.get('peak_rss_mb') and record.get('peak_rss_scope') == 'job':
+        bisect.insort(samples['peak_rss_mb'].setdefault(pair, []), record['peak_rss_mb'])
+    # Chained records are not timed per pair, each hop is costed on its own
+    if '+' not in (record.get('backend') or ''):
+        bisect.insort(samples['seconds_per_mb'].setdefault(pair, []),
+                      record['total_seconds'] / (size / (1024 * 1024)))
+
+
+def edge_cost(input_ext, output_ext, backend, measured):
+    per_mb = measured.get((input_ext, output_ext))
+    if per_mb is None:
+        per_mb = DEFAULT_COSTS.get(backend.name, UNKNOWN_COST)
+    return HOP_COST + per_mb
+
+
+def _graph():
+    graph = {}
+    for (input_ext, output_ext), backend in _backends.items():
+        graph.setdefault(input_ext, []).append((output_ext, backend))
+    return graph
+
+
+def plan(input_ext, output_ext, measured=None, max_hops=MAX_HOPS):
+    """Returns the cheapest ConversionPlan from input_ext to output_ext, or None."""
+    input_ext = input_ext.lower()
+    output_ext = output_ext.lower()
+    if same_format(input_ext, output_ext):
+        return None
+    if measured is None:
+        measured = load_measured_costs()
+    graph = _graph()
+    best = {input_ext: 0.0}
+    queue = [(0.0, 0, input_ext, [])]
+    counter = 1
+    while queue:
+        cost, _, node, steps = heapq.heappop(queue)
+        if node == output_ext:
+            return ConversionPlan(steps, cost)
+        if cost > best.get(node, float('inf')) or len(steps) >= max_hops:
+            continue
+        for target, backend in graph.get(node, ()):
+            total = cost + edge_cost(node, target, backend, measured)
+            if total < best.get(target, float('inf')):
+                best[target] = total
+                # The counter breaks ties so steps lists are never compared
+                heapq.heappush(queue, (total, counter, target, steps + [(node, target, backend)]))
+                counter += 1
+    return None
+
+
+def plan_for(input_ext, output_ext):
+    """The direct backend as a one-step plan if there is one, else the cheapest chain."""
+    backend = get_backend(input_ext, output_ext)
+    if backend is not None:
+        return ConversionPlan([(input_ext.lower(), output_ext.lower(), backend)], 0.0)
+    return plan(input_ext, output_ext)
+
+
+def reachable_targets(input_ext, max_hops=MAX_HOPS):
+    """
+    Every extension input_ext can be converted to in at most max_hops
+    steps, nearest first, leaving out input_ext and its equivalents.
+    """
+    input_ext = input_ext.lower()
+    graph = _graph()
+    seen = {input_ext}
+    frontier = [input_ext]
+    targets = []
+    for _ in range(max_hops):
+        next_frontier = []
+        for node in frontier:
+            for target, _ in graph.get(node, ()):
+                if target not in seen:
+                    seen.add(target)
+                    next_frontier.append(target)
+                    if not same_format(input_ext, target):
+                        targets.append(target)
+        frontier = next_frontier
+    return targets
+
+
+def get_supported_formats():
+    """
+    The {category: {input_ext: [output_ext, ...]}} mapping including
+    targets that need a chain of converters. Direct targets keep their
+    registration order and come first.
+    """
+    formats = _direct_formats()
+    for entries in formats.values():
+        for input_ext, targets in entries.items():
+            targets.extend(target for target in reachable_targets(input_ext) if target not in targets)
+    return formats
+
+
+def scratch_root():
+    """The RAM-backed directory for scratch files, or None where there is none (use the temp directory)."""
+    shm = '/dev/shm'
+    if os.path.isdir(shm) and os.access(shm, os.W_OK):
+        return shm
+    return None
+
+
+def run_plan(conversion_plan, converter, input_path, output_path):
+    """Runs every step of the plan, passing each intermediate file to the next backend."""
+    if len(conversion_plan) == 1:
+        conversion_plan.steps[0][2].resolve(converter)(input_path, output_path)
+        return
+    # Named after this worker's pid so a kill mid-chain does not strand the intermediates
+    scratch = tempfile.mkdtemp(prefix=f'pxconvert-chain-{os.getpid()}-', dir=scratch_root())
+    try:
+        source = input_path
+        base = os.path.splitext(os.path.basename(output_path))[0]
+        for number, (_, step_output_ext, backend) in enumerate(conversion_plan.steps):
+            if number == len(conversion_plan) - 1:
+                target = output_path
+            else:
+                target = os.path.join(scratch, f"{base}.step{number}{step_output_ext}")
+            with progress_span(number / len(conversion_plan), (number + 1) / len(conversion_plan)):
+                backend.resolve(converter)(source, target)
+            if source != input_path:
+                os.remove(source)
+            source = target
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
@@ -0,0 +1,702 @@
+"""
+Local HTTP conversion service.
+
+    python -m conversion_server --port 8765 --jobs 4
+
+Other programs submit conversions over HTTP instead of driving the GUI:
+
+    POST   /jobs?to=.png&filename=photo.jpg     the request body is the file to convert
+    POST   /jobs                                JSON {"path": "/data/photo.jpg", "to": ".png"}
+    POST   /convert?to=.png&filename=photo.jpg  upload, wait and receive the converted file
+    GET    /jobs/<id>                           state, progress, error and metrics of a job
+    GET    /jobs/<id>/result                    waits for the job, then streams its output
+    DELETE /jobs/<id>                           drops a queued job or kills a running one
+    GET    /status                              queue depth, running jobs and throughput
+    GET    /formats                             the supported conversions
+
+Jobs wait in one FIFO per category and the dispatcher serves the
+categories in turn, each under its concurrency limit, so a long video
+never holds up a stream of small image jobs queued behind it. The queue
+is bounded: when it is full a new job is refused with 503 and Retry-After
+before its upload is read. A job also waits while its estimated memory
+(see job_scheduler) does not fit in the memory budget next to the
+running jobs. Uploads and results move in fixed-size chunks paced by the
+socket, so neither is held in memory.
+
+Conversions run on a ConversionPool, the process pool ConversionEngine
+uses as well. A job over the timeout is killed with its child
+processes. Results are kept for result_ttl seconds. The server binds to
+localhost by default and, like pxconvert, never imports PyQt6.
+"""
+import argparse
+import asyncio
+import json
+import mimetypes
+import os
+import shutil
+import signal
+import sys
+import tempfile
+import time
+import uuid
+from collections import deque
+from concurrent.futures.process import BrokenProcessPool
+from http import HTTPStatus
+from urllib.parse import parse_qsl, quote, urlsplit
+from conversion_cache import ConversionCache, cache_from_settings, hash_file, make_key
+from conversion_engine import DEFAULT_CATEGORY_LIMITS, ConversionPool, get_category
+from conversion_metrics import MetricsLog, MetricsSummary, base_record, metrics_log_from_settings
+from file_converter import FileConverter, converter_options_from_settings
+from format_sniffer import resolve_format
+from job_scheduler import MemoryBudget, estimate_cost
+from settings_manager import SettingsManager
+from utils import get_supported_formats
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+DEFAULT_QUEUE_SIZE = 256
+DEFAULT_MAX_UPLOAD_MB = 4096
+DEFAULT_RESULT_TTL = 3600
+CHUNK_SIZE = 256 * 1024
+MAX_HEADER_BYTES = 64 * 1024
+MAX_JSON_BYTES = 64 * 1024
+# How often running jobs are checked against the timeout and old results pruned
+WATCHDOG_SECONDS = 0.5
+RETRY_AFTER_SECONDS = 2
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+
+def default_work_directory():
+    return os.path.join(tempfile.gettempdir(), 'px-converter-pro-server')
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message, headers=None):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+        self.headers = headers or {}
+
+
+class _Request:
+    def __init__(self, method, target, headers):
+        self.method = method
+        parts = urlsplit(target)
+        self.path = parts.path
+        self.query = dict(parse_qsl(parts.query))
+        self.headers = headers
+
+
+class ServerJob:
+    def __init__(self, job_id, input_path, output_format, output_path, category, directory, upload):
+        self.id = job_id
+        self.input_path = input_path
+        self.output_format = output_format
+        self.output_path = output_path
+        self.category = category
+        # Holds the upload and the output; removed when the job is pruned
+        self.directory = directory
+        self.upload = upload
+        self.state = QUEUED
+        self.error = None
+        self.cached = False
+        self.metrics = None
+        self.created = time.time()
+        self.finished = None
+        self.slot = None
+        self.started = None
+        # Set when the watchdog or a DELETE kills the job: the error to report
+        self.kill_reason = None
+        # Cancelled before a worker picked it up; killed once its pid appears
+        self.kill_pending = False
+        self.memory_mb = 0.0
+        # Set once the job has had to wait for memory
+        self.deferred = False
+        self.done = asyncio.Event()
+
+    def to_dict(self, progress=None):
+        return {
+            'id': self.id,
+            'state': self.state,
+            'input': self.input_path,
+            'output': self.output_path if self.state == DONE else None,
+            'output_format': self.output_format,
+            'category': self.category,
+            'progress': 1.0 if self.state == DONE else progress,
+            'cached': self.cached,
+            'error': self.error,
+            'metrics': self.metrics,
+            'result': f'/jobs/{self.id}/result',
+        }
+
+
+def _safe_name(name):
+    name = os.path.basename((name or '').replace('\\', '/'))
+    return name if name not in ('', '.', '..') else 'upload'
+
+
+def _normalize_format(output_format):
+    output_format = (output_format or '').strip().lower()
+    if output_format and not output_format.startswith('.'):
+        output_format = '.' + output_format
+    return output_format
+
+
+class ConversionServer:
+    """
+    Serves conversions over HTTP. start() binds the socket and returns the
+    port (pass port=0 to pick a free one), close() stops everything and
+    kills running conversions; serve() does both around serve_forever().
+    """
+
+    def __init__(self, work_directory=None, max_workers=1, category_limits=None, queue_size=DEFAULT_QUEUE_SIZE,
+                 cache=None, converter_options=None, metrics_log=None, job_timeout=None,
+                 max_upload_bytes=DEFAULT_MAX_UPLOAD_MB * 1024 * 1024, result_ttl=DEFAULT_RESULT_TTL,
+                 memory_budget_mb=None):
+        self.work_directory = work_directory or default_work_directory()
+        self.max_workers = max(1, int(max_workers or 1))
+        self.category_limits = dict(DEFAULT_CATEGORY_LIMITS)
+        if category_limits:
+            self.category_limits.update(category_limits)
+        self.queue_size = max(1, int(queue_size))
+        self.cache = cache
+        self.converter_options = dict(converter_options or {})
+        self.metrics_log = metrics_log
+        self.job_timeout = float(job_timeout) if job_timeout else None
+        self.max_upload_bytes = max_upload_bytes
+        self.result_ttl = result_ttl
+        self.supported_formats = get_supported_formats()
+        self.summary = MetricsSummary()
+        self.jobs = {}
+        self.running = {}
+        self.queues = {}
+        self.running_per_category = {}
+        self.memory = MemoryBudget(memory_budget_mb)
+        self._deferred = 0
+        # Categories in serving order; the one just served moves to the back
+        self._order = deque()
+        self._queued = 0
+        # Admitted jobs whose upload is still being received
+        self._reserved = 0
+        # One pool slot per worker
+        self._slots = deque(range(self.max_workers))
+        self._pool = None
+        self._server = None
+        self._tasks = set()
+        self._wakeup = None
+
+    async def start(self, host=DEFAULT_HOST, port=DEFAULT_PORT):
+        os.makedirs(self.work_directory, exist_ok=True)
+        self._wakeup = asyncio.Event()
+        self._pool = ConversionPool(self.converter_options, self.max_workers)
+        self._server = await asyncio.start_server(self._handle, host, port, limit=MAX_HEADER_BYTES)
+        self._spawn(self._dispatch())
+        self._spawn(self._watchdog())
+        return self._server.sockets[0].getsockname()[1]
+
+    async def serve(self, host=DEFAULT_HOST, port=DEFAULT_PORT):
+        port = await self.start(host, port)
+        print(f"Conversion server listening on http://{host}:{port}")
+        try:
+            await self._server.serve_forever()
+        finally:
+            await self.close()
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+        tasks = list(self._tasks)
+        for task in tasks:
+            task.cancel()
+        # Cancelled jobs kill their workers on the way out
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if self._pool is not None:
+            self._pool.shutdown(wait=False)
+            self._pool = None
+        if self.metrics_log is not None:
+            self.metrics_log.close()
+
+    def _spawn(self, coroutine):
+        # asyncio keeps only weak references to tasks
+        task = asyncio.create_task(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    # Scheduling
+
+    def _reserve(self):
+        if self._queued + self._reserved >= self.queue_size:
+            raise HTTPError(503, "The conversion queue is full, try again later.",
+                            {'Retry-After': str(RETRY_AFTER_SECONDS)})
+        self._reserved += 1
+
+    def _enqueue(self, job, front=False):
+        queue = self.queues.get(job.category)
+        if queue is None:
+            queue = self.queues[job.category] = deque()
+            self._order.append(job.category)
+        job.state = QUEUED
+        if front:
+            queue.appendleft(job)
+        else:
+            queue.append(job)
+        self._queued += 1
+        self._wakeup.set()
+
+    def _next_job(self):
+        for _ in range(len(self._order)):
+            category = self._order[0]
+            self._order.rotate(-1)
+            queue = self.queues[category]
+            limit = self.category_limits.get(category)
+            if not queue or (limit is not None and self.running_per_category.get(category, 0) >= limit):
+                continue
+            if not self.memory.fits(queue[0].memory_mb):
+                if not queue[0].deferred:
+                    queue[0].deferred = True
+                    self._deferred += 1
+                continue
+            self._queued -= 1
+            return queue.popleft()
+        return None
+
+    async def _dispatch(self):
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            while self._slots:
+                job = self._next_job()
+                if job is None:
+                    break
+                self._start(job)
+
+    def _start(self, job):
+        job.slot = self._slots.popleft()
+        job.state = RUNNING
+        job.started = None
+        self.running[job.id] = job
+        self.running_per_category[job.category] = self.running_per_category.get(job.category, 0) + 1
+        self.memory.reserve(job.memory_mb)
+        self._spawn(self._run(job))
+
+    async def _run(self, job):
+        requeue = False
+        try:
+            error, metrics, requeue = await self._convert(job)
+        except asyncio.CancelledError:
+            # The server is closing: stop the conversion rather than wait for it
+            self._pool.clean_up(job.slot, [job.output_path])
+            raise
+        except Exception as e:
+            error = str(e) or type(e).__name__
+            metrics = base_record(job.input_path, job.output_path, 'failed', error)
+            metrics['error_class'] = type(e).__name__
+        finally:
+            self.running.pop(job.id, None)
+            self.running_per_category[job.category] -= 1
+            self.memory.release(job.memory_mb)
+            self._slots.append(job.slot)
+            job.slot = None
+            self._wakeup.set()
+        if requeue:
+            self._enqueue(job, front=True)
+        elif not job.done.is_set():
+            self._finish(job, error, metrics)
+
+    async def _convert(self, job):
+        """Returns (error, metrics, requeue)."""
+        key = None
+        if self.cache is not None:
+            content_hash = await asyncio.to_thread(hash_file, job.input_path)
+            key = make_key(content_hash, job.output_format, FileConverter.VERSION,
+                           FileConverter.cache_options(self.converter_options, job.output_format))
+            if await asyncio.to_thread(self.cache.materialize, key, job.output_format, job.output_path):
+                job.cached = True
+                return None, base_record(job.input_path, job.output_path, 'cached'), False
+        if job.kill_reason is not None:
+            # Cancelled while its input was being hashed
+            return self._killed_outcome(job)
+        try:
+            error, metrics = await asyncio.wrap_future(
+                self._pool.submit(job.slot, job.input_path, job.output_path))
+        except BrokenProcessPool as e:
+            requeue = self._pool.broken(job.slot, [job.output_path])
+            if job.kill_reason is not None:
+                return self._killed_outcome(job)
+            if requeue:
+                # Went down with another job that was killed; run it again
+                return None, None, True
+            error = str(e) or type(e).__name__
+            metrics = base_record(job.input_path, job.output_path, 'failed', error)
+            metrics['error_class'] = type(e).__name__
+            return error, metrics, False
+        if job.kill_reason is not None:
+            # Cancelled before its worker started, and done before the watchdog got to it
+            try:
+                os.remove(job.output_path)
+            except OSError:
+                pass
+            return self._killed_outcome(job)
+        if error is None and key is not None:
+            try:
+                await asyncio.to_thread(self.cache.store, key, job.output_path)
+            except OSError as e:
+                print(f"Could not cache {job.output_path}: {e}")
+        return error, metrics, False
+
+    def _killed_outcome(self, job):
+        metrics = base_record(job.input_path, job.output_path, 'failed', job.kill_reason)
+        metrics['error_class'] = 'TimeoutError' if job.kill_reason.startswith('Timed out') else 'CancelledError'
+        return job.kill_reason, metrics, False
+
+    def _finish(self, job, error, metrics):
+        job.state = FAILED if error else DONE
+        job.error = error
+        job.metrics = metrics
+        job.finished = time.time()
+        if job.upload:
+            shutil.rmtree(os.path.dirname(job.input_path), ignore_errors=True)
+        if metrics is not None:
+            self.summary.add(metrics)
+            if self.metrics_log is not None:
+                try:
+                    self.metrics_log.append(metrics)
+                except OSError as e:
+                    print(f"Could not write metrics: {e}")
+        job.done.set()
+
+    def _kill(self, job, reason):
+        """
+        Stops a running job. One that no worker has picked up yet is left
+        pending: _convert then never submits it, or the watchdog kills it as
+        soon as its worker's pid appears.
+        """
+        if job.kill_reason is not None:
+            return False
+        job.kill_reason = reason
+        job.kill_pending = job.slot is None or not self._pool.kill(job.slot)
+        return True
+
+    def _cancel(self, job):
+        if job.state == QUEUED and job in self.queues.get(job.category, ()):
+            self.queues[job.category].remove(job)
+            self._queued -= 1
+            self._finish(job, "Cancelled", None)
+            return True
+        if job.state == RUNNING:
+            return self._kill(job, "Cancelled")
+        return False
+
+    async def _watchdog(self):
+        while True:
+            await asyncio.sleep(WATCHDOG_SECONDS)
+            now = time.monotonic()
+            for job in list(self.running.values()):
+                if job.slot is None or not self._pool.started(job.slot):
+                    continue
+                if job.kill_pending:
+                    job.kill_pending = False
+                    self._pool.kill(job.slot)
+                    continue
+                if job.started is None:
+                    job.started = now
+                if self.job_timeout is not None and now - job.started > self.job_timeout:
+                    self._kill(job, f"Timed out after {self.job_timeout:g} seconds")
+            self._prune(time.time())
+
+    def _prune(self, now):
+        for job in list(self.jobs.values()):
+            if job.finished is not None and now - job.finished > self.result_ttl:
+                del self.jobs[job.id]
+                shutil.rmtree(job.directory, ignore_errors=True)
+
+    def status(self):
+        categories = {}
+        for category in set(self.queues) | set(self.running_per_category):
+            categories[category] = {
+                'queued': len(self.queues.get(category, ())),
+                'running': self.running_per_category.get(category, 0),
+                'limit': self.category_limits.get(category),
+            }
+        return {
+            'queued': self._queued,
+            'receiving': self._reserved,
+            'running': len(self.running),
+            'queue_size': self.queue_size,
+            'workers': self.max_workers,
+            'categories': categories,
+            'memory': {**self.memory.snapshot(), 'deferred_for_memory': self._deferred},
+            'throughput': self.summary.snapshot(),
+        }
+
+    def _progress_of(self, job):
+        if job.state == RUNNING and job.slot is not None:
+            return round(self._pool.progress[job.slot], 4)
+        return 0.0 if job.state == QUEUED else None
+
+    # HTTP
+
+    async def _handle(self, reader, writer):
+        try:
+            request = await self._read_request(reader)
+            await self._route(request, reader, writer)
+        except HTTPError as e:
+            await self._send_json(writer, e.status, {'error': e.message}, e.headers)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except Exception as e:
+            print(f"Conversion server error: {e!r}")
+            try:
+                await self._send_json(writer, 500, {'error': str(e) or type(e).__name__})
+            except ConnectionError:
+                pass
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def _read_request(self, reader):
+        try:
+            line = await reader.readline()
+            if not line:
+                raise ConnectionResetError("Client closed the connection")
+            method, target, _ = line.decode('latin-1').split(' ', 2)
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                headers[name.strip().lower()] = value.strip()
+        except (ValueError, asyncio.LimitOverrunError):
+            raise HTTPError(400, "Malformed request.")
+        return _Request(method.upper(), target, headers)
+
+    async def _iter_body(self, request, reader, limit):
+        """Yields the request body in chunks, with Content-Length or chunked transfer encoding."""
+        received = 0
+        if request.headers.get('transfer-encoding', '').lower() == 'chunked':
+            while True:
+                try:
+                    remaining = int((await reader.readline()).split(b';')[0].strip(), 16)
+                except ValueError:
+                    raise HTTPError(400, "Malformed chunked body.")
+                if remaining == 0:
+                    # Skip the trailers
+                    while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                        pass
+                    return
+                while remaining:
+                    chunk = await reader.read(min(CHUNK_SIZE, remaining))
+                    if not chunk:
+                        raise asyncio.IncompleteReadError(b'', remaining)
+                    remaining -= len(chunk)
+                    received += len(chunk)
+                    if received > limit:
+                        raise HTTPError(413, "Request body too large.")
+                    yield chunk
+                await reader.readline()
+        try:
+            remaining = int(request.headers.get('content-length') or 0)
+        except ValueError:
+            raise HTTPError(400, "Invalid Content-Length.")
+        if remaining > limit:
+            raise HTTPError(413, "Request body too large.")
+        while remaining:
+            chunk = await reader.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                raise asyncio.IncompleteReadError(b'', remaining)
+            remaining -= len(chunk)
+            yield chunk
+
+    async def _send_head(self, writer, status, headers):
+        lines = [f"HTTP/1.1 {status} {HTTPStatus(status).phrase}", "Connection: close"]
+        lines.extend(f"{name}: {value}" for name, value in headers.items())
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode('latin-1'))
+        await writer.drain()
+
+    async def _send_json(self, writer, status, payload, headers=None):
+        body = json.dumps(payload).encode('utf-8')
+        await self._send_head(writer, status, {'Content-Type': 'application/json',
+                                               'Content-Length': str(len(body)), **(headers or {})})
+        writer.write(body)
+        await writer.drain()
+
+    async def _send_file(self, writer, path):
+        name = os.path.basename(path)
+        with open(path, 'rb') as f:
+            await self._send_head(writer, 200, {
+                'Content-Type': mimetypes.guess_type(name)[0] or 'application/octet-stream',
+                'Content-Length': str(os.fstat(f.fileno()).st_size),
+                'Content-Disposition': f"attachment; filename*=UTF-8''{quote(name)}",
+            })
+            while True:
+                chunk = f.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                writer.write(chunk)
+                # Waits while the client reads slower than the disk, so about one chunk is buffered
+                await writer.drain()
+
+    async def _send_result(self, writer, job):
+        if job.state == DONE:
+            await self._send_file(writer, job.output_path)
+        else:
+            await self._send_json(writer, 422, job.to_dict())
+
+    async def _route(self, request, reader, writer):
+        method, path = request.method, request.path.rstrip('/') or '/'
+        if path == '/status' and method == 'GET':
+            return await self._send_json(writer, 200, self.status())
+        if path == '/formats' and method == 'GET':
+            return await self._send_json(writer, 200, self.supported_formats)
+        if path in ('/jobs', '/convert') and method == 'POST':
+            job = await self._create_job(request, reader, writer)
+            if path == '/jobs':
+                return await self._send_json(writer, 202, job.to_dict(self._progress_of(job)),
+                                             {'Location': f'/jobs/{job.id}'})
+            await job.done.wait()
+            return await self._send_result(writer, job)
+        parts = path.strip('/').split('/')
+        if parts[0] != 'jobs' or len(parts) not in (2, 3) or (len(parts) == 3 and parts[2] != 'result'):
+            raise HTTPError(404, "Not found.")
+        job = self.jobs.get(parts[1])
+        if job is None:
+            raise HTTPError(404, "No such job.")
+        if len(parts) == 3:
+            if method != 'GET':
+                raise HTTPError(405, "Use GET.")
+            try:
+                wait = float(request.query['wait']) if 'wait' in request.query else None
+                await asyncio.wait_for(job.done.wait(), wait)
+            except ValueError:
+                raise HTTPError(400, "wait must be a number of seconds.")
+            except asyncio.TimeoutError:
+                return await self._send_json(writer, 202, job.to_dict(self._progress_of(job)))
+            return await self._send_result(writer, job)
+        if method == 'GET':
+            return await self._send_json(writer, 200, job.to_dict(self._progress_of(job)))
+        if method == 'DELETE':
+            if not self._cancel(job):
+                raise HTTPError(409, f"Job is already {job.state}.")
+            return await self._send_json(writer, 202, job.to_dict(self._progress_of(job)))
+        raise HTTPError(405, "Use GET or DELETE.")
+
+    async def _create_job(self, request, reader, writer):
+        self._reserve()
+        job_id = uuid.uuid4().hex[:16]
+        directory = os.path.join(self.work_directory, job_id)
+        try:
+            os.makedirs(directory)
+            content_type = request.headers.get('content-type', '').split(';')[0].strip().lower()
+            if content_type == 'application/json':
+                try:
+                    spec = json.loads(b''.join([chunk async for chunk in
+                                                self._iter_body(request, reader, MAX_JSON_BYTES)]))
+                    input_path = spec['path']
+                    output_format = _normalize_format(spec.get('to'))
+                except (ValueError, KeyError, TypeError, AttributeError):
+                    raise HTTPError(400, 'Expected JSON like {"path": "/data/file.jpg", "to": ".png"}.')
+                if not isinstance(input_path, str) or not os.path.isfile(input_path):
+                    raise HTTPError(404, f"No such file: {input_path}")
+                upload = False
+            else:
+                output_format = _normalize_format(request.query.get('to'))
+                source = os.path.join(directory, 'source')
+                os.makedirs(source)
+                input_path = os.path.join(source, _safe_name(request.query.get('filename')))
+                if request.headers.get('expect', '').lower() == '100-continue':
+                    # Admitted: tell the client to send the body now
+                    writer.write(b"HTTP/1.1 100 Continue\r\n\r\n")
+                    await writer.drain()
+                with open(input_path, 'wb') as f:
+                    async for chunk in self._iter_body(request, reader, self.max_upload_bytes):
+                        f.write(chunk)
+                upload = True
+            if not output_format:
+                raise HTTPError(400, "The target format is missing (to=.png).")
+            input_format = resolve_format(input_path)
+            category = get_category(input_path, self.supported_formats)
+            if output_format not in self.supported_formats.get(category, {}).get(input_format, []):
+                raise HTTPError(422, f"Conversion from {input_format or '(none)'} to {output_format} is not supported.")
+            stem = os.path.splitext(os.path.basename(input_path))[0]
+            job = ServerJob(job_id, input_path, output_format, os.path.join(directory, stem + output_format),
+                            category, directory, upload)
+            job.memory_mb, _ = await asyncio.to_thread(estimate_cost, input_path, [output_format],
+                                                       self.converter_options)
+        except BaseException:
+            shutil.rmtree(directory, ignore_errors=True)
+            raise
+        finally:
+            self._reserved -= 1
+        self.jobs[job.id] = job
+        self._enqueue(job)
+        return job
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="conversion_server",
+        description="Serve Px-Converter Pro conversions over HTTP.",
+    )
+    parser.add_argument("--host", default=DEFAULT_HOST,
+                        help="Address to listen on (default: localhost only).")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="Port to listen on (0 picks a free one).")
+    parser.add_argument("--jobs", "-j", type=int,
+                        help="Number of worker processes (defaults to the GUI setting).")
+    parser.add_argument("--queue-size", type=int, default=DEFAULT_QUEUE_SIZE,
+                        help="Jobs allowed to wait; beyond that new jobs get 503.")
+    parser.add_argument("--work-dir", help="Directory for uploads and results.")
+    parser.add_argument("--timeout", type=float, metavar="SECONDS",
+                        help="Kill any single conversion still running after this long.")
+    parser.add_argument("--max-upload", type=int, default=DEFAULT_MAX_UPLOAD_MB, metavar="MB",
+                        help="Largest accepted upload in megabytes.")
+    parser.add_argument("--result-ttl", type=float, default=DEFAULT_RESULT_TTL, metavar="SECONDS",
+                        help="How long finished jobs and their results are kept.")
+    parser.add_argument("--memory-budget", type=int, metavar="MB",
+                        help="Only start conversions while their estimated memory fits in this many MB.")
+    parser.add_argument("--no-cache", action="store_true", help="Bypass the conversion cache.")
+    parser.add_argument("--metrics-log", metavar="PATH",
+                        help="Append per-job metrics to this rotating JSON-lines file.")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    settings_manager = SettingsManager()
+    cache = None
+    if not args.no_cache and settings_manager.get('cache_enabled', True):
+        cache = cache_from_settings(settings_manager) or ConversionCache()
+    metrics_log = MetricsLog(args.metrics_log) if args.metrics_log else metrics_log_from_settings(settings_manager)
+    job_timeout = args.timeout if args.timeout is not None else settings_manager.get('job_timeout_seconds')
+    server = ConversionServer(
+        args.work_dir,
+        args.jobs or settings_manager.get('max_workers', os.cpu_count() or 1),
+        settings_manager.get('category_limits'),
+        queue_size=args.queue_size,
+        cache=cache,
+        converter_options=converter_options_from_settings(settings_manager),
+        metrics_log=metrics_log,
+        job_timeout=job_timeout or None,
+        max_upload_bytes=args.max_upload * 1024 * 1024,
+        result_ttl=args.result_ttl,
+        memory_budget_mb=args.memory_budget or settings_manager.get('memory_budget_mb'),
+    )
+    # As in pxconvert: a plain kill still stops the running conversions
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(128 + signum))
+    try:
+        asyncio.run(server.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        print("Conversion server stopped.", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
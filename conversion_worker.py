@@ -1,46 +1,102 @@
 from PyQt6.QtCore import QThread, pyqtSignal
-from file_converter import FileConverter
+from conversion_engine import ConversionEngine
+from job_queue import drain
 import os
 
 class ConversionWorker(QThread):
     progress = pyqtSignal(int)
     status = pyqtSignal(str, int) # Message and timeout
+    metrics = pyqtSignal(dict) # Per-job record from conversion_metrics
+    summary = pyqtSignal(dict) # Running MetricsSummary snapshot
     finished = pyqtSignal()
 
-    def __init__(self, files_to_convert, output_directory):
+    def __init__(self, files_to_convert, output_directory, max_workers=1, category_limits=None, cache=None,
+                 metrics_log=None, job_queue=None, job_timeout=None, memory_budget_mb=None,
+                 converter_options=None):
         super().__init__()
         self.files_to_convert = files_to_convert
         self.output_directory = output_directory
-        self.converter = FileConverter()
+        # With a JobQueue the batch is recorded before it runs, and unfinished
+        # jobs from an earlier session are resumed along with it
+        self.job_queue = job_queue
+        # Conversions run in pool processes even with one worker, so stop()
+        # can kill a file halfway instead of waiting for it to finish
+        self.engine = ConversionEngine(output_directory, max_workers, category_limits, cache=cache,
+                                       metrics_log=metrics_log, job_timeout=job_timeout, cancellable=True,
+                                       memory_budget_mb=memory_budget_mb, converter_options=converter_options)
         self.is_running = True
+        # Fraction done of each running job, for progress within a file
+        self._fractions = {}
+        self._completed = 0
+        self._total = max(1, len(files_to_convert))
 
     def run(self):
         print(f"ConversionWorker started with {len(self.files_to_convert)} files.")
         total_files = len(self.files_to_convert)
-        if total_files == 0:
+        if total_files == 0 and (self.job_queue is None or not self.job_queue.unfinished_count()):
             print("No files to convert in worker.")
             self.finished.emit()
             return
-        for i, (input_path, output_format) in enumerate(self.files_to_convert):
-            if not self.is_running:
-                print("Worker stopped early.")
-                break
-            base_name = os.path.basename(input_path)
-            output_filename = f"{os.path.splitext(base_name)[0]}{output_format}"
-            output_path = os.path.join(self.output_directory, output_filename)
-            self.status.emit(f"({i+1}/{total_files}) Converting {base_name}...", 0)
-            print(f"Converting {input_path} to {output_path}")
-            try:
-                self.converter.convert(input_path, output_path)
-                print(f"Saved: {output_path}")
-            except Exception as e:
-                print(f"Error converting {base_name}: {e}")
-                self.status.emit(f"Error converting {base_name}: {e}", 8000)
-            progress_percentage = int(((i + 1) / total_files) * 100)
-            self.progress.emit(progress_percentage)
+        if self.job_queue is not None:
+            # A new batch runs on its own; an empty one resumes everything left unfinished
+            batch = self.job_queue.add(self.files_to_convert, self.output_directory) if self.files_to_convert else None
+            drain(self.job_queue, self.engine,
+                  on_started=self._on_started,
+                  on_result=self._on_result,
+                  should_stop=lambda: not self.is_running,
+                  batch=batch,
+                  on_progress=self._on_progress)
+            counts = self.job_queue.counts()
+            print(f"Job queue: {counts['pending']} pending, {counts['failed']} failed.")
+            self.job_queue.close()
+        else:
+            self.engine.run(
+                self.files_to_convert,
+                on_started=self._on_started,
+                on_result=self._on_result,
+                should_stop=lambda: not self.is_running,
+                on_progress=self._on_progress,
+            )
+        if not self.is_running:
+            print("Worker stopped early.")
+        if self.engine.cache is not None:
+            print(f"Cache: {self.engine.cache.hits} hits, {self.engine.cache.misses} misses")
+        if self.engine.metrics_log is not None:
+            self.engine.metrics_log.close()
         print("ConversionWorker finished.")
         self.status.emit("Conversion process finished.", 5000)
         self.finished.emit()
 
+    def _on_started(self, index, total_files, input_path):
+        self._total = total_files
+        base_name = os.path.basename(input_path)
+        self.status.emit(f"({index+1}/{total_files}) Converting {base_name}...", 0)
+        print(f"Converting {input_path}")
+
+    def _on_result(self, result, completed, total_files):
+        base_name = os.path.basename(result.input_path)
+        if result.ok:
+            print(f"Saved: {result.output_path}")
+        else:
+            print(f"Error converting {base_name}: {result.error}")
+            self.status.emit(f"Error converting {base_name}: {result.error}", 8000)
+        self._fractions.pop(result.index, None)
+        self._completed = completed
+        self._total = total_files
+        self._emit_progress()
+        if result.metrics is not None:
+            self.metrics.emit(result.metrics)
+        self.summary.emit(self.engine.summary.snapshot())
+
+    def _on_progress(self, index, fraction):
+        self._fractions[index] = fraction
+        self._emit_progress()
+
+    def _emit_progress(self):
+        done = self._completed + sum(self._fractions.values())
+        self.progress.emit(min(100, int(done / self._total * 100)))
+
     def stop(self):
+        """Kills the running conversions and removes their partial outputs."""
         self.is_running = False
+        self.engine.cancel()
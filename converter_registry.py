@@ -0,0 +1,127 @@
+import importlib
+
+CATEGORIES = ["Documents", "Images", "Audio", "Video"]
+
+TEXT_EXTENSIONS = ['.txt', '.py', '.json', '.csv', '.xml', '.html', '.md', '.rtf', '.log', '.ini', '.yaml', '.yml']
+IMAGE_EXTENSIONS = ['.png', '.jpg', '.jpeg', '.bmp', '.gif', '.tiff']
+AUDIO_EXTENSIONS = ['.mp3', '.wav', '.ogg', '.flac']
+VIDEO_EXTENSIONS = ['.mp4', '.avi', '.mov', '.mkv']
+
+# Extensions that name the same format; converting between them is pointless.
+_EQUIVALENT_EXTENSIONS = [{'.jpg', '.jpeg'}]
+
+
+class ConverterBackend:
+    """
+    A converter registered for one or more (input_ext, output_ext) pairs.
+
+    handler may be:
+      - the name of a FileConverter method, e.g. "_convert_image"
+      - a "module:function" string, imported the first time it is used
+      - any callable taking (input_path, output_path)
+
+    fanout is an optional handler of the same kinds taking (input_path,
+    output_paths). It decodes the input once for all of the targets and
+    returns one exception (or None) per output path.
+    """
+
+    def __init__(self, name, category, handler, fanout=None):
+        self.name = name
+        self.category = category
+        self.handler = handler
+        self.fanout = fanout
+        self._resolved = {}
+
+    def _resolve(self, handler, converter):
+        if callable(handler):
+            return handler
+        if ':' not in handler:
+            return getattr(converter, handler)
+        if handler not in self._resolved:
+            module_name, attr = handler.split(':', 1)
+            self._resolved[handler] = getattr(importlib.import_module(module_name), attr)
+        return self._resolved[handler]
+
+    def resolve(self, converter):
+        return self._resolve(self.handler, converter)
+
+    def resolve_fanout(self, converter):
+        return self._resolve(self.fanout, converter)
+
+    def __repr__(self):
+        return f"ConverterBackend({self.name!r}, {self.category!r})"
+
+
+_backends = {}
+_targets_by_input = {}
+
+
+def same_format(input_ext, output_ext):
+    """True if the two extensions are the same or name the same format."""
+    input_ext = input_ext.lower()
+    output_ext = output_ext.lower()
+    return input_ext == output_ext or any({input_ext, output_ext} <= same for same in _EQUIVALENT_EXTENSIONS)
+
+
+def register_backend(name, category, input_exts, output_exts, handler, fanout=None):
+    """
+    Registers handler for every (input_ext, output_ext) combination, skipping
+    identical and equivalent extension pairs. Later registrations override
+    earlier ones for the same pair.
+    """
+    backend = ConverterBackend(name, category, handler, fanout)
+    for input_ext in input_exts:
+        input_ext = input_ext.lower()
+        targets = _targets_by_input.setdefault(input_ext, [])
+        for output_ext in output_exts:
+            output_ext = output_ext.lower()
+            if same_format(input_ext, output_ext):
+                continue
+            if (input_ext, output_ext) not in _backends:
+                targets.append(output_ext)
+            _backends[(input_ext, output_ext)] = backend
+    return backend
+
+
+def get_backend(input_ext, output_ext):
+    return _backends.get((input_ext.lower(), output_ext.lower()))
+
+
+def get_fanout_backend(input_ext, output_ext):
+    """The direct backend for the pair if it can share one decode between several targets."""
+    backend = get_backend(input_ext, output_ext)
+    return backend if backend is not None and backend.fanout is not None else None
+
+
+def get_supported_formats():
+    """
+    Builds the {category: {input_ext: [output_ext, ...]}} mapping from the
+    registered backends. An input belongs to the category of the first
+    backend registered for it.
+    """
+    formats = {category: {} for category in CATEGORIES}
+    for input_ext, targets in _targets_by_input.items():
+        if not targets:
+            continue
+        category = _backends[(input_ext, targets[0])].category
+        formats.setdefault(category, {})[input_ext] = list(targets)
+    return {category: entries for category, entries in formats.items() if entries}
+
+
+def _register_builtin_backends():
+    register_backend("docx_to_pdf", "Documents", ['.docx'], ['.pdf'], "_convert_docx_to_pdf")
+    register_backend("pdf_to_docx", "Documents", ['.pdf'], ['.docx'], "_convert_pdf_to_docx")
+    # Registered before text_copy so .pdf is the first target the UI offers
+    register_backend("text_to_pdf", "Documents", TEXT_EXTENSIONS, ['.pdf'], "_convert_text_to_pdf")
+    register_backend("text_to_docx", "Documents", TEXT_EXTENSIONS, ['.docx'], "_convert_text_to_docx")
+    register_backend("text_copy", "Documents", TEXT_EXTENSIONS, TEXT_EXTENSIONS, "_copy_text_file")
+    register_backend("spreadsheet", "Documents", ['.csv', '.xlsx'], ['.csv', '.xlsx'], "_convert_spreadsheet")
+    register_backend("image", "Images", IMAGE_EXTENSIONS, IMAGE_EXTENSIONS, "_convert_image",
+                     fanout="_convert_image_many")
+    register_backend("audio", "Audio", AUDIO_EXTENSIONS, AUDIO_EXTENSIONS, "_convert_audio",
+                     fanout="_convert_audio_many")
+    register_backend("video", "Video", VIDEO_EXTENSIONS, VIDEO_EXTENSIONS, "_convert_video",
+                     fanout="_convert_video_many")
+
+
+_register_builtin_backends()
@@ -0,0 +1,284 @@
+"""
+Streaming DOCX reader and writer.
+
+word/document.xml is parsed with iterparse straight from the zip archive,
+and each paragraph or table row is handed on as soon as its closing tag
+has been read. Finished elements are cleared right away. Memory therefore
+depends on the largest single block, not on the document. Images and
+other embedded parts are never read.
+
+convert_docx_to_pdf feeds these blocks into the streaming PDF writer of
+text_pdf_engine.
+
+convert_text_to_docx goes the other way for plain text: word/document.xml
+is written into the archive one paragraph per line while the text is read,
+so neither the text nor the document is ever held whole.
+"""
+import posixpath
+import re
+import zipfile
+from xml.sax.saxutils import escape
+import xml.etree.ElementTree as ET
+
+W = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+_REL = '{http://schemas.openxmlformats.org/package/2006/relationships}Relationship'
+_OFFICE_DOCUMENT = '/officeDocument'
+_HEADER = '/header'
+
+# Paragraph style id -> (font resource, size) in the PDF
+STYLE_FONTS = {
+    'Title': ('F2', 20),
+    'Subtitle': ('F3', 14),
+    'Heading1': ('F2', 16),
+    'Heading2': ('F2', 14),
+    'Heading3': ('F2', 13),
+}
+HEADING_FONT = ('F2', 12)
+BODY_FONT = ('F1', 12)
+PARAGRAPH_SPACING = 4
+CELL_PADDING = 6
+BULLET = '• '
+
+
+def _relationships(archive, part):
+    """Returns [(type, target part name)] for the relationships of part."""
+    folder, name = posixpath.split(part)
+    rels_name = posixpath.join(folder, '_rels', name + '.rels')
+    try:
+        root = ET.fromstring(archive.read(rels_name))
+    except KeyError:
+        return []
+    relationships = []
+    for rel in root.iter(_REL):
+        if rel.get('TargetMode') == 'External':
+            continue
+        target = rel.get('Target', '')
+        if target.startswith('/'):
+            target = target.lstrip('/')
+        else:
+            target = posixpath.normpath(posixpath.join(folder, target))
+        relationships.append((rel.get('Type', ''), target))
+    return relationships
+
+
+def main_part(archive):
+    for rel_type, target in _relationships(archive, ''):
+        if rel_type.endswith(_OFFICE_DOCUMENT):
+            return target
+    return 'word/document.xml'
+
+
+def paragraph_text(paragraph):
+    """Returns (text, page_break) for a w:p element; line breaks become '\\n'."""
+    pieces = []
+    page_break = False
+    for elem in paragraph.iter():
+        tag = elem.tag
+        if tag == W + 't':
+            pieces.append(elem.text or '')
+        elif tag == W + 'tab':
+            pieces.append('\t')
+        elif tag == W + 'br':
+            if elem.get(W + 'type') == 'page':
+                page_break = True
+            else:
+                pieces.append('\n')
+        elif tag == W + 'cr':
+            pieces.append('\n')
+    return ''.join(pieces), page_break
+
+
+def paragraph_style(paragraph):
+    """Returns (style id, is list item) for a w:p element."""
+    properties = paragraph.find(W + 'pPr')
+    if properties is None:
+        return None, False
+    style = properties.find(W + 'pStyle')
+    style = style.get(W + 'val') if style is not None else None
+    # Built-in list styles carry their numbering in styles.xml rather than on the paragraph
+    return style, properties.find(W + 'numPr') is not None or bool(style and style.startswith('List'))
+
+
+def iter_blocks(input_path):
+    """
+    Yields the body of a .docx in document order as:
+        ('paragraph', (text, style, list_item, page_break))
+        ('row', [cell_text, ...])   one per row of a top-level table
+        ('table_end', None)
+    Nested tables are flattened into the text of their cell.
+    """
+    with zipfile.ZipFile(input_path) as archive:
+        with archive.open(main_part(archive)) as stream:
+            body = None
+            table_depth = 0
+            paragraph_depth = 0  # text boxes nest paragraphs inside paragraphs
+            for event, elem in ET.iterparse(stream, events=('start', 'end')):
+                tag = elem.tag
+                if event == 'start':
+                    if tag == W + 'body':
+                        body = elem
+                    elif tag == W + 'tbl':
+                        table_depth += 1
+                    elif tag == W + 'p':
+                        paragraph_depth += 1
+                    continue
+                if tag == W + 'p':
+                    paragraph_depth -= 1
+                    if paragraph_depth or table_depth:
+                        continue
+                    text, page_break = paragraph_text(elem)
+                    style, list_item = paragraph_style(elem)
+                    yield 'paragraph', (text, style, list_item, page_break)
+                    if body is not None:
+                        body.clear()
+                elif tag == W + 'tr' and table_depth == 1:
+                    cells = []
+                    for cell in elem.findall(W + 'tc'):
+                        cells.append('\n'.join(paragraph_text(p)[0] for p in cell.iter(W + 'p')))
+                    yield 'row', cells
+                    elem.clear()
+                elif tag == W + 'tbl':
+                    table_depth -= 1
+                    if table_depth == 0:
+                        yield 'table_end', None
+                        if body is not None:
+                            body.clear()
+
+
+def header_text(input_path):
+    """Returns the text of the first non-empty page header, or None."""
+    with zipfile.ZipFile(input_path) as archive:
+        headers = sorted(target for rel_type, target in _relationships(archive, main_part(archive))
+                         if rel_type.endswith(_HEADER))
+        for name in headers:
+            try:
+                root = ET.fromstring(archive.read(name))
+            except KeyError:
+                continue
+            text = ' '.join(paragraph_text(p)[0] for p in root.iter(W + 'p')).strip()
+            if text:
+                return ' '.join(text.split())
+    return None
+
+
+def _style_font(style):
+    if style in STYLE_FONTS:
+        return STYLE_FONTS[style]
+    if style and style.startswith('Heading'):
+        return HEADING_FONT
+    return BODY_FONT
+
+
+def convert_docx_to_pdf(input_path, output_path, options=None):
+    from text_pdf_engine import (FONTS, TAB_SIZE, DEFAULT_COMPRESS_LEVEL, FontMetrics,
+                                 PDFStreamWriter, TextPageBuilder)
+    options = options or {}
+    compress_level = int(options.get('pdf_compress_level', DEFAULT_COMPRESS_LEVEL))
+
+    with open(output_path, 'wb') as out:
+        writer = PDFStreamWriter(out, compress_level)
+        builder = TextPageBuilder(writer.add_page, header=header_text(input_path))
+        width = builder.text_width
+        body_metrics = FontMetrics.get(FONTS[BODY_FONT[0]], BODY_FONT[1])
+        body_leading = BODY_FONT[1] * 4 / 3
+
+        for kind, payload in iter_blocks(input_path):
+            if kind == 'paragraph':
+                text, style, list_item, page_break = payload
+                font, size = _style_font(style)
+                metrics = FontMetrics.get(FONTS[font], size)
+                leading = size * 4 / 3
+                indent = metrics.width(BULLET) if list_item else 0
+                lines = text.expandtabs(TAB_SIZE).split('\n')
+                if lines == ['']:
+                    if page_break:
+                        builder.close()
+                    else:
+                        builder.add_space(leading + PARAGRAPH_SPACING)
+                    continue
+                for number, line in enumerate(lines):
+                    for index, piece in enumerate(metrics.wrap(line.rstrip(), width - indent)):
+                        if list_item and number == 0 and index == 0:
+                            builder.add_line(BULLET + piece, font, size, leading)
+                        else:
+                            builder.add_line(piece, font, size, leading, indent)
+                if page_break:
+                    builder.close()
+                else:
+                    builder.add_space(PARAGRAPH_SPACING)
+            elif kind == 'row':
+                if not payload:
+                    continue
+                column_width = width / len(payload)
+                columns = []
+                for cell in payload:
+                    lines = []
+                    for line in cell.expandtabs(TAB_SIZE).split('\n'):
+                        lines.extend(body_metrics.wrap(line.rstrip(), column_width - CELL_PADDING))
+                    columns.append(lines)
+                builder.add_row(columns, column_width, leading=body_leading)
+                builder.add_space(PARAGRAPH_SPACING / 2)
+            elif kind == 'table_end':
+                builder.add_space(PARAGRAPH_SPACING)
+
+        builder.close()
+        writer.close()
+
+
+_CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/word/document.xml" ContentType="application/'
+    'vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>'
+    '</Types>')
+_PACKAGE_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/'
+    'relationships/officeDocument" Target="word/document.xml"/>'
+    '</Relationships>')
+_DOCUMENT_START = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main"><w:body>')
+# Letter pages with one-inch margins, as in the PDFs of text_pdf_engine
+_DOCUMENT_END = (
+    '<w:sectPr><w:pgSz w:w="12240" w:h="15840"/>'
+    '<w:pgMar w:top="1440" w:right="1440" w:bottom="1440" w:left="1440" '
+    'w:header="720" w:footer="720" w:gutter="0"/></w:sectPr></w:body></w:document>')
+# Control characters XML 1.0 does not allow, even escaped
+_XML_ILLEGAL = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]')
+# Paragraphs collected before one write to the archive
+WRITE_BATCH = 1000
+
+
+def _text_paragraph(line):
+    line = _XML_ILLEGAL.sub('', line.rstrip('\r\n'))
+    if not line:
+        return '<w:p/>'
+    runs = '<w:tab/>'.join('<w:t xml:space="preserve">%s</w:t>' % escape(piece) if piece else ''
+                           for piece in line.split('\t'))
+    return '<w:p><w:r>%s</w:r></w:p>' % runs
+
+
+def convert_text_to_docx(input_path, output_path, options=None):
+    from text_engine import detect_encoding
+    from text_pdf_engine import iter_lines
+    from conversion_metrics import progress_enabled
+    options = options or {}
+    encoding = options.get('text_source_encoding') or detect_encoding(input_path)
+
+    with zipfile.ZipFile(output_path, 'w', zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr('[Content_Types].xml', _CONTENT_TYPES)
+        archive.writestr('_rels/.rels', _PACKAGE_RELS)
+        with archive.open('word/document.xml', 'w', force_zip64=True) as document:
+            document.write(_DOCUMENT_START.encode('utf-8'))
+            batch = []
+            for line in iter_lines(input_path, encoding, report=progress_enabled()):
+                batch.append(_text_paragraph(line))
+                if len(batch) >= WRITE_BATCH:
+                    document.write(''.join(batch).encode('utf-8'))
+                    batch = []
+            batch.append(_DOCUMENT_END)
+            document.write(''.join(batch).encode('utf-8'))
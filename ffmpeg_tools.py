@@ -0,0 +1,121 @@
+import json
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+from conversion_metrics import progress_enabled, report_progress
+
+# Smaller sources finish too quickly for in-file progress to be worth the
+# extra ffmpeg run that finding their duration may take
+PROGRESS_MIN_BYTES = 4 * 1024 * 1024
+
+_DURATION = re.compile(rb'Duration: (\d+):(\d\d):(\d\d(?:\.\d+)?)')
+
+
+def find_executable(name):
+    path = shutil.which(name)
+    if path is None:
+        raise RuntimeError(f"{name} was not found. Please install FFmpeg and make sure it is on your PATH.")
+    return path
+
+
+def find_ffmpeg():
+    return find_executable('ffmpeg')
+
+
+def probe(input_path):
+    """
+    Returns ffprobe's JSON description ({'streams': [...], 'format': {...}})
+    of input_path, or None when ffprobe is not installed.
+    """
+    ffprobe = shutil.which('ffprobe')
+    if ffprobe is None:
+        return None
+    result = subprocess.run(
+        [ffprobe, '-v', 'error', '-show_streams', '-show_format', '-of', 'json', input_path],
+        stdin=subprocess.DEVNULL, capture_output=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"ffprobe error: {result.stderr.decode('utf-8', 'replace').strip()}")
+    return json.loads(result.stdout or b'{}')
+
+
+def streams_of_type(info, codec_type):
+    return [stream for stream in (info or {}).get('streams', []) if stream.get('codec_type') == codec_type]
+
+
+def duration_of(input_path):
+    """Returns the duration of a media file in seconds, or None if it cannot be told."""
+    try:
+        info = probe(input_path)
+    except RuntimeError:
+        return None
+    if info is not None:
+        try:
+            return float(info.get('format', {}).get('duration')) or None
+        except (TypeError, ValueError):
+            return None
+    # Without ffprobe, ffmpeg prints the duration when given an input and no output
+    result = subprocess.run([find_ffmpeg(), '-nostdin', '-hide_banner', '-i', input_path],
+                            stdin=subprocess.DEVNULL, capture_output=True)
+    match = _DURATION.search(result.stderr)
+    if match is None:
+        return None
+    hours, minutes, seconds = match.groups()
+    return int(hours) * 3600 + int(minutes) * 60 + float(seconds) or None
+
+
+def progress_duration(input_path):
+    """The duration to measure ffmpeg's progress against, or None when no progress is wanted."""
+    if not progress_enabled():
+        return None
+    try:
+        if os.path.getsize(input_path) < PROGRESS_MIN_BYTES:
+            return None
+    except OSError:
+        return None
+    return duration_of(input_path)
+
+
+def follow_progress(stream, duration):
+    """Reads ffmpeg -progress output from stream until it closes, reporting the time done."""
+    for line in stream:
+        key, _, value = line.partition(b'=')
+        if key in (b'out_time_us', b'out_time_ms') and duration:
+            # Both keys carry microseconds; the value is N/A until the first frame
+            try:
+                report_progress(int(value) / 1e6 / duration)
+            except ValueError:
+                pass
+
+
+def ffmpeg_command(*args):
+    return [find_ffmpeg(), '-nostdin', '-hide_banner', '-loglevel', 'error', '-y', *args]
+
+
+def run_ffmpeg(*args, duration=None):
+    """
+    Runs ffmpeg with args and raises RuntimeError if it fails. Given the
+    source duration in seconds, the run reports its progress.
+    """
+    if not duration:
+        result = subprocess.run(ffmpeg_command(*args), stdin=subprocess.DEVNULL, capture_output=True)
+        if result.returncode != 0:
+            raise RuntimeError(f"FFmpeg error: {result.stderr.decode('utf-8', 'replace').strip()}")
+        return
+    with tempfile.TemporaryFile() as stderr:
+        process = subprocess.Popen(ffmpeg_command('-progress', 'pipe:1', '-nostats', *args),
+                                   stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=stderr)
+        try:
+            follow_progress(process.stdout, duration)
+            process.wait()
+        except BaseException:
+            process.kill()
+            process.wait()
+            raise
+        finally:
+            process.stdout.close()
+        if process.returncode != 0:
+            stderr.seek(0)
+            raise RuntimeError(f"FFmpeg error: {stderr.read().decode('utf-8', 'replace').strip()}")
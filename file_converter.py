@@ -1,102 +1,155 @@
-from PIL import Image
-from pydub import AudioSegment
-import ffmpeg
-from docx import Document
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import letter
 import os
-try:
-    from pdf2docx import Converter as PDF2DocxConverter
-except ImportError:
-    PDF2DocxConverter = None
+from conversion_planner import plan_for, run_plan
+from converter_registry import get_fanout_backend
+from format_sniffer import resolve_format
+
+# Converter dependencies (Pillow, pydub, ffmpeg-python, python-docx, reportlab,
+# pdf2docx) are imported inside the backend that needs them, so a process
+# only pays for the backends it actually uses.
+
+# Settings that are handed to the backends as converter options
+CONVERTER_SETTINGS = ('pdf_docx_workers', 'pdf_docx_chunk_pages')
+
+
+def converter_options_from_settings(settings_manager):
+    """The backend options set in Settings, for ConversionEngine(converter_options=...)."""
+    # Unset values are left out, so they do not change cache keys
+    return {key: int(settings_manager.get(key)) for key in CONVERTER_SETTINGS if settings_manager.get(key)}
+
 
 class FileConverter:
+    # Bump whenever a backend's output changes, so cached conversions are invalidated
+    VERSION = "7"
+
+    def __init__(self, options=None):
+        self.options = dict(options or {})
+
+    @staticmethod
+    def cache_options(options, output_format):
+        """The converter options as they affect output_format, for cache keys."""
+        options = options or {}
+        key_options = {key: value for key, value in options.items() if key not in CONVERTER_SETTINGS}
+        if output_format.lower() == '.docx':
+            # Reached from PDF directly or through a chain
+            from pdf_docx_engine import cache_options
+            key_options.update(cache_options(options))
+        return key_options
+
     def convert(self, input_path, output_path):
-        _, input_ext = os.path.splitext(input_path)
+        # Routed on the detected content, so a misnamed file still reaches the right backend
+        input_ext = resolve_format(input_path)
         _, output_ext = os.path.splitext(output_path)
-        input_ext = input_ext.lower()
         output_ext = output_ext.lower()
 
         try:
-            if input_ext in ['.png', '.jpg', '.jpeg', '.bmp', '.gif', '.tiff']:
-                self._convert_image(input_path, output_path)
-            elif input_ext in ['.mp3', '.wav', '.ogg', '.flac']:
-                self._convert_audio(input_path, output_path)
-            elif input_ext in ['.mp4', '.avi', '.mov', '.mkv']:
-                self._convert_video(input_path, output_path)
-            elif input_ext == '.docx' and output_ext == '.pdf':
-                self._convert_docx_to_pdf(input_path, output_path)
-            elif input_ext == '.pdf' and output_ext == '.docx':
-                self._convert_pdf_to_docx(input_path, output_path)
-            elif input_ext in ['.txt', '.py', '.json', '.csv', '.xml', '.html', '.md', '.rtf', '.log', '.ini', '.yaml', '.yml']:
-                if output_ext in ['.txt', '.py', '.json', '.csv', '.xml', '.html', '.md', '.rtf', '.log', '.ini', '.yaml', '.yml']:
-                    self._copy_text_file(input_path, output_path)
-                elif output_ext == '.pdf':
-                    self._convert_text_to_pdf(input_path, output_path)
-                else:
-                    raise ValueError(f"Conversion from {input_ext} to {output_ext} is not supported.")
-            else:
+            conversion_plan = plan_for(input_ext, output_ext)
+            if conversion_plan is None:
                 raise ValueError(f"Conversion from {input_ext} to {output_ext} is not supported.")
+            run_plan(conversion_plan, self, input_path, output_path)
         except Exception as e:
-            raise RuntimeError(f"Failed to convert {os.path.basename(input_path)}: {e}")
+            raise RuntimeError(f"Failed to convert {os.path.basename(input_path)}: {e}") from e
+
+    def convert_many(self, input_path, output_paths):
+        """
+        Converts input_path to every path in output_paths and returns one
+        RuntimeError (or None) per output. Targets served by a backend with
+        fan-out support share a single decode of the input.
+        """
+        input_ext = resolve_format(input_path)
+        errors = [None] * len(output_paths)
+        groups = {}
+        for number, output_path in enumerate(output_paths):
+            backend = get_fanout_backend(input_ext, os.path.splitext(output_path)[1])
+            if backend is not None:
+                groups.setdefault(backend, []).append(number)
+                continue
+            try:
+                self.convert(input_path, output_path)
+            except RuntimeError as e:
+                errors[number] = e
+        for backend, numbers in groups.items():
+            if len(numbers) == 1:
+                try:
+                    self.convert(input_path, output_paths[numbers[0]])
+                except RuntimeError as e:
+                    errors[numbers[0]] = e
+                continue
+            try:
+                outcomes = backend.resolve_fanout(self)(input_path, [output_paths[number] for number in numbers])
+            except Exception as e:
+                outcomes = [e] * len(numbers)
+            for number, outcome in zip(numbers, outcomes):
+                if outcome is not None:
+                    error = RuntimeError(f"Failed to convert {os.path.basename(input_path)}: {outcome}")
+                    error.__cause__ = outcome
+                    errors[number] = error
+        return errors
 
     def _convert_pdf_to_docx(self, input_path, output_path):
-        if PDF2DocxConverter is None:
-            raise RuntimeError("pdf2docx is not installed. Please install it with 'pip install pdf2docx'.")
-        converter = PDF2DocxConverter(input_path)
-        converter.convert(output_path, start=0, end=None)
-        converter.close()
+        from pdf_docx_engine import convert_pdf_to_docx
+        convert_pdf_to_docx(input_path, output_path, self.options)
 
     def _convert_image(self, input_path, output_path):
-        with Image.open(input_path) as img:
-            # Handle formats like GIF that may have transparency (alpha channel)
-            if img.mode == 'RGBA' and output_path.lower().endswith(('.jpg', '.jpeg')):
-                img = img.convert('RGB')
-            img.save(output_path)
+        from image_engine import convert_image
+        convert_image(input_path, output_path, self.options)
+
+    def _convert_image_many(self, input_path, output_paths):
+        from image_engine import convert_image_many
+        return convert_image_many(input_path, output_paths, self.options)
 
     def _convert_audio(self, input_path, output_path):
+        if self.options.get('audio_streaming', True):
+            from audio_stream import stream_transcode
+            stream_transcode(input_path, output_path)
+            return
+        # In-memory path: decodes the whole file into an AudioSegment first
+        from pydub import AudioSegment
         _, output_ext = os.path.splitext(output_path)
         audio = AudioSegment.from_file(input_path)
         audio.export(output_path, format=output_ext[1:])
 
+    def _convert_audio_many(self, input_path, output_paths):
+        if self.options.get('audio_streaming', True):
+            from audio_stream import stream_transcode_many
+            return stream_transcode_many(input_path, output_paths)
+        from pydub import AudioSegment
+        audio = AudioSegment.from_file(input_path)
+        errors = []
+        for output_path in output_paths:
+            try:
+                audio.export(output_path, format=os.path.splitext(output_path)[1][1:])
+                errors.append(None)
+            except Exception as e:
+                errors.append(e)
+        return errors
+
     def _convert_video(self, input_path, output_path):
-        try:
-            (
-                ffmpeg
-                .input(input_path)
-                .output(output_path, vcodec='copy', acodec='copy')
-                .run(overwrite_output=True, quiet=True)
-            )
-        except ffmpeg.Error as e:
-            raise RuntimeError(f"FFmpeg error: {e}")
+        from video_engine import convert_video
+        convert_video(input_path, output_path, self.options)
+
+    def _convert_video_many(self, input_path, output_paths):
+        from video_engine import convert_video_many
+        return convert_video_many(input_path, output_paths, self.options)
 
     def _convert_docx_to_pdf(self, input_path, output_path):
-        # A basic implementation. For complex layouts, a more robust library may be needed.
-        doc = Document(input_path)
-        c = canvas.Canvas(output_path, pagesize=letter)
-        width, height = letter
-        y = height - 72
-        for para in doc.paragraphs:
-            if y < 72: # Basic page break
-                c.showPage()
-                y = height - 72
-            c.drawString(72, y, para.text)
-            y -= 20 # Line spacing
-        c.save()
+        from docx_engine import convert_docx_to_pdf
+        convert_docx_to_pdf(input_path, output_path, self.options)
 
     def _copy_text_file(self, input_path, output_path):
-        with open(input_path, 'r', encoding='utf-8') as fin, open(output_path, 'w', encoding='utf-8') as fout:
-            fout.write(fin.read())
+        from text_engine import convert_text
+        convert_text(input_path, output_path, self.options)
+
+    def _convert_spreadsheet(self, input_path, output_path):
+        from spreadsheet_engine import convert_csv_to_xlsx, convert_xlsx_to_csv
+        if resolve_format(input_path) == '.xlsx':
+            convert_xlsx_to_csv(input_path, output_path, self.options)
+        else:
+            convert_csv_to_xlsx(input_path, output_path, self.options)
 
     def _convert_text_to_pdf(self, input_path, output_path):
-        c = canvas.Canvas(output_path, pagesize=letter)
-        width, height = letter
-        y = height - 72
-        with open(input_path, 'r', encoding='utf-8') as fin:
-            for line in fin:
-                if y < 72:
-                    c.showPage()
-                    y = height - 72
-                c.drawString(72, y, line.rstrip())
-                y -= 16
-        c.save()
+        from text_pdf_engine import convert_text_to_pdf
+        convert_text_to_pdf(input_path, output_path, self.options)
+
+    def _convert_text_to_docx(self, input_path, output_path):
+        from docx_engine import convert_text_to_docx
+        convert_text_to_docx(input_path, output_path, self.options)
@@ -0,0 +1,341 @@
+"""
+Model/view file list.
+
+FileListModel keeps one small entry per queued file, and FileItemDelegate
+paints every row itself. No widgets are created per row; the output
+formats of a row are picked from a popup menu that exists only while it
+is open, so the list stays fast with 100k files. Colours, fonts and
+icons are built once per delegate instead of once per row.
+
+A row can have several output formats. Each becomes its own job, and the
+engine converts them from a single decode of the input.
+"""
+import os
+from PyQt6.QtCore import QAbstractListModel, QModelIndex, QPersistentModelIndex, QRectF, QSize, Qt, pyqtSignal
+from PyQt6.QtGui import QBrush, QColor, QFont, QFontMetrics, QLinearGradient, QPainter, QPen
+from PyQt6.QtWidgets import QMenu, QStyle, QStyledItemDelegate
+from format_sniffer import resolve_format, same_format
+
+PathRole = Qt.ItemDataRole.UserRole + 1
+ExtensionRole = Qt.ItemDataRole.UserRole + 2
+TargetsRole = Qt.ItemDataRole.UserRole + 3
+OutputFormatRole = Qt.ItemDataRole.UserRole + 4 # List of selected output formats
+
+ROW_HEIGHT = 64
+
+_ICON_EXTENSIONS = [
+    ('img', ['.png', '.jpg', '.jpeg', '.bmp', '.gif', '.tiff', '.webp']),
+    ('aud', ['.mp3', '.wav', '.ogg', '.flac', '.aac', '.wma', '.m4a']),
+    ('vid', ['.mp4', '.avi', '.mov', '.mkv', '.wmv', '.webm', '.flv', '.mpeg', '.mpg']),
+    ('doc', ['.docx', '.doc', '.odt', '.rtf']),
+    ('pdf', ['.pdf']),
+    ('sheet', ['.xlsx', '.xls', '.csv']),
+    ('ppt', ['.pptx', '.ppt']),
+    ('text', ['.txt', '.py', '.json', '.xml', '.html', '.md', '.log', '.ini', '.yaml', '.yml']),
+    ('archive', ['.zip', '.rar', '.7z', '.tar', '.gz']),
+]
+
+
+def icon_key_for_extension(ext):
+    for key, extensions in _ICON_EXTENSIONS:
+        if ext in extensions:
+            return key
+    return 'unknown'
+
+
+class _FileEntry:
+    __slots__ = ('path', 'name', 'ext', 'targets', 'output_formats')
+
+    def __init__(self, path, ext, targets):
+        self.path = path
+        self.name = os.path.basename(path)
+        self.ext = ext
+        # Shared per extension, never copied per row
+        self.targets = targets
+        self.output_formats = targets[:1]
+
+
+class FileListModel(QAbstractListModel):
+    def __init__(self, supported_formats, parent=None):
+        super().__init__(parent)
+        self._entries = []
+        self.set_supported_formats(supported_formats)
+
+    def set_supported_formats(self, supported_formats):
+        self._targets = {}
+        for formats in supported_formats.values():
+            for ext, targets in formats.items():
+                self._targets.setdefault(ext, list(targets))
+
+    def targets_for(self, ext):
+        return self._targets.get(ext)
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._entries)
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+        entry = self._entries[index.row()]
+        if role == Qt.ItemDataRole.DisplayRole:
+            return entry.name
+        if role == PathRole:
+            return entry.path
+        if role == Qt.ItemDataRole.ToolTipRole:
+            tooltip = entry.path
+            if not same_format(os.path.splitext(entry.name)[1].lower(), entry.ext):
+                tooltip += f"\nDetected as {entry.ext.upper()[1:]} from its content"
+            if len(entry.output_formats) > 1:
+                tooltip += f"\nConverting to {', '.join(entry.output_formats)}"
+            return tooltip
+        if role == ExtensionRole:
+            return entry.ext
+        if role == TargetsRole:
+            return entry.targets
+        if role == OutputFormatRole:
+            return entry.output_formats
+        return None
+
+    def setData(self, index, value, role=Qt.ItemDataRole.EditRole):
+        """Sets the output formats of a row; value is a format or a non-empty list of them."""
+        if not index.isValid() or role not in (Qt.ItemDataRole.EditRole, OutputFormatRole):
+            return False
+        entry = self._entries[index.row()]
+        formats = [value] if isinstance(value, str) else list(value)
+        if not formats or any(output_format not in entry.targets for output_format in formats):
+            return False
+        # Kept in the order the targets are offered
+        entry.output_formats = [target for target in entry.targets if target in formats]
+        self.dataChanged.emit(index, index, [OutputFormatRole])
+        return True
+
+    def flags(self, index):
+        if not index.isValid():
+            return Qt.ItemFlag.NoItemFlags
+        return Qt.ItemFlag.ItemIsEnabled | Qt.ItemFlag.ItemIsSelectable | Qt.ItemFlag.ItemIsEditable
+
+    def add_files(self, file_paths):
+        """
+        Appends the supported files in one insert; returns the unsupported
+        paths. Files are typed by their content, not their name.
+        """
+        entries = []
+        unsupported = []
+        for file_path in file_paths:
+            ext = resolve_format(file_path)
+            targets = self._targets.get(ext)
+            if targets:
+                entries.append(_FileEntry(file_path, ext, targets))
+            else:
+                unsupported.append(file_path)
+        if entries:
+            first = len(self._entries)
+            self.beginInsertRows(QModelIndex(), first, first + len(entries) - 1)
+            self._entries.extend(entries)
+            self.endInsertRows()
+        return unsupported
+
+    def remove_rows(self, rows):
+        rows = sorted(set(rows), reverse=True)
+        if not rows:
+            return
+        if len(rows) > 1000:
+            # A reset is far cheaper than thousands of separate removals
+            doomed = set(rows)
+            self.beginResetModel()
+            self._entries = [entry for row, entry in enumerate(self._entries) if row not in doomed]
+            self.endResetModel()
+            return
+        # Remove contiguous runs from the bottom up so earlier rows keep their indexes
+        start = end = rows[0]
+        for row in rows[1:] + [None]:
+            if row is not None and row == start - 1:
+                start = row
+                continue
+            self.beginRemoveRows(QModelIndex(), start, end)
+            del self._entries[start:end + 1]
+            self.endRemoveRows()
+            if row is not None:
+                start = end = row
+
+    def clear(self):
+        self.beginResetModel()
+        self._entries = []
+        self.endResetModel()
+
+    def unassigned_count(self):
+        """Number of rows without an output format."""
+        return sum(1 for entry in self._entries if not entry.output_formats)
+
+    def jobs(self):
+        """Returns [(input_path, output_format)] for every selected target of every row."""
+        return [(entry.path, output_format) for entry in self._entries for output_format in entry.output_formats]
+
+
+class _FormatMenu(QMenu):
+    """A menu of checkable formats that stays open while formats are toggled."""
+
+    def mouseReleaseEvent(self, event):
+        action = self.actionAt(event.position().toPoint())
+        if action is not None and action.isCheckable():
+            action.trigger()
+            return
+        super().mouseReleaseEvent(event)
+
+
+class FileItemDelegate(QStyledItemDelegate):
+    """
+    Paints a file row: icon, name, extension badge, output-format box and
+    remove button. Clicking the format box opens a menu where one or more
+    output formats are checked.
+    """
+    remove_requested = pyqtSignal(int)
+
+    def __init__(self, icons, view):
+        super().__init__(view)
+        self.view = view
+        self.icon_pixmaps = {key: icon.pixmap(32, 32) for key, icon in icons.items()}
+        self.remove_pixmap = icons['remove'].pixmap(20, 20)
+        self._icon_keys = {}
+
+        # Everything below is built once and reused for every painted row
+        self.card_gradient = QLinearGradient(0, 0, 1, 1)
+        self.card_gradient.setCoordinateMode(QLinearGradient.CoordinateMode.ObjectBoundingMode)
+        self.card_gradient.setColorAt(0, QColor('#2B2D4A'))
+        self.card_gradient.setColorAt(1, QColor('#3A1C71'))
+        self.card_brush = QBrush(self.card_gradient)
+        self.card_pen = QPen(QColor('#5A5CFF'), 1.5)
+        self.hover_pen = QPen(QColor('#7F53FF'), 2)
+        self.selected_brush = QBrush(QColor('#0078D4'))
+
+        badge_gradient = QLinearGradient(0, 0, 1, 1)
+        badge_gradient.setCoordinateMode(QLinearGradient.CoordinateMode.ObjectBoundingMode)
+        badge_gradient.setColorAt(0, QColor('#5A5CFF'))
+        badge_gradient.setColorAt(1, QColor('#7F53FF'))
+        self.badge_brush = QBrush(badge_gradient)
+
+        combo_gradient = QLinearGradient(0, 0, 1, 1)
+        combo_gradient.setCoordinateMode(QLinearGradient.CoordinateMode.ObjectBoundingMode)
+        combo_gradient.setColorAt(0, QColor('#23242A'))
+        combo_gradient.setColorAt(1, QColor('#5A5CFF'))
+        self.combo_brush = QBrush(combo_gradient)
+        self.accent_pen = QPen(QColor('#7F53FF'), 1.5)
+
+        self.name_pen = QPen(QColor('#E0E6F8'))
+        self.light_pen = QPen(QColor('#F5F5F7'))
+        self.name_font = QFont(view.font())
+        self.name_font.setPixelSize(16)
+        self.name_font.setWeight(QFont.Weight.DemiBold)
+        self.name_metrics = QFontMetrics(self.name_font)
+        self.badge_font = QFont(view.font())
+        self.badge_font.setPixelSize(13)
+        self.badge_font.setWeight(QFont.Weight.Bold)
+        self.combo_font = QFont(view.font())
+        self.combo_font.setPixelSize(15)
+        self.combo_font.setWeight(QFont.Weight.DemiBold)
+
+    # Row geometry, shared by painting, hit testing and the editor
+    def _card_rect(self, option):
+        return QRectF(option.rect).adjusted(2, 6, -2, -6)
+
+    def _remove_rect(self, option):
+        card = self._card_rect(option)
+        return QRectF(card.right() - 16 - 36, card.center().y() - 16, 36, 32)
+
+    def _combo_rect(self, option):
+        remove = self._remove_rect(option)
+        return QRectF(remove.left() - 20 - 120, remove.top(), 120, 32)
+
+    def _badge_rect(self, option):
+        combo = self._combo_rect(option)
+        return QRectF(combo.left() - 20 - 64, combo.center().y() - 13, 64, 26)
+
+    def sizeHint(self, option, index):
+        return QSize(option.rect.width(), ROW_HEIGHT)
+
+    def paint(self, painter, option, index):
+        entry_ext = index.data(ExtensionRole)
+        painter.save()
+        painter.setRenderHint(QPainter.RenderHint.Antialiasing)
+
+        card = self._card_rect(option)
+        selected = bool(option.state & QStyle.StateFlag.State_Selected)
+        hovered = bool(option.state & QStyle.StateFlag.State_MouseOver)
+        painter.setPen(self.hover_pen if hovered else self.card_pen)
+        painter.setBrush(self.selected_brush if selected else self.card_brush)
+        painter.drawRoundedRect(card, 16, 16)
+
+        icon_key = self._icon_keys.get(entry_ext)
+        if icon_key is None:
+            icon_key = self._icon_keys[entry_ext] = icon_key_for_extension(entry_ext)
+        pixmap = self.icon_pixmaps.get(icon_key) or self.icon_pixmaps['unknown']
+        icon_left = int(card.left()) + 16
+        painter.drawPixmap(icon_left, int(card.center().y()) - 16, pixmap)
+
+        badge = self._badge_rect(option)
+        name_rect = QRectF(icon_left + 32 + 26, card.top(), badge.left() - 20 - (icon_left + 58), card.height())
+        painter.setFont(self.name_font)
+        painter.setPen(self.name_pen)
+        name = self.name_metrics.elidedText(index.data(Qt.ItemDataRole.DisplayRole),
+                                            Qt.TextElideMode.ElideMiddle, int(name_rect.width()))
+        painter.drawText(name_rect, Qt.AlignmentFlag.AlignVCenter | Qt.AlignmentFlag.AlignLeft, name)
+
+        painter.setPen(self.accent_pen)
+        painter.setBrush(self.badge_brush)
+        painter.drawRoundedRect(badge, 10, 10)
+        painter.setFont(self.badge_font)
+        painter.setPen(self.light_pen)
+        painter.drawText(badge, Qt.AlignmentFlag.AlignCenter, entry_ext.upper()[1:] if len(entry_ext) > 1 else "?")
+
+        combo = self._combo_rect(option)
+        painter.setPen(self.accent_pen)
+        painter.setBrush(self.combo_brush)
+        painter.drawRoundedRect(combo, 10, 10)
+        painter.setFont(self.combo_font)
+        painter.setPen(self.name_pen)
+        formats = index.data(OutputFormatRole)
+        label = formats[0] if len(formats) == 1 else f"{formats[0]} +{len(formats) - 1}"
+        painter.drawText(combo.adjusted(14, 0, -24, 0), Qt.AlignmentFlag.AlignVCenter | Qt.AlignmentFlag.AlignLeft, label)
+        painter.drawText(combo.adjusted(0, 0, -10, 0), Qt.AlignmentFlag.AlignVCenter | Qt.AlignmentFlag.AlignRight, "▾")
+
+        remove = self._remove_rect(option)
+        painter.setPen(self.accent_pen)
+        painter.setBrush(self.badge_brush)
+        painter.drawRoundedRect(remove, 10, 10)
+        painter.drawPixmap(int(remove.center().x()) - 10, int(remove.center().y()) - 10, self.remove_pixmap)
+        painter.restore()
+
+    def editorEvent(self, event, model, option, index):
+        if event.type() == event.Type.MouseButtonRelease and event.button() == Qt.MouseButton.LeftButton:
+            position = event.position()
+            if self._remove_rect(option).contains(position):
+                self.remove_requested.emit(index.row())
+                return True
+            if self._combo_rect(option).contains(position):
+                self.show_format_menu(model, index, self._combo_rect(option))
+                return True
+        return super().editorEvent(event, model, option, index)
+
+    def show_format_menu(self, model, index, rect):
+        """Pops up the output formats of a row below rect; at least one stays checked."""
+        row = QPersistentModelIndex(index)
+        menu = _FormatMenu(self.view)
+        selected = set(index.data(OutputFormatRole))
+        actions = []
+        for target in index.data(TargetsRole) or []:
+            action = menu.addAction(target)
+            action.setCheckable(True)
+            action.setChecked(target in selected)
+            actions.append(action)
+
+        def toggled(action):
+            formats = [a.text() for a in actions if a.isChecked()]
+            if not formats:
+                action.setChecked(True)
+                return
+            if row.isValid():
+                model.setData(model.index(row.row(), 0), formats, OutputFormatRole)
+
+        menu.triggered.connect(toggled)
+        menu.exec(self.view.viewport().mapToGlobal(rect.bottomLeft().toPoint()))
+        menu.deleteLater()
@@ -0,0 +1,91 @@
+"""
+Directory scanning shared by the GUI and the command line.
+
+iter_files walks directories with an explicit os.scandir stack, so no
+per-entry stat is needed unless a size filter asks for it. It applies
+include/exclude globs and size limits and yields matching files as they
+are found.
+"""
+import fnmatch
+import os
+
+# Version-control and build directories nobody wants to convert
+DEFAULT_EXCLUDE = ['.git', '.svn', '.hg', '__pycache__', 'node_modules']
+
+
+def parse_patterns(text):
+    """Splits a comma or semicolon separated pattern list, e.g. from a settings field."""
+    if not text:
+        return []
+    if isinstance(text, (list, tuple)):
+        return [pattern for pattern in text if pattern]
+    return [pattern.strip() for pattern in text.replace(';', ',').split(',') if pattern.strip()]
+
+
+def _matches(name, relative_path, patterns):
+    name = name.lower()
+    relative_path = relative_path.lower().replace(os.sep, '/')
+    return any(fnmatch.fnmatchcase(name, pattern) or fnmatch.fnmatchcase(relative_path, pattern)
+               for pattern in patterns)
+
+
+def iter_files(paths, recursive=True, include=None, exclude=None, extensions=None,
+               min_size=None, max_size=None, should_stop=None):
+    """
+    Yields the files under paths. Plain file paths are yielded as given.
+    Directories are expanded (recursively unless recursive is False):
+      - include: glob patterns a file name or relative path must match
+      - exclude: glob patterns that drop files and whole directories
+      - extensions: lowercase extensions to keep, e.g. {'.png', '.mp3'}
+      - min_size/max_size: byte limits
+    Patterns are matched case-insensitively. should_stop() is polled
+    between directory entries.
+    """
+    include = [pattern.lower() for pattern in include or []]
+    exclude = [pattern.lower() for pattern in exclude or []]
+    if should_stop is None:
+        should_stop = lambda: False
+    for path in paths:
+        if should_stop():
+            return
+        if not os.path.isdir(path):
+            yield path
+            continue
+        stack = [path]
+        while stack:
+            directory = stack.pop()
+            try:
+                with os.scandir(directory) as iterator:
+                    entries = sorted(iterator, key=lambda e: e.name)
+            except OSError:
+                continue
+            subdirectories = []
+            for entry in entries:
+                if should_stop():
+                    return
+                relative_path = os.path.relpath(entry.path, path)
+                if exclude and _matches(entry.name, relative_path, exclude):
+                    continue
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        if recursive:
+                            subdirectories.append(entry.path)
+                        continue
+                    if not entry.is_file():
+                        continue
+                except OSError:
+                    continue
+                if extensions is not None and os.path.splitext(entry.name)[1].lower() not in extensions:
+                    continue
+                if include and not _matches(entry.name, relative_path, include):
+                    continue
+                if min_size is not None or max_size is not None:
+                    try:
+                        size = entry.stat().st_size
+                    except OSError:
+                        continue
+                    if (min_size is not None and size < min_size) or (max_size is not None and size > max_size):
+                        continue
+                yield entry.path
+            # Pushed in reverse so sub-directories are visited in name order
+            stack.extend(reversed(subdirectories))
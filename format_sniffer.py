@@ -0,0 +1,182 @@
+"""
+Content-based format detection.
+
+sniff() reads a small header (os.pread where available) and recognises
+formats by their magic bytes. ZIP containers are told apart by their
+member names, and text files by the absence of binary bytes. Results are
+memoised by (path, size, mtime), so repeated lookups while a batch is
+queued, scanned or converted never touch the file again.
+
+resolve_format() turns a detection into the extension the converter
+registry is keyed by. It falls back to the file's own extension when the
+content is not recognised.
+"""
+import os
+import threading
+import zipfile
+from collections import OrderedDict
+
+HEADER_SIZE = 4096
+CACHE_SIZE = 200000
+TEXT = 'text'
+
+# Extensions that name the same format; a match on either counts as agreement
+_ALIASES = {'.jpeg': '.jpg', '.tif': '.tiff', '.yml': '.yaml', '.mpg': '.mpeg', '.tgz': '.gz'}
+
+_ZIP_MARKERS = [
+    ('word/document.xml', '.docx'),
+    ('xl/workbook.xml', '.xlsx'),
+    ('ppt/presentation.xml', '.pptx'),
+]
+_MP4_QUICKTIME_BRANDS = {b'qt  '}
+_MP4_AUDIO_BRANDS = {b'M4A ', b'M4B '}
+_QUICKTIME_ATOMS = {b'moov', b'mdat', b'wide', b'free', b'skip', b'pnot'}
+
+_cache = OrderedDict()
+_lock = threading.Lock()
+
+
+def _read_header(path, size=HEADER_SIZE):
+    fd = os.open(path, os.O_RDONLY | getattr(os, 'O_BINARY', 0))
+    try:
+        if hasattr(os, 'pread'):
+            return os.pread(fd, size, 0)
+        return os.read(fd, size)
+    finally:
+        os.close(fd)
+
+
+def _sniff_zip(path):
+    try:
+        with zipfile.ZipFile(path) as archive:
+            names = set(archive.namelist())
+    except (zipfile.BadZipFile, OSError):
+        return '.zip'
+    for marker, ext in _ZIP_MARKERS:
+        if marker in names:
+            return ext
+    return '.zip'
+
+
+def _looks_like_text(header):
+    if header.startswith((b'\xef\xbb\xbf', b'\xff\xfe', b'\xfe\xff')):
+        return True
+    if b'\x00' in header:
+        return False
+    # Allow common control characters; anything else below 0x20 means binary
+    control = sum(1 for byte in header if byte < 0x20 and byte not in (9, 10, 12, 13, 27))
+    return control <= len(header) // 100
+
+
+def detect(header, path=None):
+    """Returns the extension of the format in header, TEXT, or None if unknown."""
+    if not header:
+        return None
+    if header.startswith(b'\x89PNG\r\n\x1a\n'):
+        return '.png'
+    if header.startswith(b'\xff\xd8\xff'):
+        return '.jpg'
+    if header.startswith((b'GIF87a', b'GIF89a')):
+        return '.gif'
+    if header.startswith((b'II*\x00', b'MM\x00*')):
+        return '.tiff'
+    if header.startswith(b'BM') and len(header) >= 14 and header[6:10] == b'\x00\x00\x00\x00':
+        return '.bmp'
+    if header.startswith(b'RIFF') and len(header) >= 12:
+        return {b'WAVE': '.wav', b'AVI ': '.avi', b'WEBP': '.webp'}.get(header[8:12])
+    if header.startswith(b'%PDF-') or b'%PDF-' in header[:1024]:
+        return '.pdf'
+    if header.startswith(b'PK\x03\x04'):
+        return _sniff_zip(path) if path else '.zip'
+    if len(header) >= 262 and header[257:262] == b'ustar':
+        return '.tar'
+    if header.startswith(b'\x1f\x8b'):
+        return '.gz'
+    if header.startswith(b'BZh') and header[4:10] == b'1AY&SY':
+        return '.bz2'
+    if header.startswith(b'\xfd7zXZ\x00'):
+        return '.xz'
+    if header.startswith(b"7z\xbc\xaf'\x1c"):
+        return '.7z'
+    if header.startswith(b'Rar!\x1a\x07'):
+        return '.rar'
+    if header.startswith(b'OggS'):
+        return '.ogg'
+    if header.startswith(b'fLaC'):
+        return '.flac'
+    if header.startswith(b'ID3'):
+        return '.mp3'
+    if header.startswith(b'\x1a\x45\xdf\xa3'):
+        return '.webm' if b'webm' in header[:64] else '.mkv'
+    # ISO-BMFF boxes start with a big-endian size; the zero high byte keeps
+    # text such as "The free..." from matching an atom name
+    if len(header) >= 12 and header[0] == 0 and header[4:8] == b'ftyp':
+        brand = header[8:12]
+        if brand in _MP4_QUICKTIME_BRANDS:
+            return '.mov'
+        if brand in _MP4_AUDIO_BRANDS:
+            return '.m4a'
+        return '.mp4'
+    if len(header) >= 8 and header[0] == 0 and header[4:8] in _QUICKTIME_ATOMS:
+        return '.mov'
+    if header.startswith(b'{\\rtf'):
+        return '.rtf'
+    # MPEG audio frame sync without an ID3 tag: 11 set bits and a valid layer
+    if len(header) >= 2 and header[0] == 0xFF and header[1] & 0xE0 == 0xE0 and header[1] & 0x06:
+        return '.mp3'
+    if _looks_like_text(header):
+        return TEXT
+    return None
+
+
+def sniff(path):
+    """
+    Returns the detected format of path (an extension or TEXT), or None when
+    the content is not recognised or the file cannot be read.
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    key = (path, stat.st_size, stat.st_mtime_ns)
+    with _lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            return _cache[key]
+    try:
+        detected = detect(_read_header(path), path)
+    except OSError:
+        return None
+    with _lock:
+        _cache[key] = detected
+        if len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+    return detected
+
+
+def same_format(ext_a, ext_b):
+    return _ALIASES.get(ext_a, ext_a) == _ALIASES.get(ext_b, ext_b)
+
+
+def resolve_format(path, text_extensions=None):
+    """
+    Returns the lowercase extension path should be converted as. The
+    detected format wins over a wrong extension; text keeps its own
+    extension when that is a known text type (.py, .csv, ...).
+    """
+    ext = os.path.splitext(path)[1].lower()
+    detected = sniff(path)
+    if detected is None:
+        return ext
+    if detected == TEXT:
+        if text_extensions is None:
+            from converter_registry import TEXT_EXTENSIONS as text_extensions
+        return ext if ext in text_extensions else '.txt'
+    if same_format(detected, ext):
+        return ext
+    return detected
+
+
+def clear_cache():
+    with _lock:
+        _cache.clear()
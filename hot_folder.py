@@ -0,0 +1,438 @@
+"""
+Hot-folder daemon: converts files as they are dropped into watched folders.
+
+    python -m hot_folder /srv/ingest --to .pdf --out /srv/converted
+
+Folders, target formats and the output directory default to the
+watch_folders, watch_output_format and watch_output_directory settings
+(falling back to output_directory). New files are picked up through
+inotify on Linux, with a rescan every poll interval because inotify does
+not see writes made by other machines on a network share. A file is only
+taken once its size and modification time have stayed the same for
+settle_seconds, so half-copied files are left alone. A dropped ZIP or
+TAR archive has its members converted into a folder named after it (see
+archive_source).
+
+Several daemons, on one machine or many, may watch the same folder. A
+daemon takes a file by renaming it into its own claim directory,
+
+    <folder>/.pxconvert-processing/<host>-<pid>/
+
+which only one of them can do. It takes no more files than it has workers,
+so the others get a share. Converted sources are moved to
+.pxconvert-done/, failed ones to .pxconvert-failed/ next to a .error.txt
+note. A daemon touches its claim directory while it runs. If the daemon
+dies, its claims go back to the folder: at once on the same host, and
+after stale_seconds without a touch on any host.
+"""
+import argparse
+import ctypes
+import ctypes.util
+import os
+import select
+import signal
+import socket
+import sys
+import threading
+import tarfile
+import time
+import zipfile
+from archive_source import convert_archive, is_archive
+from conversion_cache import ConversionCache, cache_from_settings
+from conversion_engine import ConversionEngine, get_category
+from conversion_metrics import MetricsLog, metrics_log_from_settings
+from file_converter import converter_options_from_settings
+from file_scanner import DEFAULT_EXCLUDE, iter_files, parse_patterns
+from format_sniffer import resolve_format
+from job_queue import _process_alive
+from pxconvert import emit, normalize_format
+from settings_manager import SettingsManager
+from utils import get_supported_formats
+
+DEFAULT_SETTLE_SECONDS = 5.0
+DEFAULT_POLL_SECONDS = 10.0
+DEFAULT_STALE_SECONDS = 300.0
+# Claim directories are touched this often; must stay well below stale_seconds
+HEARTBEAT_SECONDS = 30.0
+
+PROCESSING_DIR = '.pxconvert-processing'
+DONE_DIR = '.pxconvert-done'
+FAILED_DIR = '.pxconvert-failed'
+
+# inotify events that can mean a new or finished file
+_IN_CLOSE_WRITE = 0x008
+_IN_MOVED_TO = 0x080
+_IN_CREATE = 0x100
+_WATCH_MASK = _IN_CLOSE_WRITE | _IN_MOVED_TO | _IN_CREATE
+
+
+class _Inotify:
+    """Minimal inotify binding through libc: wait() returns once a watched folder changes."""
+
+    def __init__(self, folders):
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        for folder in folders:
+            if libc.inotify_add_watch(self.fd, os.fsencode(folder), _WATCH_MASK) < 0:
+                errno = ctypes.get_errno()
+                os.close(self.fd)
+                raise OSError(errno, f"Cannot watch {folder}")
+
+    def wait(self, timeout):
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return False
+        # The events only wake the loop; the folders are rescanned anyway
+        try:
+            while os.read(self.fd, 64 * 1024):
+                pass
+        except BlockingIOError:
+            pass
+        return True
+
+    def close(self):
+        os.close(self.fd)
+
+
+class _Poller:
+    def wait(self, timeout):
+        time.sleep(timeout)
+        return False
+
+    def close(self):
+        pass
+
+
+def open_watcher(folders):
+    """Returns an inotify watcher on Linux, or a plain sleeper where inotify is unavailable."""
+    if sys.platform.startswith('linux'):
+        try:
+            return _Inotify(folders)
+        except (OSError, AttributeError) as e:
+            print(f"inotify unavailable ({e}), polling instead.")
+    return _Poller()
+
+
+def _unique_path(directory, name):
+    path = os.path.join(directory, name)
+    stem, ext = os.path.splitext(name)
+    number = 1
+    while os.path.lexists(path):
+        path = os.path.join(directory, f"{stem}-{number}{ext}")
+        number += 1
+    return path
+
+
+class HotFolderDaemon:
+    def __init__(self, folders, output_formats, engine, settle_seconds=DEFAULT_SETTLE_SECONDS,
+                 poll_seconds=DEFAULT_POLL_SECONDS, stale_seconds=DEFAULT_STALE_SECONDS,
+                 include=None, exclude=None):
+        self.folders = [os.path.abspath(folder) for folder in folders]
+        self.output_formats = list(output_formats)
+        self.engine = engine
+        self.settle_seconds = float(settle_seconds)
+        self.poll_seconds = float(poll_seconds)
+        self.stale_seconds = float(stale_seconds)
+        self.include = include
+        # Dot files cover our own directories and the temporary names of rsync, browsers etc.
+        self.exclude = list(exclude or []) + ['.*']
+        self.instance = f"{socket.gethostname()}-{os.getpid()}"
+        self.supported_formats = get_supported_formats()
+        # path -> (size, mtime_ns, when that state was first seen)
+        self._seen = {}
+        # (path, size, mtime_ns) of files that cannot be converted to any target
+        self._skipped = set()
+        # claimed path -> the folder it came from
+        self._claimed = {}
+        self._stop = threading.Event()
+
+    def _claim_dir(self, folder):
+        return os.path.join(folder, PROCESSING_DIR, self.instance)
+
+    def stop(self):
+        """Ends run() after the current batch. May be called from any thread."""
+        self._stop.set()
+        self.engine.cancel()
+
+    def run(self, once=False):
+        """
+        Watches the folders until stop() is called. With once, converts what
+        is there (waiting for it to settle) and returns.
+        """
+        for folder in self.folders:
+            os.makedirs(self._claim_dir(folder), exist_ok=True)
+        watcher = open_watcher(self.folders)
+        heartbeat = threading.Thread(target=self._heartbeat, daemon=True)
+        heartbeat.start()
+        try:
+            while not self._stop.is_set():
+                self.recover()
+                ready, waiting = self.scan()
+                claimed = self.claim(ready)
+                if claimed:
+                    self.process(claimed)
+                    continue
+                if once and not waiting:
+                    break
+                # Come back when the next file could have settled, or at the next rescan
+                watcher.wait(min(self.poll_seconds, self.settle_seconds) if waiting else self.poll_seconds)
+        finally:
+            self._stop.set()
+            watcher.close()
+            self.release()
+            for folder in self.folders:
+                try:
+                    os.rmdir(self._claim_dir(folder))
+                except OSError:
+                    pass
+
+    def _heartbeat(self):
+        while not self._stop.wait(HEARTBEAT_SECONDS):
+            for folder in self.folders:
+                try:
+                    os.utime(self._claim_dir(folder))
+                except OSError as e:
+                    print(f"Hot folder heartbeat failed for {folder}: {e}")
+
+    def scan(self):
+        """Returns (settled files, number of files still being written)."""
+        now = time.monotonic()
+        ready = []
+        waiting = 0
+        present = set()
+        for folder in self.folders:
+            for path in iter_files([folder], recursive=False, include=self.include, exclude=self.exclude):
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                present.add(path)
+                state = (stat.st_size, stat.st_mtime_ns)
+                if (path, *state) in self._skipped:
+                    continue
+                previous = self._seen.get(path)
+                if previous is None or previous[:2] != state:
+                    self._seen[path] = (*state, now)
+                    waiting += 1
+                elif now - previous[2] < self.settle_seconds:
+                    waiting += 1
+                elif self._targets(path):
+                    ready.append((folder, path))
+                else:
+                    print(f"Hot folder: no conversion of {path} to {', '.join(self.output_formats)}, leaving it.")
+                    self._skipped.add((path, *state))
+        for path in set(self._seen) - present:
+            del self._seen[path]
+        self._skipped = {entry for entry in self._skipped if entry[0] in present}
+        return ready, waiting
+
+    def _targets(self, path):
+        if is_archive(path):
+            # Whether any member converts is only known once it is read
+            return list(self.output_formats)
+        category = get_category(path, self.supported_formats)
+        targets = self.supported_formats.get(category, {}).get(resolve_format(path), [])
+        return [output_format for output_format in self.output_formats if output_format in targets]
+
+    def claim(self, ready):
+        """
+        Moves up to one file per worker into this daemon's claim directory.
+        The rename is atomic, so a file claimed by another daemon in the
+        meantime is simply skipped.
+        """
+        claimed = []
+        for folder, path in ready:
+            if len(claimed) >= self.engine.max_workers:
+                break
+            destination = _unique_path(self._claim_dir(folder), os.path.basename(path))
+            try:
+                os.rename(path, destination)
+            except FileNotFoundError:
+                continue
+            except OSError as e:
+                print(f"Hot folder: could not claim {path}: {e}")
+                continue
+            self._seen.pop(path, None)
+            self._claimed[destination] = folder
+            claimed.append(destination)
+        return claimed
+
+    def process(self, claimed):
+        jobs = []
+        owners = []
+        archives = [path for path in claimed if is_archive(path)]
+        for path in claimed:
+            if path in archives:
+                continue
+            for output_format in self._targets(path):
+                jobs.append((path, output_format))
+                owners.append(path)
+        errors = {path: [] for path in claimed}
+        finished = set()
+        for result in self.engine.run(jobs):
+            path = owners[result.index]
+            finished.add(path)
+            self._emit(result)
+            if not result.ok:
+                errors[path].append(f"{os.path.splitext(result.output_path)[1]}: {result.error}")
+        for path in archives:
+            if self._stop.is_set():
+                break
+            try:
+                results = convert_archive(path, self.output_formats, self.engine, should_stop=self._stop.is_set,
+                                          on_result=lambda result, name: self._emit(result))
+            except (OSError, ValueError, EOFError, zipfile.BadZipFile, tarfile.TarError) as e:
+                errors[path].append(f"Could not read archive: {e}")
+            else:
+                errors[path] += [f"{result.input_path}: {result.error}" for result in results if not result.ok]
+            if not self._stop.is_set():
+                finished.add(path)
+        for path in claimed:
+            if path not in finished:
+                # Stopped before it ran; release() hands it back
+                continue
+            self._settle_claim(path, errors[path])
+
+    def _emit(self, result):
+        record = result.to_dict()
+        record["status"] = "converted" if result.ok else "failed"
+        emit(record)
+
+    def _settle_claim(self, path, errors):
+        folder = self._claimed.pop(path)
+        directory = os.path.join(folder, FAILED_DIR if errors else DONE_DIR)
+        try:
+            os.makedirs(directory, exist_ok=True)
+            destination = _unique_path(directory, os.path.basename(path))
+            os.rename(path, destination)
+            if errors:
+                with open(destination + '.error.txt', 'w', encoding='utf-8') as f:
+                    f.write("\n".join(errors) + "\n")
+        except FileNotFoundError:
+            print(f"Hot folder: {path} was taken back by another daemon.")
+        except OSError as e:
+            print(f"Hot folder: could not move {path}: {e}")
+
+    def release(self):
+        """Returns the files this daemon claimed but did not finish to their folders."""
+        for path, folder in list(self._claimed.items()):
+            try:
+                os.rename(path, _unique_path(folder, os.path.basename(path)))
+            except OSError as e:
+                print(f"Hot folder: could not release {path}: {e}")
+        self._claimed.clear()
+
+    def recover(self):
+        """Hands the claims of dead or silent daemons back to their folders."""
+        host = socket.gethostname()
+        now = time.time()
+        for folder in self.folders:
+            root = os.path.join(folder, PROCESSING_DIR)
+            try:
+                instances = os.listdir(root)
+            except OSError:
+                continue
+            for instance in instances:
+                if instance == self.instance:
+                    continue
+                directory = os.path.join(root, instance)
+                owner_host, _, pid = instance.rpartition('-')
+                try:
+                    if owner_host == host and pid.isdigit():
+                        stale = not _process_alive(int(pid))
+                    else:
+                        stale = now - os.stat(directory).st_mtime > self.stale_seconds
+                    if not stale:
+                        continue
+                    names = os.listdir(directory)
+                except OSError:
+                    continue
+                for name in names:
+                    try:
+                        os.rename(os.path.join(directory, name), _unique_path(folder, name))
+                    except OSError:
+                        # Another daemon recovered it first
+                        continue
+                    print(f"Hot folder: recovered {name} from {instance}.")
+                try:
+                    os.rmdir(directory)
+                except OSError:
+                    pass
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="hot_folder",
+        description="Convert files dropped into watched folders.",
+    )
+    parser.add_argument("folders", nargs="*", help="Folders to watch (defaults to the watch_folders setting).")
+    parser.add_argument("--to", dest="output_format",
+                        help="Target extension or comma separated list (defaults to the watch_output_format setting).")
+    parser.add_argument("--out", dest="output_directory",
+                        help="Output directory (defaults to the watch_output_directory or output_directory setting).")
+    parser.add_argument("--jobs", "-j", type=int, help="Number of parallel worker processes.")
+    parser.add_argument("--settle", type=float, metavar="SECONDS",
+                        help="How long a file must stay unchanged before it is converted.")
+    parser.add_argument("--poll", type=float, metavar="SECONDS", help="Interval between full rescans.")
+    parser.add_argument("--stale", type=float, metavar="SECONDS",
+                        help="Take over the files of a daemon on another host that has been silent this long.")
+    parser.add_argument("--timeout", type=float, metavar="SECONDS",
+                        help="Stop any single conversion still running after this long and count it as failed.")
+    parser.add_argument("--once", action="store_true",
+                        help="Convert the files present now, then exit instead of watching.")
+    parser.add_argument("--no-cache", action="store_true", help="Bypass the conversion cache.")
+    parser.add_argument("--metrics-log", metavar="PATH",
+                        help="Append per-job metrics to this rotating JSON-lines file.")
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    settings_manager = SettingsManager()
+    folders = args.folders or parse_patterns(settings_manager.get('watch_folders'))
+    output_formats = [normalize_format(output_format) for output_format in
+                      parse_patterns(args.output_format or settings_manager.get('watch_output_format'))]
+    if not folders or not output_formats:
+        parser.print_usage(sys.stderr)
+        print("hot_folder: error: folders and --to are required (or set them in Settings)", file=sys.stderr)
+        return 2
+    output_directory = (args.output_directory or settings_manager.get('watch_output_directory')
+                        or settings_manager.get('output_directory', os.getcwd()))
+    os.makedirs(output_directory, exist_ok=True)
+
+    cache = None
+    if not args.no_cache and settings_manager.get('cache_enabled', True):
+        cache = cache_from_settings(settings_manager) or ConversionCache()
+    metrics_log = MetricsLog(args.metrics_log) if args.metrics_log else metrics_log_from_settings(settings_manager)
+    job_timeout = args.timeout if args.timeout is not None else settings_manager.get('job_timeout_seconds')
+    engine = ConversionEngine(output_directory, args.jobs or settings_manager.get('max_workers', os.cpu_count() or 1),
+                              settings_manager.get('category_limits'), cache=cache, metrics_log=metrics_log,
+                              job_timeout=job_timeout or None,
+                              memory_budget_mb=settings_manager.get('memory_budget_mb'),
+                              converter_options=converter_options_from_settings(settings_manager))
+    daemon = HotFolderDaemon(
+        folders, output_formats, engine,
+        args.settle if args.settle is not None else settings_manager.get('watch_settle_seconds', DEFAULT_SETTLE_SECONDS),
+        args.poll if args.poll is not None else settings_manager.get('watch_poll_seconds', DEFAULT_POLL_SECONDS),
+        args.stale if args.stale is not None else settings_manager.get('watch_stale_seconds', DEFAULT_STALE_SECONDS),
+        include=parse_patterns(settings_manager.get('scan_include')),
+        exclude=parse_patterns(settings_manager.get('scan_exclude', DEFAULT_EXCLUDE)),
+    )
+    # As in pxconvert: a plain kill still stops the conversions and releases the claimed files
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(128 + signum))
+    print(f"hot_folder: watching {', '.join(daemon.folders)} as {daemon.instance}", file=sys.stderr)
+    try:
+        daemon.run(once=args.once)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if metrics_log is not None:
+            metrics_log.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
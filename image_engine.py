@@ -0,0 +1,483 @@
+"""
+Image conversion engine.
+
+- Multi-frame sources (animated GIF, multi-page TIFF, ...) keep every frame
+  when the target format can hold more than one. Frames are read lazily
+  from the source one at a time. Other targets get the first frame and a
+  warning, or one file per frame with image_split_frames.
+- Very large single-frame rasters whose pixel data is stored uncompressed
+  (BMP, PPM, uncompressed TIFF strips) are converted in horizontal bands
+  to PNG, TIFF or BMP. Peak memory is then one band, not the whole image.
+- Encoder settings (quality, optimize, compression level) come from the
+  converter options. Unset options keep Pillow's defaults.
+- convert_image_many() decodes a source once and encodes every requested
+  target from that decode, in parallel threads (Pillow's encoders release
+  the GIL).
+"""
+import os
+import struct
+import sys
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+from conversion_metrics import report_progress, stage
+
+# Targets that can store more than one frame. Pillow writes PNG as APNG.
+MULTI_FRAME_FORMATS = {'.gif', '.tiff', '.tif', '.png', '.webp'}
+STRIP_FORMATS = {'.png', '.tiff', '.tif', '.bmp'}
+
+DEFAULT_STRIP_THRESHOLD = 64 * 1024 * 1024  # pixels
+# Parallel fan-out gives every encoder its own copy of the decoded image.
+# When the copies would exceed this many pixels in total, the targets are
+# encoded one after another from the shared decode instead.
+PARALLEL_FANOUT_PIXELS = 16 * 1024 * 1024
+BAND_BYTES = 8 * 1024 * 1024
+
+_RAWMODE_BITS = {
+    '1': 1, 'L': 8, 'P': 8, 'RGB': 24, 'BGR': 24, 'RGBA': 32, 'RGBX': 32,
+    'BGRA': 32, 'BGRX': 32, 'CMYK': 32, 'LA': 16,
+}
+
+
+def encoder_settings(output_ext, options):
+    """Maps converter options to Pillow save() keyword arguments for output_ext."""
+    settings = {}
+    quality = options.get('image_quality')
+    optimize = options.get('image_optimize')
+    compress_level = options.get('image_compress_level')
+    if output_ext in ('.jpg', '.jpeg', '.webp'):
+        if quality is not None:
+            settings['quality'] = int(quality)
+        if optimize is not None and output_ext != '.webp':
+            settings['optimize'] = bool(optimize)
+    elif output_ext == '.png':
+        if compress_level is not None:
+            settings['compress_level'] = int(compress_level)
+        if optimize is not None:
+            settings['optimize'] = bool(optimize)
+    elif output_ext == '.gif':
+        if optimize is not None:
+            settings['optimize'] = bool(optimize)
+    elif output_ext in ('.tiff', '.tif'):
+        if options.get('image_tiff_compression'):
+            settings['compression'] = options['image_tiff_compression']
+    return settings
+
+
+def prepare_for_format(img, output_ext):
+    """Converts img to a mode the target format can store."""
+    if output_ext in ('.jpg', '.jpeg'):
+        if img.mode not in ('RGB', 'L', 'CMYK'):
+            return img.convert('RGB')
+    elif output_ext == '.bmp':
+        if img.mode not in ('1', 'L', 'P', 'RGB', 'RGBA'):
+            return img.convert('RGB')
+    return img
+
+
+def convert_image(input_path, output_path, options=None):
+    options = options or {}
+    output_ext = os.path.splitext(output_path)[1].lower()
+    threshold = int(options.get('image_strip_threshold', DEFAULT_STRIP_THRESHOLD))
+    max_pixels = Image.MAX_IMAGE_PIXELS
+    img = _open(input_path)
+    with img:
+        n_frames = getattr(img, 'n_frames', 1)
+        width, height = img.size
+        if n_frames == 1 and width * height >= threshold and output_ext in STRIP_FORMATS:
+            layout = _raw_layout(img)
+            if layout is not None:
+                _convert_in_bands(img, layout, output_path, output_ext, options)
+                return
+        if max_pixels and width * height > 2 * max_pixels:
+            raise Image.DecompressionBombError(
+                f"Image size ({width * height} pixels) exceeds limit of {2 * max_pixels} pixels "
+                f"and cannot be converted band by band.")
+        settings = encoder_settings(output_ext, options)
+        with stage('decode'):
+            img.load()
+        report_progress(0.5 / n_frames)
+        with stage('encode'):
+            if n_frames > 1 and output_ext in MULTI_FRAME_FORMATS:
+                _save_all_frames(img, n_frames, output_path, output_ext, settings)
+            else:
+                prepare_for_format(img, output_ext).save(output_path, **settings)
+                if n_frames > 1 and options.get('image_split_frames'):
+                    _save_remaining_frames(img, n_frames, output_path, output_ext, settings)
+                elif n_frames > 1:
+                    print(f"{os.path.basename(input_path)}: {output_ext} holds a single frame; "
+                          f"kept the first of {n_frames}.", file=sys.stderr)
+
+
+def _open(input_path):
+    max_pixels = Image.MAX_IMAGE_PIXELS
+    # The decompression bomb check is applied by the caller, once it knows
+    # whether the image can be processed band by band.
+    Image.MAX_IMAGE_PIXELS = None
+    try:
+        return Image.open(input_path)
+    finally:
+        Image.MAX_IMAGE_PIXELS = max_pixels
+
+
+def _convert_each(input_path, output_paths, options):
+    errors = []
+    for output_path in output_paths:
+        try:
+            convert_image(input_path, output_path, options)
+            errors.append(None)
+        except Exception as e:
+            errors.append(e)
+    return errors
+
+
+def convert_image_many(input_path, output_paths, options=None):
+    """
+    Converts one source to several targets with a single decode and returns
+    one exception (or None) per output path. Animated and very large sources
+    are converted target by target, since they are streamed rather than
+    decoded in one piece.
+    """
+    options = options or {}
+    threshold = int(options.get('image_strip_threshold', DEFAULT_STRIP_THRESHOLD))
+    max_pixels = Image.MAX_IMAGE_PIXELS
+    img = _open(input_path)
+    with img:
+        pixels = img.size[0] * img.size[1]
+        if (getattr(img, 'n_frames', 1) > 1 or pixels >= threshold
+                or (max_pixels and pixels > 2 * max_pixels)):
+            return _convert_each(input_path, output_paths, options)
+        with stage('decode'):
+            img.load()
+        workers = min(len(output_paths), os.cpu_count() or 1)
+        parallel = workers > 1 and pixels * len(output_paths) <= PARALLEL_FANOUT_PIXELS
+
+        def encode(output_path):
+            output_ext = os.path.splitext(output_path)[1].lower()
+            try:
+                frame = prepare_for_format(img, output_ext)
+                # save() stores its settings on the image, so concurrent
+                # encoders must not share one object
+                if parallel and frame is img:
+                    frame = img.copy()
+                frame.save(output_path, **encoder_settings(output_ext, options))
+                return None
+            except Exception as e:
+                return e
+
+        with stage('encode'):
+            if not parallel:
+                return _collect(map(encode, output_paths), len(output_paths))
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                return _collect(executor.map(encode, output_paths), len(output_paths))
+
+
+def _collect(results, total):
+    # Lists the per-target results as they arrive, one progress step per target
+    errors = []
+    for error in results:
+        errors.append(error)
+        report_progress(len(errors) / total)
+    return errors
+
+
+def _animation_mode(img, output_ext):
+    """
+    Decoders may return frames in different modes (GIF gives P for the first
+    frame and RGB/RGBA afterwards), so every frame is normalised to a single
+    mode. GIF targets quantise each frame themselves.
+    """
+    if output_ext == '.gif':
+        return None
+    if 'A' in img.getbands() or 'transparency' in img.info:
+        return 'RGBA'
+    return 'RGB'
+
+
+def _prepare_frame(img, output_ext, mode):
+    frame = img.convert(mode) if mode is not None and img.mode != mode else prepare_for_format(img, output_ext)
+    return img.copy() if frame is img else frame
+
+
+def _frame_iter(img, n_frames, output_ext, mode=None):
+    for index in range(1, n_frames):
+        img.seek(index)
+        yield _prepare_frame(img, output_ext, mode)
+        report_progress(index / n_frames)
+
+
+class _LazyFrames:
+    """
+    Re-iterable view of frames 1..n-1. Some Pillow writers (APNG) walk
+    append_images twice, so a plain generator would be exhausted after the
+    first pass.
+    """
+
+    def __init__(self, img, n_frames, output_ext, mode):
+        self.args = (img, n_frames, output_ext, mode)
+
+    def __iter__(self):
+        return _frame_iter(*self.args)
+
+
+def _save_all_frames(img, n_frames, output_path, output_ext, settings):
+    img.seek(0)
+    mode = _animation_mode(img, output_ext)
+    first = _prepare_frame(img, output_ext, mode)
+    if output_ext == '.gif' and 'loop' in img.info:
+        settings.setdefault('loop', img.info['loop'])
+    first.save(output_path, save_all=True, append_images=_LazyFrames(img, n_frames, output_ext, mode), **settings)
+
+
+def _save_remaining_frames(img, n_frames, output_path, output_ext, settings):
+    # Formats without multi-frame support get one file per extra frame: name-2.jpg, name-3.jpg, ...
+    stem, ext = os.path.splitext(output_path)
+    for index, frame in enumerate(_frame_iter(img, n_frames, output_ext), start=2):
+        frame.save(f"{stem}-{index}{ext}", **settings)
+
+
+def _raw_layout(img):
+    """
+    Returns [(y0, y1, offset, rawmode, stride, orientation), ...] when every
+    tile of img is uncompressed and spans the full width, otherwise None.
+    """
+    width, _ = img.size
+    layout = []
+    for tile in img.tile:
+        codec_name, extents, offset, args = tile[0], tile[1], tile[2], tile[3]
+        if codec_name != 'raw':
+            return None
+        x0, y0, x1, y1 = extents
+        if x0 != 0 or x1 != width:
+            return None
+        if isinstance(args, str):
+            args = (args, 0, 1)
+        rawmode = args[0]
+        stride = args[1] if len(args) > 1 else 0
+        orientation = args[2] if len(args) > 2 else 1
+        bits = _RAWMODE_BITS.get(rawmode)
+        if bits is None:
+            return None
+        if not stride:
+            stride = (width * bits + 7) // 8
+        layout.append((y0, y1, offset, rawmode, stride, orientation))
+    return sorted(layout) or None
+
+
+def _iter_bands(img, layout):
+    """Yields (y, band_image) pairs covering the image from top to bottom."""
+    width, _ = img.size
+    with open(img.filename, 'rb') as f:
+        for y0, y1, offset, rawmode, stride, orientation in layout:
+            rows_per_band = max(1, BAND_BYTES // max(stride, 1))
+            tile_height = y1 - y0
+            for top in range(0, tile_height, rows_per_band):
+                rows = min(rows_per_band, tile_height - top)
+                if orientation < 0:
+                    # Bottom-up storage: the band's last row comes first in the file
+                    f.seek(offset + (tile_height - top - rows) * stride)
+                else:
+                    f.seek(offset + top * stride)
+                data = f.read(rows * stride)
+                if len(data) < rows * stride:
+                    raise RuntimeError("Image data is truncated.")
+                band = Image.frombuffer(img.mode, (width, rows), data, 'raw', rawmode, stride, orientation)
+                if img.mode == 'P':
+                    band.putpalette(img.getpalette())
+                yield y0 + top, band
+
+
+def _band_mode(img, output_ext):
+    if output_ext == '.bmp':
+        return 'L' if img.mode in ('1', 'L') else 'RGB'
+    if img.mode in ('1', 'L'):
+        return 'L'
+    if img.mode in ('RGBA', 'LA', 'PA') or (img.mode == 'P' and 'transparency' in img.info):
+        return 'RGBA'
+    return 'RGB'
+
+
+def _convert_in_bands(img, layout, output_path, output_ext, options):
+    mode = _band_mode(img, output_ext)
+    width, height = img.size
+    bands = ((y, band if band.mode == mode else band.convert(mode)) for y, band in _iter_bands(img, layout))
+    if output_ext == '.png':
+        writer = _StreamingPNGWriter(output_path, width, height, mode,
+                                     int(options.get('image_compress_level', 6)))
+    elif output_ext == '.bmp':
+        writer = _StreamingBMPWriter(output_path, width, height, mode)
+    else:
+        writer = _StreamingTIFFWriter(output_path, width, height, mode,
+                                      options.get('image_tiff_compression'))
+    try:
+        for y, band in bands:
+            writer.write_band(band)
+            report_progress((y + band.size[1]) / height)
+        writer.close()
+    except BaseException:
+        writer.abort()
+        raise
+
+
+class _StreamingPNGWriter:
+    _COLOR_TYPES = {'L': (0, 1), 'RGB': (2, 3), 'RGBA': (6, 4)}
+
+    def __init__(self, path, width, height, mode, compress_level):
+        self.path = path
+        self.file = open(path, 'wb')
+        self.compressor = zlib.compressobj(compress_level)
+        self.row_bytes = width * self._COLOR_TYPES[mode][1]
+        color_type = self._COLOR_TYPES[mode][0]
+        self.file.write(b'\x89PNG\r\n\x1a\n')
+        self._chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, color_type, 0, 0, 0))
+
+    def _chunk(self, chunk_type, data):
+        self.file.write(struct.pack('>I', len(data)))
+        self.file.write(chunk_type)
+        self.file.write(data)
+        self.file.write(struct.pack('>I', zlib.crc32(chunk_type + data) & 0xffffffff))
+
+    def write_band(self, band):
+        data = band.tobytes()
+        # Filter type 0 (None) in front of every scanline
+        rows = bytearray()
+        for start in range(0, len(data), self.row_bytes):
+            rows += b'\x00'
+            rows += data[start:start + self.row_bytes]
+        compressed = self.compressor.compress(bytes(rows))
+        if compressed:
+            self._chunk(b'IDAT', compressed)
+
+    def close(self):
+        self._chunk(b'IDAT', self.compressor.flush())
+        self._chunk(b'IEND', b'')
+        self.file.close()
+
+    def abort(self):
+        self.file.close()
+        os.remove(self.path)
+
+
+class _StreamingBMPWriter:
+    """Writes a top-down (negative height) BMP, 8-bit grayscale or 24-bit BGR."""
+
+    def __init__(self, path, width, height, mode):
+        self.path = path
+        self.file = open(path, 'wb')
+        self.mode = mode
+        bits = 8 if mode == 'L' else 24
+        self.row_bytes = width * bits // 8
+        self.padding = b'\x00' * ((4 - self.row_bytes % 4) % 4)
+        palette = b''.join(bytes((i, i, i, 0)) for i in range(256)) if mode == 'L' else b''
+        pixel_offset = 14 + 40 + len(palette)
+        image_size = (self.row_bytes + len(self.padding)) * height
+        self.file.write(struct.pack('<2sIHHI', b'BM', pixel_offset + image_size, 0, 0, pixel_offset))
+        self.file.write(struct.pack('<IiiHHIIiiII', 40, width, -height, 1, bits, 0, image_size,
+                                    2835, 2835, 256 if mode == 'L' else 0, 0))
+        self.file.write(palette)
+
+    def write_band(self, band):
+        data = band.tobytes('raw', 'L' if self.mode == 'L' else 'BGR')
+        if not self.padding:
+            self.file.write(data)
+            return
+        for start in range(0, len(data), self.row_bytes):
+            self.file.write(data[start:start + self.row_bytes])
+            self.file.write(self.padding)
+
+    def close(self):
+        self.file.close()
+
+    def abort(self):
+        self.file.close()
+        os.remove(self.path)
+
+
+class _StreamingTIFFWriter:
+    """
+    Writes a baseline little-endian TIFF in strips as tall as the first
+    band. TIFF requires every strip but the last to have RowsPerStrip rows,
+    and bands restart at each source strip, so rows are buffered across
+    bands until a strip is full. The IFD goes at the end of the file.
+    """
+    _PHOTOMETRIC = {'L': 1, 'RGB': 2, 'RGBA': 2}
+
+    def __init__(self, path, width, height, mode, compression=None):
+        self.path = path
+        self.file = open(path, 'wb')
+        self.width = width
+        self.height = height
+        self.mode = mode
+        self.samples = len(mode)
+        self.deflate = compression in ('tiff_adobe_deflate', 'tiff_deflate', 'deflate')
+        self.row_bytes = width * self.samples
+        self.rows_per_strip = None
+        self.pending = bytearray()
+        self.strip_offsets = []
+        self.strip_byte_counts = []
+        self.file.write(b'II*\x00\x00\x00\x00\x00')  # IFD offset patched in close()
+
+    def write_band(self, band):
+        if self.rows_per_strip is None:
+            self.rows_per_strip = band.size[1]
+        self.pending += band.tobytes()
+        strip_bytes = self.rows_per_strip * self.row_bytes
+        while len(self.pending) >= strip_bytes:
+            self._write_strip(bytes(self.pending[:strip_bytes]))
+            del self.pending[:strip_bytes]
+
+    def _write_strip(self, data):
+        if self.deflate:
+            data = zlib.compress(data)
+        self.strip_offsets.append(self.file.tell())
+        self.strip_byte_counts.append(len(data))
+        self.file.write(data)
+
+    def _write_array(self, type_code, values):
+        offset = self.file.tell()
+        fmt = 'H' if type_code == 3 else 'I'
+        self.file.write(struct.pack(f'<{len(values)}{fmt}', *values))
+        if self.file.tell() % 2:
+            self.file.write(b'\x00')
+        return offset
+
+    def close(self):
+        if self.pending:
+            self._write_strip(bytes(self.pending))
+            self.pending.clear()
+        bits_offset = self._write_array(3, [8] * self.samples) if self.samples > 2 else None
+        offsets_offset = self._write_array(4, self.strip_offsets) if len(self.strip_offsets) > 1 else None
+        counts_offset = self._write_array(4, self.strip_byte_counts) if len(self.strip_byte_counts) > 1 else None
+
+        entries = [
+            (256, 4, 1, self.width),
+            (257, 4, 1, self.height),
+            (258, 3, self.samples, bits_offset if bits_offset is not None else 8),
+            (259, 3, 1, 8 if self.deflate else 1),
+            (262, 3, 1, self._PHOTOMETRIC[self.mode]),
+            (273, 4, len(self.strip_offsets),
+             offsets_offset if offsets_offset is not None else self.strip_offsets[0]),
+            (277, 3, 1, self.samples),
+            (278, 4, 1, self.rows_per_strip or self.height),
+            (279, 4, len(self.strip_byte_counts),
+             counts_offset if counts_offset is not None else self.strip_byte_counts[0]),
+            (284, 3, 1, 1),
+        ]
+        if self.mode == 'RGBA':
+            entries.append((338, 3, 1, 2))  # ExtraSamples: unassociated alpha
+
+        ifd_offset = self.file.tell()
+        self.file.write(struct.pack('<H', len(entries)))
+        for tag, type_code, count, value in entries:
+            if type_code == 3 and count == 1:
+                self.file.write(struct.pack('<HHIHH', tag, type_code, count, value, 0))
+            else:
+                self.file.write(struct.pack('<HHII', tag, type_code, count, value))
+        self.file.write(struct.pack('<I', 0))
+        self.file.seek(4)
+        self.file.write(struct.pack('<I', ifd_offset))
+        self.file.close()
+
+    def abort(self):
+        self.file.close()
+        os.remove(self.path)
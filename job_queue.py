@@ -0,0 +1,316 @@
+"""
+Durable conversion queue.
+
+Every job of a batch is written to an SQLite database (WAL mode) before
+it runs, and its state is updated as it moves through
+pending -> running -> done | failed. A run that is interrupted by a crash,
+a kill or a reboot leaves its unfinished jobs behind. The next run
+resumes them, and jobs that are already done are not converted again.
+
+Failures whose error class looks transient (timeouts, a dead worker
+process, running out of memory or disk) are retried with exponential
+backoff up to max_attempts. Other failures are final.
+
+Every unfinished job records the process that owns it, including jobs
+waiting out a backoff. Resuming and discarding only touch jobs of this
+process or of processes that no longer exist, so several processes can
+share one database.
+"""
+import os
+import sqlite3
+import time
+from conversion_engine import build_output_path
+
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+DEFAULT_MAX_ATTEMPTS = 3
+DEFAULT_BACKOFF_SECONDS = 5.0
+MAX_BACKOFF_SECONDS = 300.0
+# Finished jobs are kept this long for reference, then pruned
+KEEP_FINISHED_SECONDS = 7 * 24 * 3600
+
+# Error classes worth another attempt; anything else fails the job for good
+TRANSIENT_ERRORS = {
+    'TimeoutError', 'TimeoutExpired', 'BrokenProcessPool', 'BrokenPipeError', 'MemoryError',
+    'InterruptedError', 'BlockingIOError', 'ConnectionError', 'OSError',
+}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    batch INTEGER NOT NULL,
+    input_path TEXT NOT NULL,
+    output_format TEXT NOT NULL,
+    output_path TEXT NOT NULL,
+    state TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt REAL NOT NULL DEFAULT 0,
+    owner INTEGER,
+    error TEXT,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_by_state ON jobs (state, next_attempt);
+"""
+
+
+def default_queue_path():
+    from conversion_metrics import default_log_path
+    return os.path.join(os.path.dirname(default_log_path()), 'queue.sqlite3')
+
+
+def queue_from_settings(settings_manager):
+    """Returns a JobQueue configured from the settings, or None if disabled."""
+    if not settings_manager.get('queue_enabled', True):
+        return None
+    try:
+        return JobQueue(settings_manager.get('queue_db'),
+                        settings_manager.get('queue_max_attempts', DEFAULT_MAX_ATTEMPTS),
+                        settings_manager.get('queue_backoff_seconds', DEFAULT_BACKOFF_SECONDS))
+    except (OSError, sqlite3.Error) as e:
+        print(f"Job queue disabled: {e}")
+        return None
+
+
+def _process_alive(pid):
+    if pid is None:
+        return False
+    if pid == os.getpid():
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except (PermissionError, OSError):
+        # Exists but belongs to someone else, or the platform cannot tell
+        return True
+    return True
+
+
+class QueuedJob:
+    __slots__ = ('id', 'input_path', 'output_format', 'output_path', 'attempts')
+
+    def __init__(self, row):
+        self.id, self.input_path, self.output_format, self.output_path, self.attempts = row
+
+
+class JobQueue:
+    """
+    A JobQueue may be created in one thread and handed to another, but must
+    not be used from two threads at once. Several processes may share a
+    database; jobs owned by a live process are never taken over.
+    """
+
+    def __init__(self, path=None, max_attempts=DEFAULT_MAX_ATTEMPTS, backoff_seconds=DEFAULT_BACKOFF_SECONDS):
+        self.path = path or default_queue_path()
+        self.max_attempts = max(1, int(max_attempts))
+        self.backoff_seconds = float(backoff_seconds)
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        self.db = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        # With WAL, NORMAL never corrupts the database; a power cut loses at most the last commits
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.executescript(_SCHEMA)
+        self.recover()
+
+    def close(self):
+        self.db.close()
+
+    def _transaction(self):
+        self.db.execute('BEGIN IMMEDIATE')
+
+    def recover(self):
+        """Releases jobs left running by a process that no longer exists, and prunes old finished jobs."""
+        now = time.time()
+        self._transaction()
+        try:
+            rows = self.db.execute('SELECT id, owner, attempts FROM jobs WHERE state = ?', (RUNNING,)).fetchall()
+            for job_id, owner, attempts in rows:
+                if _process_alive(owner):
+                    continue
+                if attempts >= self.max_attempts:
+                    self.db.execute('UPDATE jobs SET state = ?, owner = NULL, error = ?, updated = ? WHERE id = ?',
+                                    (FAILED, 'Interrupted on every attempt', now, job_id))
+                else:
+                    self.db.execute('UPDATE jobs SET state = ?, owner = NULL, updated = ? WHERE id = ?',
+                                    (PENDING, now, job_id))
+            self._orphan_pending()
+            self.db.execute('DELETE FROM jobs WHERE state IN (?, ?) AND updated < ?',
+                            (DONE, FAILED, now - KEEP_FINISHED_SECONDS))
+            self.db.execute('COMMIT')
+        except BaseException:
+            self.db.execute('ROLLBACK')
+            raise
+        if rows:
+            print(f"Job queue: recovered {len(rows)} interrupted jobs.")
+
+    def _orphan_pending(self):
+        """Clears the owner of pending jobs whose process no longer exists, so any process may take them."""
+        owners = self.db.execute('SELECT DISTINCT owner FROM jobs WHERE state = ? AND owner IS NOT NULL',
+                                 (PENDING,)).fetchall()
+        for (owner,) in owners:
+            if not _process_alive(owner):
+                self.db.execute('UPDATE jobs SET owner = NULL WHERE state = ? AND owner = ?', (PENDING, owner))
+
+    def _pending_filter(self, batch):
+        """The WHERE clause and parameters for pending jobs of batch, or without one, of no live process but this one."""
+        if batch is not None:
+            return 'state = ? AND batch = ?', (PENDING, batch)
+        self._orphan_pending()
+        return 'state = ? AND (owner IS NULL OR owner = ?)', (PENDING, os.getpid())
+
+    def add(self, jobs, output_directory):
+        """Queues [(input_path, output_format)] as one batch and returns the batch number."""
+        now = time.time()
+        self._transaction()
+        try:
+            batch = self.db.execute('SELECT COALESCE(MAX(batch), 0) + 1 FROM jobs').fetchone()[0]
+            self.db.executemany(
+                'INSERT INTO jobs (batch, input_path, output_format, output_path, state, owner, updated) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                ((batch, input_path, output_format, build_output_path(input_path, output_format, output_directory),
+                  PENDING, os.getpid(), now) for input_path, output_format in jobs))
+            self.db.execute('COMMIT')
+        except BaseException:
+            self.db.execute('ROLLBACK')
+            raise
+        return batch
+
+    def claim(self, batch=None, now=None):
+        """
+        Takes every pending job of batch whose backoff has expired, oldest
+        first, and marks it running for this process so no other process
+        picks it up. Without a batch it takes this process's jobs and those
+        whose owner no longer exists. Attempts are only counted once a job
+        actually starts (mark_running).
+        """
+        now = time.time() if now is None else now
+        self._transaction()
+        try:
+            where, params = self._pending_filter(batch)
+            rows = self.db.execute('SELECT id, input_path, output_format, output_path, attempts FROM jobs '
+                                   f'WHERE {where} AND next_attempt <= ? ORDER BY id', params + (now,)).fetchall()
+            self.db.executemany('UPDATE jobs SET state = ?, owner = ?, updated = ? WHERE id = ?',
+                                ((RUNNING, os.getpid(), now, row[0]) for row in rows))
+            self.db.execute('COMMIT')
+        except BaseException:
+            self.db.execute('ROLLBACK')
+            raise
+        return [QueuedJob(row) for row in rows]
+
+    def next_retry_time(self, batch=None):
+        """When the earliest backed-off job claim(batch) would take becomes ready, or None if none is waiting."""
+        where, params = self._pending_filter(batch)
+        return self.db.execute(f'SELECT MIN(next_attempt) FROM jobs WHERE {where}', params).fetchone()[0]
+
+    def counts(self):
+        counts = dict.fromkeys((PENDING, RUNNING, DONE, FAILED), 0)
+        counts.update(self.db.execute('SELECT state, COUNT(*) FROM jobs GROUP BY state').fetchall())
+        return counts
+
+    def unfinished_count(self, batch=None):
+        """Jobs claim(batch) would take, now or after a backoff. Jobs of another live process are not counted."""
+        where, params = self._pending_filter(batch)
+        return self.db.execute(f'SELECT COUNT(*) FROM jobs WHERE {where}', params).fetchone()[0]
+
+    def mark_running(self, job_id):
+        self.db.execute('UPDATE jobs SET attempts = attempts + 1, updated = ? WHERE id = ?', (time.time(), job_id))
+
+    def mark_done(self, job_id):
+        self.db.execute('UPDATE jobs SET state = ?, owner = NULL, error = NULL, updated = ? WHERE id = ?',
+                        (DONE, time.time(), job_id))
+
+    def mark_failed(self, job_id, error, error_class=None):
+        """Schedules a retry for transient failures with attempts left; returns True if one was scheduled."""
+        now = time.time()
+        attempts = self.db.execute('SELECT attempts FROM jobs WHERE id = ?', (job_id,)).fetchone()[0]
+        if error_class in TRANSIENT_ERRORS and attempts < self.max_attempts:
+            delay = min(MAX_BACKOFF_SECONDS, self.backoff_seconds * 2 ** (attempts - 1))
+            self.db.execute('UPDATE jobs SET state = ?, owner = ?, error = ?, next_attempt = ?, updated = ? '
+                            'WHERE id = ?', (PENDING, os.getpid(), error, now + delay, now, job_id))
+            return True
+        self.db.execute('UPDATE jobs SET state = ?, owner = NULL, error = ?, updated = ? WHERE id = ?',
+                        (FAILED, error, now, job_id))
+        return False
+
+    def release(self, job_ids):
+        """Returns claimed jobs that did not finish (e.g. the run was stopped) to the pending state."""
+        now = time.time()
+        self._transaction()
+        try:
+            self.db.executemany('UPDATE jobs SET state = ?, owner = ?, updated = ? WHERE id = ? AND state = ?',
+                                ((PENDING, os.getpid(), now, job_id, RUNNING) for job_id in job_ids))
+            self.db.execute('COMMIT')
+        except BaseException:
+            self.db.execute('ROLLBACK')
+            raise
+
+    def discard_unfinished(self):
+        """Deletes the pending jobs claim() would take without a batch; other live processes keep theirs."""
+        self._transaction()
+        try:
+            where, params = self._pending_filter(None)
+            self.db.execute(f'DELETE FROM jobs WHERE {where}', params)
+            self.db.execute('COMMIT')
+        except BaseException:
+            self.db.execute('ROLLBACK')
+            raise
+
+
+def drain(job_queue, engine, on_started=None, on_result=None, should_stop=None, batch=None, sleep=time.sleep,
+          on_progress=None):
+    """
+    Runs the queue's ready jobs (only those of batch, if given) through
+    engine until nothing is left or should_stop() returns True, waiting out
+    the backoff of retried jobs.
+    on_started/on_result are called like ConversionEngine.run's callbacks,
+    with a total covering the jobs known when the drain started;
+    on_progress is passed to ConversionEngine.run as is. Jobs killed by
+    engine.cancel() go back to the pending state.
+    Returns the number of jobs that ended in the failed state.
+    """
+    if should_stop is None:
+        should_stop = lambda: False
+    total = job_queue.unfinished_count(batch)
+    completed = 0
+    failed = 0
+    while not should_stop():
+        claimed = job_queue.claim(batch)
+        if not claimed:
+            retry_at = job_queue.next_retry_time(batch)
+            if retry_at is None:
+                break
+            # Sleep in short steps so a stop request is noticed quickly
+            sleep(min(0.5, max(0.0, retry_at - time.time())))
+            continue
+
+        def started_job(index, _, input_path):
+            job_queue.mark_running(claimed[index].id)
+            if on_started:
+                on_started(min(completed, total - 1), total, input_path)
+
+        def finished_job(result, *_):
+            nonlocal completed, failed
+            job = claimed[result.index]
+            if result.ok:
+                job_queue.mark_done(job.id)
+            elif job_queue.mark_failed(job.id, result.error, (result.metrics or {}).get('error_class')):
+                print(f"Retrying {job.input_path} later (attempt {job.attempts + 1} failed: {result.error})")
+                return
+            else:
+                failed += 1
+            completed += 1
+            if on_result:
+                on_result(result, completed, total)
+
+        try:
+            engine.run([(job.input_path, job.output_format, job.output_path) for job in claimed],
+                       on_started=started_job, on_result=finished_job, should_stop=should_stop,
+                       on_progress=on_progress)
+        finally:
+            # Jobs claimed but never finished (the run was stopped) go back to pending
+            job_queue.release([job.id for job in claimed])
+    return failed
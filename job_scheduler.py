@@ -0,0 +1,238 @@
+"""
+Memory- and cost-aware job scheduling.
+
+estimate_cost() predicts a conversion's peak memory and run time from its
+formats and input size. Memory follows a per-backend model of what the
+backend holds at once: decoded pixels for images, ffmpeg processes for
+audio and video, every page for pdf2docx. When the metrics log holds
+enough samples of a pair, their median peak raises the estimate if it is
+higher (it never lowers it: the peak of ffmpeg children is not always
+captured). Run time uses the planner's seconds per MB, measured or
+estimated.
+
+JobScheduler hands out pending jobs longest first, which keeps the long
+ones from being left to run alone at the end of a batch. A job is only
+admitted while the estimates of the running jobs plus its own fit in the
+memory budget; smaller jobs that fit are started in the meantime. A job
+larger than the whole budget still runs, but only when nothing else does.
+"""
+import bisect
+import math
+import os
+from conversion_planner import DEFAULT_COSTS, UNKNOWN_COST, load_measured, plan_for
+from format_sniffer import resolve_format
+from pdf_docx_engine import DEFAULT_CHUNK_PAGES
+
+# Python interpreter plus the imported converter libraries in a worker
+WORKER_BASE_MB = 40
+# One ffmpeg process decoding and encoding up to 1080p video
+VIDEO_PROCESS_MB = 250
+AUDIO_PROCESS_MB = 40
+# Above this size a video is likely long enough to be encoded in segments (one ffmpeg each)
+SEGMENTED_VIDEO_MB = 64
+# How much larger decoded PCM is than the file, for the in-memory (pydub) audio path
+PCM_EXPANSION = {'.wav': 1, '.flac': 2}
+COMPRESSED_AUDIO_EXPANSION = 10
+# Fallback when an image's dimensions cannot be read
+IMAGE_EXPANSION = 10
+# pdf2docx and docx2pdf load fitz or reportlab on top of the worker
+DOCUMENT_LIBRARY_MB = 90
+PDF2DOCX_MB_PER_PAGE = 1.5
+# Pages of a PDF rendered from plain text
+TEXT_BYTES_PER_PAGE = 3000
+# openpyxl on top of the worker
+SPREADSHEET_LIBRARY_MB = 10
+# The shared strings of an XLSX are held whole; measured at about 60 times
+# the file when every string is distinct
+SHARED_STRINGS_EXPANSION = 60
+FALLBACK_BUDGET_MB = 4096
+
+
+def default_memory_budget_mb():
+    """Half of the physical memory, or FALLBACK_BUDGET_MB where it cannot be read."""
+    try:
+        return os.sysconf('SC_PHYS_PAGES') * os.sysconf('SC_PAGE_SIZE') // (2 * 1024 * 1024)
+    except (AttributeError, ValueError, OSError):
+        return FALLBACK_BUDGET_MB
+
+
+def _image_mb(input_path, size_mb):
+    try:
+        from PIL import Image
+        with Image.open(input_path) as img:
+            # Only the header is read; one frame is decoded at a time
+            pixels = img.width * img.height
+            bands = len(img.getbands())
+    except Exception:
+        return size_mb * IMAGE_EXPANSION
+    # The decoded frame plus the copy converted for the target mode
+    return 2 * pixels * bands / (1024 * 1024)
+
+
+def _backend_mb(backend_name, input_path, input_format, size_mb, options, intermediate=False):
+    """
+    The memory a backend needs beyond the worker itself, in MB. size_mb is
+    the size of the job's source; intermediate is set for the later steps
+    of a chain, whose input is produced from it.
+    """
+    if backend_name == 'image':
+        return _image_mb(input_path, size_mb)
+    if backend_name == 'video':
+        workers = int(options.get('video_workers') or os.cpu_count() or 1)
+        return VIDEO_PROCESS_MB * (workers if size_mb >= SEGMENTED_VIDEO_MB else 1)
+    if backend_name == 'audio':
+        if options.get('audio_streaming', True):
+            # A decoder and an encoder process joined by a pipe
+            return 2 * AUDIO_PROCESS_MB
+        # The decoded AudioSegment and the exported copy
+        return 2 * size_mb * PCM_EXPANSION.get(input_format, COMPRESSED_AUDIO_EXPANSION)
+    if backend_name == 'pdf_to_docx':
+        if intermediate:
+            # A PDF typeset from text has far more pages than its size suggests
+            pages = size_mb * 1024 * 1024 / TEXT_BYTES_PER_PAGE
+        else:
+            pages = 20 * size_mb
+        workers = int(options.get('pdf_docx_workers') or os.cpu_count() or 1)
+        chunk_pages = int(options.get('pdf_docx_chunk_pages') or DEFAULT_CHUNK_PAGES)
+        if workers > 1 and pages > chunk_pages:
+            # Split into page ranges: every range process loads the library and holds its own pages
+            processes = min(workers, math.ceil(pages / chunk_pages))
+            return processes * (DOCUMENT_LIBRARY_MB + PDF2DOCX_MB_PER_PAGE * chunk_pages)
+        return DOCUMENT_LIBRARY_MB + PDF2DOCX_MB_PER_PAGE * pages
+    if backend_name == 'docx_to_pdf':
+        return DOCUMENT_LIBRARY_MB + 10 * size_mb
+    if backend_name == 'spreadsheet':
+        if input_format == '.xlsx':
+            return SPREADSHEET_LIBRARY_MB + SHARED_STRINGS_EXPANSION * size_mb
+        return SPREADSHEET_LIBRARY_MB
+    # Text backends stream their input
+    return 20
+
+
+def estimate_cost(input_path, output_formats, options=None):
+    """
+    Returns (memory_mb, cpu_seconds) for converting input_path to every
+    format in output_formats in one job (a fan-out group shares the worker
+    and the decode, but every target adds its encoder's memory).
+    """
+    options = options or {}
+    input_format = resolve_format(input_path)
+    try:
+        size_mb = os.path.getsize(input_path) / (1024 * 1024)
+    except OSError:
+        size_mb = 0.0
+    measured_memory = load_measured('peak_rss_mb')
+    measured_seconds = load_measured('seconds_per_mb')
+    memory_mb = WORKER_BASE_MB
+    cpu_seconds = 0.0
+    for output_format in output_formats:
+        conversion_plan = plan_for(input_format, output_format)
+        if conversion_plan is None:
+            continue
+        # The steps of a chain run one after another, so the largest one counts
+        needed = max(_backend_mb(backend.name, input_path, step_input, size_mb, options, step > 0)
+                     for step, (step_input, _, backend) in enumerate(conversion_plan.steps))
+        peak = measured_memory.get((input_format, output_format))
+        if peak is not None:
+            needed = max(needed, peak - WORKER_BASE_MB)
+        memory_mb += needed
+        for step_input, step_output, backend in conversion_plan.steps:
+            per_mb = measured_seconds.get((step_input, step_output))
+            if per_mb is None:
+                per_mb = DEFAULT_COSTS.get(backend.name, UNKNOWN_COST)
+            cpu_seconds += per_mb * size_mb
+    return round(memory_mb, 1), round(cpu_seconds, 3)
+
+
+class MemoryBudget:
+    """Tracks the estimated memory of running jobs against a budget."""
+
+    def __init__(self, budget_mb=None):
+        self.budget_mb = float(budget_mb or default_memory_budget_mb())
+        self.reserved_mb = 0.0
+        self.running = 0
+        self.peak_mb = 0.0
+
+    def fits(self, memory_mb):
+        # An oversized job still runs, alone, rather than never
+        return self.running == 0 or self.reserved_mb + memory_mb <= self.budget_mb
+
+    def reserve(self, memory_mb):
+        self.reserved_mb += memory_mb
+        self.running += 1
+        self.peak_mb = max(self.peak_mb, self.reserved_mb)
+
+    def release(self, memory_mb):
+        self.reserved_mb = max(0.0, self.reserved_mb - memory_mb)
+        self.running -= 1
+
+    def snapshot(self):
+        return {
+            'running': self.running,
+            'memory_budget_mb': round(self.budget_mb, 1),
+            'memory_reserved_mb': round(self.reserved_mb, 1),
+            'budget_utilisation': round(self.reserved_mb / self.budget_mb, 3),
+            'peak_budget_utilisation': round(self.peak_mb / self.budget_mb, 3),
+        }
+
+
+class JobScheduler:
+    """
+    Orders pending jobs longest first under a memory budget and per-category
+    concurrency limits. Jobs are any objects with category, memory_mb and
+    cpu_seconds attributes. Not thread-safe.
+    """
+
+    def __init__(self, budget_mb=None, category_limits=None):
+        self.budget = MemoryBudget(budget_mb)
+        self.category_limits = dict(category_limits or {})
+        self.running_per_category = {}
+        # Sorted by (-cpu_seconds, arrival), so the longest job comes first
+        self._keys = []
+        self._jobs = []
+        self._arrivals = 0
+        # Jobs that had to wait at least once because they did not fit
+        self._deferred = set()
+
+    def __len__(self):
+        return len(self._jobs)
+
+    def push(self, job):
+        key = (-job.cpu_seconds, self._arrivals)
+        self._arrivals += 1
+        position = bisect.bisect(self._keys, key)
+        self._keys.insert(position, key)
+        self._jobs.insert(position, job)
+
+    def _category_open(self, category):
+        limit = self.category_limits.get(category)
+        return limit is None or self.running_per_category.get(category, 0) < limit
+
+    def pop(self):
+        """Removes, admits and returns the longest job that may start now, or None."""
+        for position, job in enumerate(self._jobs):
+            if not self._category_open(job.category):
+                continue
+            if not self.budget.fits(job.memory_mb):
+                self._deferred.add(id(job))
+                continue
+            del self._keys[position]
+            del self._jobs[position]
+            self.admit(job)
+            return job
+        return None
+
+    def can_admit(self, job):
+        return self._category_open(job.category) and self.budget.fits(job.memory_mb)
+
+    def admit(self, job):
+        """Counts job as running, e.g. one that is run again after a pool restart."""
+        self.budget.reserve(job.memory_mb)
+        self.running_per_category[job.category] = self.running_per_category.get(job.category, 0) + 1
+
+    def release(self, job):
+        self.budget.release(job.memory_mb)
+        self.running_per_category[job.category] -= 1
+
+    def snapshot(self):
+        return {'queued': len(self._jobs), **self.budget.snapshot(), 'deferred_for_memory': len(self._deferred)}
@@ -1,183 +1,26 @@
 import os
 import sys
 from PyQt6.QtWidgets import (QMainWindow, QWidget, QVBoxLayout, QHBoxLayout, 
-                             QPushButton, QListWidget, QFileDialog, QComboBox,
-                             QListWidgetItem, QStatusBar, QProgressBar, QLabel,
+                             QPushButton, QListView, QFileDialog, QAbstractItemView,
+                             QStatusBar, QProgressBar, QLabel, QMessageBox,
                              QApplication, QFrame)
-from PyQt6.QtCore import Qt, pyqtSignal
-from PyQt6.QtGui import QDragEnterEvent, QDropEvent
+from PyQt6.QtCore import Qt, QTimer
+from PyQt6.QtGui import QDragEnterEvent, QDropEvent, QKeySequence, QShortcut
 from styles import get_style, get_icons
 from settings_manager import SettingsManager
 from utils import get_supported_formats
 from conversion_worker import ConversionWorker
+from conversion_cache import cache_from_settings
+from file_converter import converter_options_from_settings
+from conversion_metrics import metrics_log_from_settings
+from job_queue import queue_from_settings
+from settings_dialog import SettingsDialog
+from file_list_model import FileListModel, FileItemDelegate
+from file_scanner import DEFAULT_EXCLUDE, parse_patterns
+from scan_worker import ScanWorker
 
 ICONS = None
 
-class CustomFileItemWidget(QWidget):
-    """
-    Custom widget for each item in the file list.
-    Includes an icon, file name, format selector, and a remove button.
-    """
-    remove_requested = pyqtSignal(QListWidgetItem)
-
-    def __init__(self, file_path, supported_formats, parent_item):
-        super().__init__()
-        self.file_path = file_path
-        self.parent_item = parent_item
-
-        # Outer frame for shadow and rounded bg
-        frame = QFrame(self)
-        frame.setObjectName("FileItemFrame")
-        frame.setStyleSheet("""
-            QFrame#FileItemFrame {
-                background: qlineargradient(spread:pad, x1:0, y1:0, x2:1, y2:1, stop:0 #2B2D4A, stop:1 #3A1C71);
-                border-radius: 16px;
-                border: 1.5px solid #5A5CFF;
-                box-shadow: 0px 6px 24px rgba(58,28,113,0.18);
-                backdrop-filter: blur(8px);
-                opacity: 0.98;
-                transition: box-shadow 0.3s, border 0.3s;
-            }
-            QFrame#FileItemFrame:hover {
-                border: 2px solid #7F53FF;
-                box-shadow: 0px 12px 32px rgba(127,83,255,0.12);
-                opacity: 1.0;
-            }
-        """)
-        frame_layout = QHBoxLayout(frame)
-        frame_layout.setContentsMargins(16, 10, 16, 10)
-        frame_layout.setSpacing(20)
-        frame_layout.setAlignment(Qt.AlignmentFlag.AlignVCenter)
-
-        # File Icon
-        icon_label = QLabel()
-        icon_label.setPixmap(self.get_file_icon().pixmap(32, 32))
-        icon_label.setAlignment(Qt.AlignmentFlag.AlignVCenter)
-        icon_label.setStyleSheet("""
-            QLabel {
-                background: qradialgradient(cx:0.5, cy:0.5, radius:0.7, fx:0.5, fy:0.5, stop:0 #7F53FF, stop:1 transparent);
-                border-radius: 10px;
-                padding: 2px;
-            }
-        """)
-        frame_layout.addWidget(icon_label)
-
-        # File Name
-        file_name_label = QLabel(os.path.basename(file_path))
-        file_name_label.setToolTip(file_path)
-        file_name_label.setMinimumHeight(32)
-        file_name_label.setAlignment(Qt.AlignmentFlag.AlignVCenter)
-        file_name_label.setStyleSheet("""
-            QLabel {
-                font-size: 16px;
-                color: #E0E6F8;
-                font-weight: 600;
-                padding-left: 6px;
-                letter-spacing: 0.5px;
-                text-shadow: 0px 2px 8px rgba(58,28,113,0.12);
-            }
-        """)
-        frame_layout.addWidget(file_name_label, 1)
-
-        # File Type Badge
-        _, ext = os.path.splitext(file_path)
-        ext = ext.lower()
-        badge = QLabel(ext.upper()[1:] if len(ext) > 1 else "?")
-        badge.setStyleSheet("""
-            QLabel {
-                background: qlineargradient(spread:pad, x1:0, y1:0, x2:1, y2:1, stop:0 #5A5CFF, stop:1 #7F53FF);
-                color: #F5F5F7;
-                border-radius: 10px;
-                font-size: 13px;
-                font-weight: 700;
-                padding: 4px 12px;
-                margin-right: 10px;
-                box-shadow: 0px 2px 8px rgba(127,83,255,0.10);
-                border: 1px solid #7F53FF;
-            }
-        """)
-        badge.setAlignment(Qt.AlignmentFlag.AlignCenter)
-        badge.setToolTip(f"File type: {ext}")
-        frame_layout.addWidget(badge)
-
-        # Format ComboBox
-        self.format_combo = QComboBox()
-        _, ext = os.path.splitext(file_path)
-        ext = ext.lower()
-        for category, formats in supported_formats.items():
-            if ext in formats:
-                self.format_combo.addItems(formats[ext])
-        self.format_combo.setMinimumHeight(32)
-        self.format_combo.setEditable(False)
-        self.format_combo.setStyleSheet("""
-            QComboBox {
-                background: qlineargradient(spread:pad, x1:0, y1:0, x2:1, y2:1, stop:0 #23242A, stop:1 #5A5CFF);
-                color: #E0E6F8;
-                border-radius: 10px;
-                font-size: 15px;
-                font-weight: 600;
-                padding: 6px 18px;
-                border: 1.5px solid #7F53FF;
-                box-shadow: 0px 2px 8px rgba(127,83,255,0.10);
-            }
-            QComboBox:hover {
-                background: #7F53FF;
-                color: #F5F5F7;
-                border: 2px solid #5A5CFF;
-            }
-        """)
-        self.format_combo.setToolTip("Select output format")
-        frame_layout.addWidget(self.format_combo, alignment=Qt.AlignmentFlag.AlignVCenter)
-
-        # Remove Button
-        remove_button = QPushButton()
-        remove_button.setIcon(ICONS['remove'])
-        remove_button.setObjectName("RemoveButton")
-        remove_button.setToolTip("Remove this file")
-        remove_button.setMinimumHeight(32)
-        remove_button.setMaximumWidth(36)
-        remove_button.setStyleSheet("""
-            QPushButton#RemoveButton {
-                background: qlineargradient(spread:pad, x1:0, y1:0, x2:1, y2:1, stop:0 #5A5CFF, stop:1 #3A1C71);
-                border-radius: 10px;
-                color: #F5F5F7;
-                font-weight: bold;
-                border: 1.5px solid #7F53FF;
-                box-shadow: 0px 2px 8px rgba(127,83,255,0.10);
-                transition: background 0.3s, color 0.3s;
-            }
-            QPushButton#RemoveButton:hover {
-                background: #7F53FF;
-                color: #E0E6F8;
-                border: 2px solid #5A5CFF;
-            }
-        """)
-        remove_button.setSizePolicy(remove_button.sizePolicy().horizontalPolicy(), remove_button.sizePolicy().verticalPolicy())
-        remove_button.clicked.connect(self.emit_remove_request)
-        frame_layout.addWidget(remove_button, alignment=Qt.AlignmentFlag.AlignVCenter)
-
-        main_layout = QVBoxLayout(self)
-        main_layout.setContentsMargins(0, 6, 0, 6)
-        main_layout.addWidget(frame)
-        self.setMinimumHeight(64)
-
-    def get_file_icon(self):
-        _, ext = os.path.splitext(self.file_path)
-        ext = ext.lower()
-        if ext in ['.png', '.jpg', '.jpeg', '.bmp', '.gif', '.tiff', '.webp']: return ICONS['img']
-        if ext in ['.mp3', '.wav', '.ogg', '.flac', '.aac', '.wma', '.m4a']: return ICONS['aud']
-        if ext in ['.mp4', '.avi', '.mov', '.mkv', '.wmv', '.webm', '.flv', '.mpeg', '.mpg']: return ICONS['vid']
-        if ext in ['.docx', '.doc', '.odt', '.rtf']: return ICONS['doc']
-        if ext in ['.pdf']: return ICONS['pdf']
-        if ext in ['.xlsx', '.xls', '.csv']: return ICONS.get('sheet', ICONS['unknown'])
-        if ext in ['.pptx', '.ppt']: return ICONS.get('ppt', ICONS['unknown'])
-        if ext in ['.txt', '.py', '.json', '.xml', '.html', '.md', '.log', '.ini', '.yaml', '.yml']: return ICONS.get('text', ICONS['unknown'])
-        if ext in ['.zip', '.rar', '.7z', '.tar', '.gz']: return ICONS.get('archive', ICONS['unknown'])
-        return ICONS['unknown']
-
-    def emit_remove_request(self):
-        self.remove_requested.emit(self.parent_item)
-
 class MainWindow(QMainWindow):
     def __init__(self):
         super().__init__()
@@ -201,6 +44,8 @@ class MainWindow(QMainWindow):
         self.output_directory = self.settings_manager.get('output_directory', os.path.expanduser('~'))
         self.update_output_dir_label()
         self.update_empty_list_label_visibility()
+        # Asked once the window is up, so the question appears on top of it
+        QTimer.singleShot(0, self.offer_resume)
 
     def setup_ui(self):
         # Header
@@ -225,9 +70,26 @@ class MainWindow(QMainWindow):
         list_layout = QVBoxLayout(list_frame)
         list_layout.setContentsMargins(0,0,0,0)
         
-        self.file_list_widget = QListWidget()
-        self.file_list_widget.itemChanged.connect(self.update_empty_list_label_visibility)
-        list_layout.addWidget(self.file_list_widget)
+        # Rows are painted by the delegate; only the row being edited gets a widget
+        self.file_list_model = FileListModel(self.supported_formats, self)
+        self.file_list_view = QListView()
+        self.file_list_view.setModel(self.file_list_model)
+        self.file_list_delegate = FileItemDelegate(ICONS, self.file_list_view)
+        self.file_list_delegate.remove_requested.connect(self.remove_file_item)
+        self.file_list_view.setItemDelegate(self.file_list_delegate)
+        self.file_list_view.setUniformItemSizes(True)
+        # Lays rows out incrementally, so inserts and removals don't block on 100k rows
+        self.file_list_view.setLayoutMode(QListView.LayoutMode.Batched)
+        self.file_list_view.setMouseTracking(True)
+        self.file_list_view.setSelectionMode(QAbstractItemView.SelectionMode.ExtendedSelection)
+        self.file_list_view.setEditTriggers(QAbstractItemView.EditTrigger.NoEditTriggers)
+        self.file_list_view.setVerticalScrollMode(QAbstractItemView.ScrollMode.ScrollPerPixel)
+        self.file_list_model.rowsInserted.connect(self.update_empty_list_label_visibility)
+        self.file_list_model.rowsRemoved.connect(self.update_empty_list_label_visibility)
+        self.file_list_model.modelReset.connect(self.update_empty_list_label_visibility)
+        QShortcut(QKeySequence.StandardKey.Delete, self.file_list_view, self.remove_selected_files)
+        list_layout.addWidget(self.file_list_view)
+        self._list_is_empty = None
 
         self.empty_list_label = QLabel("Drag & Drop Files Here or 'Add Files'")
         self.empty_list_label.setObjectName("EmptyListLabel")
@@ -265,6 +127,14 @@ class MainWindow(QMainWindow):
         """)
         button_layout.addWidget(self.add_files_button)
 
+        self.add_folder_button = QPushButton(" Add Folder")
+        self.add_folder_button.setIcon(ICONS['add_folder'])
+        self.add_folder_button.setObjectName("SecondaryButton")
+        self.add_folder_button.clicked.connect(self.add_folder_dialog)
+        self.add_folder_button.setMinimumHeight(38)
+        self.add_folder_button.setStyleSheet(self.add_files_button.styleSheet())
+        button_layout.addWidget(self.add_folder_button)
+
         self.set_output_dir_button = QPushButton(" Set Output")
         self.set_output_dir_button.setIcon(ICONS['folder'])
         self.set_output_dir_button.setObjectName("SecondaryButton")
@@ -281,6 +151,14 @@ class MainWindow(QMainWindow):
         self.clear_all_button.setStyleSheet(self.add_files_button.styleSheet())
         button_layout.addWidget(self.clear_all_button)
 
+        self.settings_button = QPushButton(" Settings")
+        self.settings_button.setIcon(ICONS['settings'])
+        self.settings_button.setObjectName("SecondaryButton")
+        self.settings_button.clicked.connect(self.open_settings_dialog)
+        self.settings_button.setMinimumHeight(38)
+        self.settings_button.setStyleSheet(self.add_files_button.styleSheet())
+        button_layout.addWidget(self.settings_button)
+
         button_layout.addStretch()
 
         self.convert_button = QPushButton(" Convert Files")
@@ -316,43 +194,111 @@ class MainWindow(QMainWindow):
         self.progress_bar = QProgressBar()
         self.progress_bar.setFixedWidth(200)
         self.status_bar.addPermanentWidget(self.progress_bar)
+        self.cancel_conversion_button = QPushButton("Cancel")
+        self.cancel_conversion_button.setObjectName("SecondaryButton")
+        self.cancel_conversion_button.setToolTip("Stop the running conversions and remove their partial outputs")
+        self.cancel_conversion_button.clicked.connect(self.cancel_conversion)
+        self.cancel_conversion_button.setVisible(False)
+        self.status_bar.addPermanentWidget(self.cancel_conversion_button)
+        self.worker = None
         
         self.output_dir_label = QLabel()
         self.status_bar.addWidget(self.output_dir_label)
 
+        self.throughput_label = QLabel()
+        self.status_bar.addPermanentWidget(self.throughput_label)
+
+        self.scan_label = QLabel()
+        self.status_bar.addPermanentWidget(self.scan_label)
+        self.cancel_scan_button = QPushButton("Cancel Scan")
+        self.cancel_scan_button.setObjectName("SecondaryButton")
+        self.cancel_scan_button.clicked.connect(self.cancel_scans)
+        self.status_bar.addPermanentWidget(self.cancel_scan_button)
+        self.scan_workers = []
+        self.scan_counts = {}
+        self.update_scan_status()
+
         dev_label = QLabel("Developed by Jeba Seelan")
         self.status_bar.addPermanentWidget(dev_label)
 
     def process_files(self, file_paths):
-        for file_path in file_paths:
-            _, ext = os.path.splitext(file_path)
-            # Check if extension is supported
-            is_supported = any(ext.lower() in formats for formats in self.supported_formats.values())
-            if is_supported:
-                list_item = QListWidgetItem()
-                item_widget = CustomFileItemWidget(file_path, self.supported_formats, list_item)
-                item_widget.remove_requested.connect(self.remove_file_item)
-                self.file_list_widget.addItem(list_item)
-                self.file_list_widget.setItemWidget(list_item, item_widget)
-                # Set a fixed height for better stretching and background radius
-                list_item.setSizeHint(item_widget.sizeHint())
-            else:
-                self.status_bar.showMessage(f"Unsupported file type: {os.path.basename(file_path)}", 5000)
-        self.update_empty_list_label_visibility()
+        unsupported = self.file_list_model.add_files(file_paths)
+        if len(unsupported) == 1:
+            self.status_bar.showMessage(f"Unsupported file type: {os.path.basename(unsupported[0])}", 5000)
+        elif unsupported:
+            self.status_bar.showMessage(f"Skipped {len(unsupported)} files with unsupported types", 5000)
 
     def add_files_dialog(self):
         files, _ = QFileDialog.getOpenFileNames(self, "Select Files to Convert")
         if files:
-            self.process_files(files)
+            # Typing a file reads its header, so that happens off the GUI thread too
+            self.start_scan(files)
 
-    def remove_file_item(self, item):
-        row = self.file_list_widget.row(item)
-        self.file_list_widget.takeItem(row)
-        self.update_empty_list_label_visibility()
+    def add_folder_dialog(self):
+        directory = QFileDialog.getExistingDirectory(self, "Select Folder to Convert")
+        if directory:
+            self.start_scan([directory])
+
+    def start_scan(self, paths):
+        """Types files and scans folders in the background, adding supported files in batches."""
+        settings = self.settings_manager
+        min_mb = settings.get('scan_min_size_mb') or 0
+        max_mb = settings.get('scan_max_size_mb') or 0
+        worker = ScanWorker(
+            paths,
+            include=parse_patterns(settings.get('scan_include')),
+            exclude=parse_patterns(settings.get('scan_exclude', DEFAULT_EXCLUDE)),
+            formats={ext for formats in self.supported_formats.values() for ext in formats},
+            min_size=int(min_mb * 1024 * 1024) if min_mb else None,
+            max_size=int(max_mb * 1024 * 1024) if max_mb else None,
+        )
+        worker.batch.connect(self.process_files)
+        worker.progress.connect(lambda found, worker=worker: self.on_scan_progress(worker, found))
+        worker.scan_finished.connect(lambda found, skipped, cancelled, worker=worker:
+                                     self.on_scan_finished(worker, found, skipped, cancelled))
+        self.scan_workers.append(worker)
+        self.scan_counts[worker] = 0
+        self.update_scan_status()
+        worker.start()
+
+    def on_scan_progress(self, worker, found):
+        self.scan_counts[worker] = found
+        self.update_scan_status()
+
+    def on_scan_finished(self, worker, found, skipped, cancelled):
+        if worker in self.scan_workers:
+            self.scan_workers.remove(worker)
+        self.scan_counts.pop(worker, None)
+        message = f"Scan {'cancelled' if cancelled else 'finished'}: {found} files added"
+        if skipped:
+            message += f", {skipped} with unsupported types skipped"
+        self.status_bar.showMessage(message, 5000)
+        self.update_scan_status()
+
+    def cancel_scans(self):
+        for worker in self.scan_workers:
+            worker.stop()
+
+    def update_scan_status(self):
+        scanning = bool(self.scan_workers)
+        self.scan_label.setVisible(scanning)
+        self.cancel_scan_button.setVisible(scanning)
+        if scanning:
+            self.scan_label.setText(f"Scanning… {sum(self.scan_counts.values())} files found")
+
+    def remove_file_item(self, row):
+        self.file_list_model.remove_rows([row])
+
+    def remove_selected_files(self):
+        # Selection ranges avoid materialising an index object per selected row
+        ranges = [(r.top(), r.bottom()) for r in self.file_list_view.selectionModel().selection()]
+        if sum(bottom - top + 1 for top, bottom in ranges) == self.file_list_model.rowCount():
+            self.file_list_model.clear()
+        else:
+            self.file_list_model.remove_rows([row for top, bottom in ranges for row in range(top, bottom + 1)])
 
     def clear_all_files(self):
-        self.file_list_widget.clear()
-        self.update_empty_list_label_visibility()
+        self.file_list_model.clear()
         
     def set_output_directory(self):
         directory = QFileDialog.getExistingDirectory(self, "Select Output Directory", self.output_directory)
@@ -361,51 +307,112 @@ class MainWindow(QMainWindow):
             self.settings_manager.set('output_directory', directory)
             self.update_output_dir_label()
 
+    def open_settings_dialog(self):
+        dialog = SettingsDialog(self.settings_manager, self)
+        dialog.exec()
+
     def update_output_dir_label(self):
         self.output_dir_label.setText(f"Output: {self.output_directory}")
         
     def update_empty_list_label_visibility(self):
-        is_empty = self.file_list_widget.count() == 0
+        is_empty = self.file_list_model.rowCount() == 0
+        # Restyling is expensive, so only do it when the list flips between empty and filled
+        if is_empty == self._list_is_empty:
+            return
+        self._list_is_empty = is_empty
         self.empty_list_label.setVisible(is_empty)
-        # Update QSS for item background radius and border
         if is_empty:
-            self.file_list_widget.setStyleSheet("QListWidget { border: 2px dashed #4A4C50; border-radius: 8px; } QListWidget::item { border-radius: 8px; }")
+            self.file_list_view.setStyleSheet("QListView { border: 2px dashed #4A4C50; border-radius: 8px; }")
         else:
-            self.file_list_widget.setStyleSheet("QListWidget { border: 1px solid #4A4C50; border-radius: 8px; } QListWidget::item { border-radius: 8px; }")
+            self.file_list_view.setStyleSheet("QListView { border: 1px solid #4A4C50; border-radius: 8px; }")
 
     def start_conversion(self):
         print("Convert button pressed!")
-        files_to_convert = []
-        for i in range(self.file_list_widget.count()):
-            item = self.file_list_widget.item(i)
-            widget = self.file_list_widget.itemWidget(item)
-            if widget:
-                file_path = widget.file_path
-                output_format = widget.format_combo.currentText().strip()
-                if not output_format:
-                    print(f"Skipping {file_path}: No output format selected.")
-                    self.status_bar.showMessage(f"No output format selected for {os.path.basename(file_path)}", 5000)
-                    continue
-                print(f"Queued for conversion: {file_path} -> {output_format}")
-                files_to_convert.append((file_path, output_format))
+        files_to_convert = self.file_list_model.jobs()
+        skipped = self.file_list_model.unassigned_count()
+        if skipped:
+            print(f"Skipping {skipped} files: No output format selected.")
+            self.status_bar.showMessage(f"No output format selected for {skipped} files", 5000)
 
         if files_to_convert:
-            print(f"Starting conversion for {len(files_to_convert)} files. Output dir: {self.output_directory}")
-            self.convert_button.setEnabled(False)
-            self.worker = ConversionWorker(files_to_convert, self.output_directory)
-            self.worker.progress.connect(self.progress_bar.setValue)
-            self.worker.status.connect(self.status_bar.showMessage)
-            self.worker.finished.connect(lambda: self.convert_button.setEnabled(True))
-            self.worker.finished.connect(lambda: self.progress_bar.setValue(100))
-            self.worker.start()
+            print(f"Starting {len(files_to_convert)} conversions. Output dir: {self.output_directory}")
+            self.run_worker(files_to_convert)
         else:
             print("No files to convert!")
 
+    def run_worker(self, files_to_convert, job_queue=None):
+        self.convert_button.setEnabled(False)
+        self.worker = ConversionWorker(
+            files_to_convert,
+            self.output_directory,
+            max_workers=self.settings_manager.get('max_workers', os.cpu_count() or 1),
+            category_limits=self.settings_manager.get('category_limits'),
+            cache=cache_from_settings(self.settings_manager),
+            metrics_log=metrics_log_from_settings(self.settings_manager),
+            job_queue=job_queue or queue_from_settings(self.settings_manager),
+            job_timeout=self.settings_manager.get('job_timeout_seconds') or None,
+            memory_budget_mb=self.settings_manager.get('memory_budget_mb') or None,
+            converter_options=converter_options_from_settings(self.settings_manager),
+        )
+        self.worker.progress.connect(self.progress_bar.setValue)
+        self.worker.summary.connect(self.update_throughput_label)
+        self.worker.status.connect(self.status_bar.showMessage)
+        self.worker.finished.connect(lambda: self.convert_button.setEnabled(True))
+        self.worker.finished.connect(lambda: self.cancel_conversion_button.setVisible(False))
+        self.worker.finished.connect(lambda: self.progress_bar.setValue(100))
+        self.progress_bar.setValue(0)
+        self.cancel_conversion_button.setEnabled(True)
+        self.cancel_conversion_button.setVisible(True)
+        self.worker.start()
+
+    def cancel_conversion(self):
+        if self.worker is not None and self.worker.isRunning():
+            self.cancel_conversion_button.setEnabled(False)
+            self.status_bar.showMessage("Cancelling conversions…")
+            self.worker.stop()
+
+    def offer_resume(self):
+        """Offers to finish the jobs an interrupted session left in the queue."""
+        job_queue = queue_from_settings(self.settings_manager)
+        if job_queue is None:
+            return
+        unfinished = job_queue.unfinished_count()
+        if not unfinished:
+            job_queue.close()
+            return
+        answer = QMessageBox.question(
+            self, "Resume Conversions",
+            f"Conversions left unfinished by the last session: {unfinished}. Resume them now?")
+        if answer == QMessageBox.StandardButton.Yes:
+            self.run_worker([], job_queue)
+        else:
+            job_queue.discard_unfinished()
+            job_queue.close()
+
+    def update_throughput_label(self, summary):
+        text = f"{summary['files']} files · {summary['files_per_s']:.2f} files/s · {summary['mb_per_s']:.2f} MB/s"
+        scheduler = summary.get('scheduler')
+        if scheduler:
+            text += f" · {scheduler['queued']} queued · memory {scheduler['budget_utilisation']:.0%}"
+        self.throughput_label.setText(text)
+
+    def closeEvent(self, event):
+        # Conversions run in processes of their own; do not leave them behind
+        self.cancel_scans()
+        # A QThread destroyed while still running aborts the application
+        for worker in list(self.scan_workers):
+            worker.wait()
+        if self.worker is not None and self.worker.isRunning():
+            self.worker.stop()
+            self.worker.wait()
+        super().closeEvent(event)
+
     def dragEnterEvent(self, event: QDragEnterEvent):
         if event.mimeData().hasUrls():
             event.acceptProposedAction()
 
     def dropEvent(self, event: QDropEvent):
         urls = event.mimeData().urls()
-        file_paths = [url.toLocalFile() for url in urls if url.isLocalFile()]
-        self.process_files(file_paths)
+        paths = [url.toLocalFile() for url in urls if url.isLocalFile()]
+        if paths:
+            self.start_scan(paths)
@@ -0,0 +1,143 @@
+"""
+PDF-to-DOCX engine.
+
+pdf2docx parses a PDF page by page in one process. Large documents are
+split into page ranges of pdf_docx_chunk_pages instead, each range is
+converted to its own DOCX in a pool of pdf_docx_workers processes, and the
+parts are merged in page order. pdf2docx's own multi-processing is not
+used: it always splits into one range per CPU, and it writes its
+intermediate files to the current directory, where concurrent jobs would
+collide.
+
+pdf2docx starts every page in a new section, so merging appends the body
+of each part after a section break carrying the previous part's last page
+setup. Images and hyperlinks referenced by a part are re-added to the
+merged document.
+"""
+import io
+import multiprocessing
+import os
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from conversion_metrics import progress_span, report_progress, stage
+
+DEFAULT_CHUNK_PAGES = 25
+
+
+def _load_converter():
+    try:
+        from pdf2docx import Converter
+    except ImportError:
+        raise RuntimeError("pdf2docx is not installed. Please install it with 'pip install pdf2docx'.")
+    return Converter
+
+
+def _convert_range(input_path, output_path, start=0, end=None):
+    converter = _load_converter()(input_path)
+    try:
+        converter.convert(output_path, start=start, end=end)
+    finally:
+        converter.close()
+
+
+def page_ranges(page_count, chunk_pages):
+    return [(start, min(start + chunk_pages, page_count)) for start in range(0, page_count, chunk_pages)]
+
+
+def split_settings(options):
+    """(workers, chunk_pages) for options, with the defaults filled in."""
+    workers = int(options.get('pdf_docx_workers') or os.cpu_count() or 1)
+    chunk_pages = max(1, int(options.get('pdf_docx_chunk_pages') or DEFAULT_CHUNK_PAGES))
+    return workers, chunk_pages
+
+
+def cache_options(options):
+    """
+    What decides the output besides the PDF itself: whether large documents
+    are split, and where. The worker count only matters as one or several,
+    and its default depends on the machine.
+    """
+    workers, chunk_pages = split_settings(options)
+    return {'pdf_docx_split': workers >= 2, 'pdf_docx_chunk_pages': chunk_pages}
+
+
+def convert_pdf_to_docx(input_path, output_path, options=None):
+    options = options or {}
+    workers, chunk_pages = split_settings(options)
+    converter = _load_converter()(input_path)
+    try:
+        page_count = converter.fitz_doc.page_count
+    finally:
+        converter.close()
+    if workers < 2 or page_count <= chunk_pages:
+        with stage('encode'):
+            _convert_range(input_path, output_path)
+        return
+
+    ranges = page_ranges(page_count, chunk_pages)
+    # Part files go next to the output under this worker's pid, so a cancelled job's parts are removed with it
+    work_dir = tempfile.mkdtemp(prefix=f'.pxconvert-{os.getpid()}-',
+                                dir=os.path.dirname(os.path.abspath(output_path)))
+    try:
+        parts = [os.path.join(work_dir, f"part_{index:05d}.docx") for index in range(len(ranges))]
+        context = multiprocessing.get_context('spawn')
+        with stage('encode'), progress_span(0.0, 0.9), \
+                ProcessPoolExecutor(max_workers=min(workers, len(ranges)), mp_context=context) as executor:
+            futures = [executor.submit(_convert_range, input_path, part, start, end)
+                       for part, (start, end) in zip(parts, ranges)]
+            for done, future in enumerate(as_completed(futures), start=1):
+                future.result()
+                report_progress(done / len(futures))
+        with stage('write'), progress_span(0.9, 1.0):
+            merge_docx(parts, output_path)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def _copy_relationships(element, source_part, target_part):
+    """Points the relationship ids used in element at parts of target_part, adding them where needed."""
+    from docx.opc.constants import RELATIONSHIP_TYPE as RT
+    from docx.oxml.ns import qn
+    r_namespace = qn('r:id')[:-len('id')]
+    mapping = {}
+    for node in element.iter():
+        for name, value in node.attrib.items():
+            if not name.startswith(r_namespace) or value not in source_part.rels:
+                continue
+            if value not in mapping:
+                rel = source_part.rels[value]
+                if rel.is_external:
+                    mapping[value] = target_part.relate_to(rel.target_ref, rel.reltype, is_external=True)
+                elif rel.reltype == RT.IMAGE:
+                    mapping[value], _ = target_part.get_or_add_image(io.BytesIO(rel.target_part.blob))
+                else:
+                    mapping[value] = target_part.relate_to(rel.target_part, rel.reltype)
+            node.set(name, mapping[value])
+
+
+def merge_docx(paths, output_path):
+    """Joins the DOCX files in paths, in order, into output_path."""
+    import copy
+    from docx import Document
+    from docx.oxml import OxmlElement
+    from docx.oxml.ns import qn
+    merged = Document(paths[0])
+    body = merged.element.body
+    for path in paths[1:]:
+        part = Document(path)
+        # The last page setup so far becomes a section break, as doc.add_section() would write it
+        section_properties = body.find(qn('w:sectPr'))
+        paragraph = OxmlElement('w:p')
+        paragraph_properties = OxmlElement('w:pPr')
+        paragraph_properties.append(copy.deepcopy(section_properties))
+        paragraph.append(paragraph_properties)
+        section_properties.addprevious(paragraph)
+        for element in list(part.element.body):
+            _copy_relationships(element, part.part, merged.part)
+            if element.tag == qn('w:sectPr'):
+                body.replace(section_properties, element)
+                section_properties = element
+            else:
+                section_properties.addprevious(element)
+    merged.save(output_path)
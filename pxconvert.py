@@ -0,0 +1,247 @@
+"""
+Headless command-line entry point for Px-Converter Pro.
+
+    python -m pxconvert in/ --to .png --out out/ --jobs 8
+
+Each processed file is reported on stdout as one JSON object per line.
+This module must never import PyQt6 so it can run on machines without a
+display.
+"""
+import argparse
+import json
+import os
+import signal
+import sys
+import tarfile
+import zipfile
+from archive_source import ArchiveWriter, archive_stem, convert_archive, is_archive
+from conversion_cache import ConversionCache, cache_from_settings
+from conversion_engine import ConversionEngine, get_category
+from conversion_metrics import MetricsLog
+from file_converter import converter_options_from_settings
+from file_scanner import iter_files
+from job_queue import JobQueue, drain, queue_from_settings
+from format_sniffer import resolve_format
+from settings_manager import SettingsManager
+from utils import get_supported_formats
+
+EXIT_OK = 0
+EXIT_FAILURES = 1
+EXIT_USAGE = 2
+EXIT_NO_INPUT = 3
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="pxconvert",
+        description="Convert files without the Px-Converter Pro GUI.",
+    )
+    parser.add_argument("inputs", nargs="*", help="Files or directories to convert.")
+    parser.add_argument("--to", dest="output_format",
+                        help="Target extension, e.g. .png, or a comma separated list such as png,jpg,tiff "
+                             "(each input is then decoded once for all targets).")
+    parser.add_argument("--out", dest="output_directory",
+                        help="Output directory (defaults to the saved GUI output directory).")
+    parser.add_argument("--archive-out", metavar="PATH",
+                        help="Write the outputs of archive inputs into this .zip or .tar[.gz|.bz2|.xz] archive.")
+    parser.add_argument("--jobs", "-j", type=int, default=os.cpu_count() or 1,
+                        help="Number of parallel worker processes.")
+    parser.add_argument("--timeout", type=float, metavar="SECONDS",
+                        help="Stop any single conversion still running after this long and count it as failed.")
+    parser.add_argument("--memory-budget", type=int, metavar="MB",
+                        help="Only start conversions while their estimated memory fits in this many MB "
+                             "(default: half of the physical memory).")
+    parser.add_argument("--pdf-workers", type=int, metavar="N",
+                        help="Processes converting the page ranges of one large PDF to DOCX (1 disables splitting).")
+    parser.add_argument("--pdf-chunk-pages", type=int, metavar="PAGES",
+                        help="Pages per range when a PDF is converted to DOCX in parallel.")
+    parser.add_argument("--recursive", "-r", action="store_true",
+                        help="Descend into sub-directories of directory inputs.")
+    parser.add_argument("--include", action="append", metavar="GLOB",
+                        help="Only take files matching this pattern from directories (repeatable).")
+    parser.add_argument("--exclude", action="append", metavar="GLOB",
+                        help="Skip files and directories matching this pattern (repeatable).")
+    parser.add_argument("--list-formats", action="store_true",
+                        help="Print the supported conversions as JSON and exit.")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="Bypass the conversion cache for this run.")
+    parser.add_argument("--clear-cache", action="store_true",
+                        help="Empty the conversion cache before converting (or on its own).")
+    parser.add_argument("--cache-dir", help="Use this conversion cache directory.")
+    parser.add_argument("--cache-size", type=int, metavar="MB",
+                        help="Size limit of the conversion cache in megabytes.")
+    parser.add_argument("--metrics-log", metavar="PATH",
+                        help="Append per-job metrics to this rotating JSON-lines file.")
+    parser.add_argument("--resume", action="store_true",
+                        help="Also run the unfinished jobs an interrupted run left in the job queue.")
+    parser.add_argument("--no-queue", action="store_true",
+                        help="Do not record this run in the durable job queue.")
+    parser.add_argument("--queue-db", metavar="PATH", help="Use this job queue database.")
+    return parser
+
+
+def collect_files(inputs, recursive=False, include=None, exclude=None):
+    return list(iter_files(inputs, recursive, include, exclude))
+
+
+def normalize_format(output_format):
+    output_format = output_format.strip().lower()
+    if not output_format.startswith('.'):
+        output_format = '.' + output_format
+    return output_format
+
+
+def emit(record):
+    sys.stdout.write(json.dumps(record) + "\n")
+    sys.stdout.flush()
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    supported_formats = get_supported_formats()
+
+    if args.list_formats:
+        emit(supported_formats)
+        return EXIT_OK
+
+    settings_manager = SettingsManager()
+    cache = cache_from_settings(settings_manager) or ConversionCache()
+    if args.cache_dir:
+        cache = ConversionCache(args.cache_dir, cache.max_bytes, cache.link_mode)
+    if args.cache_size is not None:
+        cache.max_bytes = args.cache_size * 1024 * 1024
+    if args.clear_cache:
+        cache.clear()
+        print(f"pxconvert: cleared cache {cache.cache_dir}", file=sys.stderr)
+        if not args.inputs:
+            return EXIT_OK
+    if args.no_cache or not settings_manager.get('cache_enabled', True):
+        cache = None
+
+    if args.resume and args.no_queue:
+        parser.print_usage(sys.stderr)
+        print("pxconvert: error: --resume needs the job queue", file=sys.stderr)
+        return EXIT_USAGE
+    if not args.resume and (not args.inputs or not args.output_format):
+        parser.print_usage(sys.stderr)
+        print("pxconvert: error: inputs and --to are required", file=sys.stderr)
+        return EXIT_USAGE
+
+    job_queue = None
+    if not args.no_queue:
+        job_queue = JobQueue(args.queue_db) if args.queue_db else queue_from_settings(settings_manager)
+
+    output_formats = [normalize_format(output_format) for output_format in (args.output_format or '').split(',')
+                      if output_format.strip()]
+    output_directory = args.output_directory or settings_manager.get('output_directory', os.getcwd())
+    os.makedirs(output_directory, exist_ok=True)
+
+    jobs = []
+    archives = []
+    skipped = 0
+    for file_path in collect_files(args.inputs, args.recursive, args.include, args.exclude):
+        if is_archive(file_path):
+            # Converted member by member after the plain files, see archive_source
+            archives.append(file_path)
+            continue
+        ext = resolve_format(file_path)
+        category = get_category(file_path, supported_formats)
+        targets = supported_formats.get(category, {}).get(ext, [])
+        for output_format in output_formats:
+            if output_format in targets:
+                jobs.append((file_path, output_format))
+            else:
+                skipped += 1
+                emit({
+                    "input": file_path,
+                    "output": None,
+                    "ok": False,
+                    "status": "skipped",
+                    "error": f"Conversion from {ext or '(none)'} to {output_format} is not supported.",
+                })
+
+    batch = None
+    if job_queue is not None and jobs:
+        batch = job_queue.add(jobs, output_directory)
+    if not jobs and not archives and not (args.resume and job_queue is not None and job_queue.unfinished_count()):
+        print("pxconvert: no convertible input files found", file=sys.stderr)
+        return EXIT_NO_INPUT
+
+    counts = {"converted": 0, "failed": 0}
+
+    def on_result(result, *_):
+        record = result.to_dict()
+        record["status"] = "converted" if result.ok else "failed"
+        counts[record["status"]] += 1
+        emit(record)
+
+    def on_skipped_member(member_path, ext, output_format):
+        nonlocal skipped
+        skipped += 1
+        emit({
+            "input": member_path,
+            "output": None,
+            "ok": False,
+            "status": "skipped",
+            "error": f"Conversion from {ext or '(none)'} to {output_format} is not supported.",
+        })
+
+    # Turn a plain kill into SystemExit so the engine still stops the
+    # conversions it started, as it does on Ctrl+C
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(128 + signum))
+    metrics_log = MetricsLog(args.metrics_log) if args.metrics_log else None
+    job_timeout = args.timeout if args.timeout is not None else settings_manager.get('job_timeout_seconds')
+    converter_options = converter_options_from_settings(settings_manager)
+    if args.pdf_workers:
+        converter_options['pdf_docx_workers'] = args.pdf_workers
+    if args.pdf_chunk_pages:
+        converter_options['pdf_docx_chunk_pages'] = args.pdf_chunk_pages
+    engine = ConversionEngine(output_directory, args.jobs, cache=cache, metrics_log=metrics_log,
+                              converter_options=converter_options,
+                              job_timeout=job_timeout or None,
+                              memory_budget_mb=args.memory_budget or settings_manager.get('memory_budget_mb'))
+    if job_queue is not None:
+        # Without --resume only this run's jobs are taken; older unfinished ones stay queued
+        drain(job_queue, engine, on_result=on_result, batch=None if args.resume else batch)
+        job_queue.close()
+    elif jobs:
+        engine.run(jobs, on_result=on_result)
+    writer = ArchiveWriter(args.archive_out) if args.archive_out and archives else None
+    try:
+        for archive_path in archives:
+            # With several archives, each one's outputs get their own folder in the output archive
+            prefix = archive_stem(archive_path) if writer is not None and len(archives) > 1 else None
+            try:
+                convert_archive(archive_path, output_formats, engine, writer=writer, prefix=prefix,
+                                on_result=on_result,
+                                on_skipped=lambda name, *formats: on_skipped_member(os.path.join(archive_path, name),
+                                                                                        *formats))
+            except (OSError, ValueError, EOFError, zipfile.BadZipFile, tarfile.TarError) as e:
+                counts["failed"] += 1
+                emit({"input": archive_path, "output": None, "ok": False, "status": "failed",
+                      "error": f"Could not read archive: {e}"})
+    except BaseException:
+        if writer is not None:
+            writer.close(keep=False)
+        raise
+    if writer is not None:
+        writer.close()
+    if metrics_log is not None:
+        metrics_log.close()
+    failed = counts["failed"]
+    print(f"pxconvert: {counts['converted']} converted, {failed} failed, {skipped} skipped",
+          file=sys.stderr)
+    summary = engine.summary.snapshot()
+    print(f"pxconvert: {summary['files_per_s']} files/s, {summary['mb_per_s']} MB/s", file=sys.stderr)
+    if 'scheduler' in summary:
+        print(f"pxconvert: memory budget {summary['scheduler']['memory_budget_mb']:g} MB, "
+              f"peak use {summary['scheduler']['peak_budget_utilisation']:.0%}, "
+              f"{summary['scheduler']['deferred_for_memory']} jobs held back", file=sys.stderr)
+    if cache is not None:
+        print(f"pxconvert: cache {cache.hits} hits, {cache.misses} misses", file=sys.stderr)
+    return EXIT_FAILURES if failed or skipped else EXIT_OK
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,58 @@
+import time
+from PyQt6.QtCore import QThread, pyqtSignal
+from file_scanner import iter_files
+from format_sniffer import resolve_format
+
+BATCH_SIZE = 500
+# Flush a partial batch after this long so slow trees still show progress
+BATCH_INTERVAL = 0.1
+
+
+class ScanWorker(QThread):
+    """
+    Types dropped or selected files and expands folders in the background,
+    and streams the supported files back to the GUI thread in batches.
+    """
+    batch = pyqtSignal(list)
+    progress = pyqtSignal(int) # Files found so far
+    scan_finished = pyqtSignal(int, int, bool) # Total files found, unsupported files skipped, cancelled
+
+    def __init__(self, paths, include=None, exclude=None, formats=None, min_size=None, max_size=None):
+        super().__init__()
+        self.paths = paths
+        self.include = include
+        self.exclude = exclude
+        # Input formats to keep, by content; the name alone would drop extensionless and misnamed files
+        self.formats = formats
+        self.min_size = min_size
+        self.max_size = max_size
+        self.is_running = True
+
+    def run(self):
+        found = 0
+        skipped = 0
+        pending = []
+        last_flush = time.monotonic()
+        for file_path in iter_files(self.paths, True, self.include, self.exclude, None,
+                                    self.min_size, self.max_size, should_stop=lambda: not self.is_running):
+            # Detected here, off the GUI thread; the model then hits the sniff cache
+            if self.formats is not None and resolve_format(file_path) not in self.formats:
+                skipped += 1
+                continue
+            pending.append(file_path)
+            found += 1
+            now = time.monotonic()
+            if len(pending) >= BATCH_SIZE or now - last_flush >= BATCH_INTERVAL:
+                self.batch.emit(pending)
+                self.progress.emit(found)
+                pending = []
+                last_flush = now
+        # Files already found are kept even when the scan is cancelled
+        if pending:
+            self.batch.emit(pending)
+        self.progress.emit(found)
+        print(f"Scan {'cancelled' if not self.is_running else 'finished'}: {found} files found, {skipped} unsupported.")
+        self.scan_finished.emit(found, skipped, not self.is_running)
+
+    def stop(self):
+        self.is_running = False
@@ -0,0 +1,167 @@
+import os
+from PyQt6.QtWidgets import (QDialog, QFormLayout, QSpinBox, QCheckBox, QLabel, QLineEdit,
+                             QPushButton, QDialogButtonBox, QVBoxLayout, QHBoxLayout)
+from conversion_cache import DEFAULT_MAX_MB, ConversionCache, cache_from_settings
+from file_scanner import DEFAULT_EXCLUDE, parse_patterns
+from pdf_docx_engine import DEFAULT_CHUNK_PAGES
+from hot_folder import DEFAULT_SETTLE_SECONDS
+from job_queue import DEFAULT_MAX_ATTEMPTS
+from job_scheduler import default_memory_budget_mb
+
+class SettingsDialog(QDialog):
+    """
+    Dialog for conversion preferences. Values are written back to the
+    SettingsManager when the dialog is accepted.
+    """
+
+    def __init__(self, settings_manager, parent=None):
+        super().__init__(parent)
+        self.settings_manager = settings_manager
+        self.setWindowTitle("Settings")
+        self.setMinimumWidth(420)
+
+        layout = QVBoxLayout(self)
+        form = QFormLayout()
+        form.setSpacing(12)
+
+        self.workers_spin = QSpinBox()
+        self.workers_spin.setRange(1, max(64, (os.cpu_count() or 1) * 4))
+        self.workers_spin.setValue(int(settings_manager.get('max_workers', os.cpu_count() or 1)))
+        self.workers_spin.setToolTip("Number of files converted at the same time")
+        form.addRow("Parallel workers:", self.workers_spin)
+
+        self.timeout_spin = QSpinBox()
+        self.timeout_spin.setRange(0, 7 * 24 * 60)
+        self.timeout_spin.setSuffix(" min")
+        self.timeout_spin.setSpecialValueText("No limit")
+        self.timeout_spin.setValue(int((settings_manager.get('job_timeout_seconds') or 0) // 60))
+        self.timeout_spin.setToolTip("A conversion still running after this long is stopped and counted as failed")
+        form.addRow("Time limit per file:", self.timeout_spin)
+
+        self.memory_budget_spin = QSpinBox()
+        self.memory_budget_spin.setRange(0, 1024 * 1024)
+        self.memory_budget_spin.setSingleStep(256)
+        self.memory_budget_spin.setSuffix(" MB")
+        self.memory_budget_spin.setSpecialValueText(f"Automatic ({default_memory_budget_mb()} MB)")
+        self.memory_budget_spin.setValue(int(settings_manager.get('memory_budget_mb') or 0))
+        self.memory_budget_spin.setToolTip("Parallel conversions only start while their estimated memory fits in this budget")
+        form.addRow("Memory budget:", self.memory_budget_spin)
+
+        self.pdf_workers_spin = QSpinBox()
+        self.pdf_workers_spin.setRange(0, max(64, (os.cpu_count() or 1) * 4))
+        self.pdf_workers_spin.setSpecialValueText(f"Automatic ({os.cpu_count() or 1})")
+        self.pdf_workers_spin.setValue(int(settings_manager.get('pdf_docx_workers') or 0))
+        self.pdf_workers_spin.setToolTip("Processes converting the page ranges of one large PDF to DOCX; 1 converts it in one piece")
+        form.addRow("PDF to DOCX workers:", self.pdf_workers_spin)
+
+        self.pdf_chunk_spin = QSpinBox()
+        self.pdf_chunk_spin.setRange(1, 10000)
+        self.pdf_chunk_spin.setSuffix(" pages")
+        self.pdf_chunk_spin.setValue(int(settings_manager.get('pdf_docx_chunk_pages') or DEFAULT_CHUNK_PAGES))
+        self.pdf_chunk_spin.setToolTip("PDFs with more pages are split into ranges of this size")
+        form.addRow("PDF to DOCX range size:", self.pdf_chunk_spin)
+
+        self.cache_checkbox = QCheckBox("Reuse previous conversions")
+        self.cache_checkbox.setChecked(bool(settings_manager.get('cache_enabled', True)))
+        form.addRow("Conversion cache:", self.cache_checkbox)
+
+        self.cache_size_spin = QSpinBox()
+        self.cache_size_spin.setRange(64, 1024 * 1024)
+        self.cache_size_spin.setSuffix(" MB")
+        self.cache_size_spin.setValue(int(settings_manager.get('cache_max_mb', DEFAULT_MAX_MB)))
+        form.addRow("Cache size limit:", self.cache_size_spin)
+
+        cache_row = QHBoxLayout()
+        self.cache_stats_label = QLabel()
+        cache_row.addWidget(self.cache_stats_label, 1)
+        clear_cache_button = QPushButton("Clear Cache")
+        clear_cache_button.setObjectName("SecondaryButton")
+        clear_cache_button.clicked.connect(self.clear_cache)
+        cache_row.addWidget(clear_cache_button)
+        form.addRow("", cache_row)
+
+        self.queue_checkbox = QCheckBox("Resume unfinished conversions after a crash")
+        self.queue_checkbox.setChecked(bool(settings_manager.get('queue_enabled', True)))
+        form.addRow("Job queue:", self.queue_checkbox)
+
+        self.attempts_spin = QSpinBox()
+        self.attempts_spin.setRange(1, 10)
+        self.attempts_spin.setValue(int(settings_manager.get('queue_max_attempts', DEFAULT_MAX_ATTEMPTS)))
+        self.attempts_spin.setToolTip("Attempts per file when a conversion fails for a temporary reason")
+        form.addRow("Attempts per file:", self.attempts_spin)
+
+        self.scan_include_edit = QLineEdit(", ".join(parse_patterns(settings_manager.get('scan_include'))))
+        self.scan_include_edit.setPlaceholderText("e.g. *.png, *.mp3 (empty = all supported files)")
+        form.addRow("Folder scan include:", self.scan_include_edit)
+
+        self.scan_exclude_edit = QLineEdit(", ".join(parse_patterns(settings_manager.get('scan_exclude', DEFAULT_EXCLUDE))))
+        self.scan_exclude_edit.setToolTip("File or folder names (or relative paths) to skip, glob patterns allowed")
+        form.addRow("Folder scan exclude:", self.scan_exclude_edit)
+
+        size_row = QHBoxLayout()
+        self.scan_min_size_spin = QSpinBox()
+        self.scan_max_size_spin = QSpinBox()
+        for spin, key in ((self.scan_min_size_spin, 'scan_min_size_mb'), (self.scan_max_size_spin, 'scan_max_size_mb')):
+            spin.setRange(0, 1024 * 1024)
+            spin.setSuffix(" MB")
+            spin.setSpecialValueText("No limit")
+            spin.setValue(int(settings_manager.get(key) or 0))
+            size_row.addWidget(spin)
+        size_row.insertWidget(1, QLabel("to"))
+        form.addRow("Folder scan file size:", size_row)
+
+        self.watch_folders_edit = QLineEdit("; ".join(parse_patterns(settings_manager.get('watch_folders'))))
+        self.watch_folders_edit.setPlaceholderText("Folders separated by ;")
+        self.watch_folders_edit.setToolTip("Folders the hot-folder daemon (python -m hot_folder) converts new files from")
+        form.addRow("Hot folders:", self.watch_folders_edit)
+
+        self.watch_format_edit = QLineEdit(", ".join(parse_patterns(settings_manager.get('watch_output_format'))))
+        self.watch_format_edit.setPlaceholderText("e.g. .pdf or .png, .jpg")
+        form.addRow("Hot folder formats:", self.watch_format_edit)
+
+        self.watch_settle_spin = QSpinBox()
+        self.watch_settle_spin.setRange(1, 3600)
+        self.watch_settle_spin.setSuffix(" s")
+        self.watch_settle_spin.setValue(int(settings_manager.get('watch_settle_seconds', DEFAULT_SETTLE_SECONDS)))
+        self.watch_settle_spin.setToolTip("How long a dropped file must stay unchanged before it is converted")
+        form.addRow("Hot folder settle time:", self.watch_settle_spin)
+
+        layout.addLayout(form)
+
+        buttons = QDialogButtonBox(QDialogButtonBox.StandardButton.Ok | QDialogButtonBox.StandardButton.Cancel)
+        buttons.accepted.connect(self.accept)
+        buttons.rejected.connect(self.reject)
+        layout.addWidget(buttons)
+
+        self.update_cache_stats()
+
+    def _cache(self):
+        return cache_from_settings(self.settings_manager) or ConversionCache(self.settings_manager.get('cache_dir') or None)
+
+    def update_cache_stats(self):
+        stats = self._cache().stats()
+        self.cache_stats_label.setText(f"{stats['entries']} entries, {stats['bytes'] / (1024 * 1024):.1f} MB")
+
+    def clear_cache(self):
+        self._cache().clear()
+        self.update_cache_stats()
+
+    def accept(self):
+        self.settings_manager.set('max_workers', self.workers_spin.value())
+        self.settings_manager.set('job_timeout_seconds', self.timeout_spin.value() * 60)
+        self.settings_manager.set('memory_budget_mb', self.memory_budget_spin.value())
+        self.settings_manager.set('pdf_docx_workers', self.pdf_workers_spin.value())
+        self.settings_manager.set('pdf_docx_chunk_pages', self.pdf_chunk_spin.value())
+        self.settings_manager.set('cache_enabled', self.cache_checkbox.isChecked())
+        self.settings_manager.set('cache_max_mb', self.cache_size_spin.value())
+        self.settings_manager.set('queue_enabled', self.queue_checkbox.isChecked())
+        self.settings_manager.set('queue_max_attempts', self.attempts_spin.value())
+        self.settings_manager.set('scan_include', parse_patterns(self.scan_include_edit.text()))
+        self.settings_manager.set('scan_exclude', parse_patterns(self.scan_exclude_edit.text()))
+        self.settings_manager.set('scan_min_size_mb', self.scan_min_size_spin.value())
+        self.settings_manager.set('scan_max_size_mb', self.scan_max_size_spin.value())
+        self.settings_manager.set('watch_folders', [folder.strip() for folder in self.watch_folders_edit.text().split(';')
+                                                    if folder.strip()])
+        self.settings_manager.set('watch_output_format', parse_patterns(self.watch_format_edit.text()))
+        self.settings_manager.set('watch_settle_seconds', self.watch_settle_spin.value())
+        super().accept()
@@ -0,0 +1,282 @@
+"""
+Streaming spreadsheet engine for CSV <-> XLSX.
+
+CSV is parsed row by row from the file (the encoding is detected and the
+dialect sniffed from a bounded prefix) and appended to a write-only
+openpyxl workbook. That workbook spools each sheet to a temporary file
+and writes strings inline, so memory does not grow with the row count.
+Rows past the XLSX limit of 1,048,576 per sheet continue on Sheet2,
+Sheet3 and so on. Numbers are stored as numbers only when they read back
+as the same text, so a round trip through XLSX does not change the CSV.
+
+XLSX is read one row at a time, and the first sheet is written to the
+CSV. Sheets that continue it, as a split table does, are appended so it
+comes back as one table; other sheets are left out with a warning. Parsed rows are dropped as they are read (see
+_WorkbookReader), so only the workbook's shared-string table is held in
+memory.
+"""
+import csv
+import datetime
+import io
+import os
+import re
+import sys
+from conversion_metrics import report_progress, stage
+
+MAX_ROWS = 1048576
+MAX_COLUMNS = 16384
+MAX_CELL_CHARS = 32767
+SNIFF_SIZE = 64 * 1024
+PROGRESS_ROWS = 10000
+DEFAULT_OUTPUT_ENCODING = 'utf-8'
+
+_INTEGER = re.compile(r'0|-?[1-9][0-9]{0,14}')
+_DECIMAL = re.compile(r'-?(0|[1-9][0-9]*)\.[0-9]+')
+
+
+def _dialect(path, encoding):
+    with open(path, 'r', encoding=encoding, errors='replace', newline='') as f:
+        sample = f.read(SNIFF_SIZE)
+    if len(sample) == SNIFF_SIZE:
+        # Only whole lines, so the last record is not mistaken for a different shape
+        sample = sample[:sample.rfind('\n') + 1] or sample
+    try:
+        return csv.Sniffer().sniff(sample, delimiters=',;\t|')
+    except csv.Error:
+        return csv.excel
+
+
+def _cell_value(text):
+    """The value to store for a CSV field: a number if it prints back the same, else the text."""
+    if _INTEGER.fullmatch(text):
+        return int(text)
+    if _DECIMAL.fullmatch(text):
+        value = float(text)
+        # openpyxl writes a whole float without its '.0', so it would come back as an integer
+        if repr(value) == text and not value.is_integer():
+            return value
+    return text
+
+
+def convert_csv_to_xlsx(input_path, output_path, options=None):
+    from openpyxl import Workbook
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+    from text_engine import detect_encoding
+    options = options or {}
+    encoding = options.get('text_source_encoding') or detect_encoding(input_path)
+    rows_per_sheet = min(MAX_ROWS, int(options.get('spreadsheet_rows_per_sheet') or MAX_ROWS))
+    dialect = _dialect(input_path, encoding)
+    size = os.path.getsize(input_path)
+
+    workbook = Workbook(write_only=True)
+    sheet = None
+    sheet_rows = rows_per_sheet
+    truncated = 0
+    cleaned = 0
+    with stage('encode'), open(input_path, 'rb') as raw, \
+            io.TextIOWrapper(raw, encoding=encoding, errors='replace', newline='') as f:
+        for number, fields in enumerate(csv.reader(f, dialect), start=1):
+            if len(fields) > MAX_COLUMNS:
+                raise ValueError(f"Row {number} has {len(fields)} columns; XLSX allows at most {MAX_COLUMNS}.")
+            if sheet_rows >= rows_per_sheet:
+                sheet = workbook.create_sheet(f"Sheet{len(workbook.worksheets) + 1}")
+                sheet_rows = 0
+            row = []
+            for text in fields:
+                if text == '':
+                    row.append(None)
+                    continue
+                if ILLEGAL_CHARACTERS_RE.search(text):
+                    text = ILLEGAL_CHARACTERS_RE.sub('', text)
+                    cleaned += 1
+                if len(text) > MAX_CELL_CHARS:
+                    text = text[:MAX_CELL_CHARS]
+                    truncated += 1
+                value = _cell_value(text)
+                if isinstance(value, str) and value.startswith('='):
+                    # Data, not a formula
+                    value = WriteOnlyCell(sheet, value)
+                    value.data_type = 's'
+                row.append(value)
+            sheet.append(row)
+            sheet_rows += 1
+            if number % PROGRESS_ROWS == 0 and size:
+                report_progress(raw.tell() / size)
+    if sheet is None:
+        workbook.create_sheet("Sheet1")
+    if truncated:
+        print(f"{os.path.basename(input_path)}: cut {truncated} fields to the XLSX limit of {MAX_CELL_CHARS} characters.",
+              file=sys.stderr)
+    if cleaned:
+        print(f"{os.path.basename(input_path)}: removed control characters XLSX cannot hold from {cleaned} fields.",
+              file=sys.stderr)
+    with stage('write'):
+        workbook.save(output_path)
+
+
+def _field(value):
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        return 'TRUE' if value else 'FALSE'
+    if isinstance(value, datetime.datetime):
+        if value.time() == datetime.time():
+            return value.date().isoformat()
+        return value.isoformat(sep=' ')
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    return str(value)
+
+
+class _CountingReader:
+    """Passes reads through and counts the bytes, for progress."""
+
+    def __init__(self, f):
+        self.f = f
+        self.count = 0
+
+    def read(self, size=-1):
+        data = self.f.read(size)
+        self.count += len(data)
+        return data
+
+
+class _WorkbookReader:
+    """
+    Reads the worksheets of an XLSX file row by row. The workbook is opened
+    the way a read-only load_workbook() does, minus its worksheet step: that
+    parses any sheet without a <dimension> element (openpyxl's write-only
+    output, for one) in full just to size it. Cells go through openpyxl's
+    own parser, so values, dates and shared strings are the same as
+    iter_rows() gives. The parser is not public API, so everything it needs
+    is looked up before any row is read, and an openpyxl that does not have
+    it falls back to the read-only workbook.
+    """
+
+    def __init__(self, path):
+        self._reader = None
+        self._workbook = None
+        try:
+            self._open_parser(path)
+        except (ImportError, AttributeError, TypeError) as e:
+            print(f"{os.path.basename(path)}: reading with openpyxl's read-only workbook ({e}).", file=sys.stderr)
+            from openpyxl import load_workbook
+            self._workbook = load_workbook(path, read_only=True, data_only=True)
+            self.names = [sheet.title for sheet in self._workbook.worksheets]
+
+    def _open_parser(self, path):
+        from openpyxl.reader.excel import ExcelReader
+        from openpyxl.styles.stylesheet import apply_stylesheet
+        from openpyxl.worksheet._reader import ROW_TAG, WorkSheetParser
+        from openpyxl.xml.functions import iterparse
+        reader = ExcelReader(path, read_only=True, data_only=True)
+        try:
+            reader.read_manifest()
+            reader.read_strings()
+            reader.read_workbook()
+            apply_stylesheet(reader.archive, reader.wb)
+            sheets = [(sheet.name, rel.target) for sheet, rel in reader.parser.find_sheets()
+                      if rel.target in reader.valid_files and 'chartsheet' not in rel.Type]
+            parser_arguments = dict(data_only=True, epoch=reader.wb.epoch,
+                                    date_formats=reader.wb._date_formats,
+                                    timedelta_formats=reader.wb._timedelta_formats)
+            # A parser is built and its row hooks looked up here, so a changed
+            # signature fails before any output is written
+            probe = WorkSheetParser(io.BytesIO(), reader.shared_strings, **parser_arguments)
+            probe.row_dimensions.clear()
+            if not callable(probe.parse_row):
+                raise AttributeError("WorkSheetParser has no parse_row")
+        except BaseException:
+            reader.archive.close()
+            raise
+        self._reader = reader
+        self._parser_class = WorkSheetParser
+        self._parser_arguments = parser_arguments
+        self._row_tag = ROW_TAG
+        self._iterparse = iterparse
+        self._targets = [target for _, target in sheets]
+        self.names = [name for name, _ in sheets]
+        self._sizes = [reader.archive.getinfo(target).file_size for target in self._targets]
+
+    def rows(self, index):
+        """Yields (fraction of the workbook read, row values) for sheet index, [] for missing rows."""
+        if self._workbook is not None:
+            for values in self._workbook.worksheets[index].iter_rows(values_only=True):
+                yield index / len(self.names), list(values)
+            return
+        total = sum(self._sizes) or 1
+        done = sum(self._sizes[:index])
+        with self._reader.archive.open(self._targets[index]) as f:
+            source = _CountingReader(f)
+            parser = self._parser_class(source, self._reader.shared_strings, **self._parser_arguments)
+            for values in self._parse_rows(parser, source):
+                yield (done + source.count) / total, values
+
+    def _parse_rows(self, parser, source):
+        # Every row element is removed from the tree once read; openpyxl's
+        # own loop only clears it, which costs memory per row
+        parents = []
+        last_row = 0
+        for event, element in self._iterparse(source, events=('start', 'end')):
+            if event == 'start':
+                parents.append(element)
+                continue
+            parents.pop()
+            if element.tag != self._row_tag:
+                continue
+            number, cells = parser.parse_row(element)
+            parents[-1].remove(element)
+            parser.row_dimensions.clear()
+            for _ in range(last_row + 1, number):
+                yield []
+            last_row = number
+            values = [None] * max((cell['column'] for cell in cells), default=0)
+            for cell in cells:
+                values[cell['column'] - 1] = cell['value']
+            yield values
+
+    def close(self):
+        if self._workbook is not None:
+            self._workbook.close()
+        else:
+            self._reader.archive.close()
+
+
+def convert_xlsx_to_csv(input_path, output_path, options=None):
+    """
+    Writes the first worksheet to output_path. Sheets that continue it, as
+    convert_csv_to_xlsx() splits a long table (every sheet before them full
+    at spreadsheet_rows_per_sheet rows), are appended; any other sheet is
+    left out with a warning, since one CSV holds one table.
+    """
+    options = options or {}
+    encoding = options.get('text_encoding') or DEFAULT_OUTPUT_ENCODING
+    rows_per_sheet = min(MAX_ROWS, int(options.get('spreadsheet_rows_per_sheet') or MAX_ROWS))
+    workbook = _WorkbookReader(input_path)
+    skipped = []
+    try:
+        with stage('encode'), open(output_path, 'w', encoding=encoding, errors='replace', newline='') as f:
+            writer = csv.writer(f)
+            number = 0
+            sheet_rows = 0
+            for index in range(len(workbook.names)):
+                if index and sheet_rows != rows_per_sheet:
+                    skipped = workbook.names[index:]
+                    break
+                sheet_rows = 0
+                for fraction, values in workbook.rows(index):
+                    fields = [_field(value) for value in values]
+                    # Trailing empty cells are not fields
+                    while fields and fields[-1] == '':
+                        fields.pop()
+                    writer.writerow(fields)
+                    number += 1
+                    sheet_rows += 1
+                    if number % PROGRESS_ROWS == 0:
+                        report_progress(fraction)
+    finally:
+        workbook.close()
+    if skipped:
+        print(f"{os.path.basename(input_path)}: only the first sheet was converted; left out "
+              f"{', '.join(skipped)}.", file=sys.stderr)
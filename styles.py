@@ -27,23 +27,23 @@ def get_style():
         font-size: 20px;
         font-style: italic;
     }
-    QListWidget {
+    QListView {
         background-color: #212325;
         border: 2px dashed #4A4C50; /* Dashed border for drop area */
         border-radius: 8px;
         padding: 10px;
     }
-    QListWidget::item {
+    QListView::item {
         background-color: #2B2D30;
         border: 1px solid #3A3C40;
         border-radius: 5px;
         padding: 5px;
         margin-bottom: 5px;
     }
-    QListWidget::item:hover {
+    QListView::item:hover {
         background-color: #3A3C40;
     }
-    QListWidget::item:selected {
+    QListView::item:selected {
         background-color: #0078D4;
         border: 1px solid #005A9E;
         color: #FFFFFF;
@@ -134,8 +134,10 @@ def get_icons():
     return {
         "add": qta.icon('fa5s.plus-circle', color='#FFFFFF'),
         "folder": qta.icon('fa5s.folder-open', color='#FFFFFF'),
+        "add_folder": qta.icon('fa5s.folder-plus', color='#FFFFFF'),
         "convert": qta.icon('fa5s.cogs', color='#FFFFFF'),
         "clear": qta.icon('fa5s.trash-alt', color='#EAEAEA'),
+        "settings": qta.icon('fa5s.sliders-h', color='#FFFFFF'),
         "remove": qta.icon('fa5s.times-circle', color='#EAEAEA'),
         "doc": qta.icon('fa5s.file-word', color='#2B579A'),
         "img": qta.icon('fa5s.file-image', color='#4B8A08'),
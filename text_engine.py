@@ -0,0 +1,137 @@
+"""
+Streaming text engine.
+
+The source encoding is detected from a bounded prefix. When it already
+matches the target encoding, the file is copied by the kernel
+(copy_file_range, then sendfile) without passing through Python.
+Otherwise it is transcoded in fixed-size chunks with incremental codecs.
+Memory use is constant either way.
+"""
+import codecs
+import os
+import shutil
+from conversion_metrics import stage
+
+CHUNK_SIZE = 1024 * 1024
+DETECT_PREFIX_SIZE = 64 * 1024
+DEFAULT_OUTPUT_ENCODING = 'utf-8'
+
+_BOMS = [
+    (codecs.BOM_UTF32_LE, 'utf-32'),
+    (codecs.BOM_UTF32_BE, 'utf-32'),
+    (codecs.BOM_UTF8, 'utf-8-sig'),
+    (codecs.BOM_UTF16_LE, 'utf-16'),
+    (codecs.BOM_UTF16_BE, 'utf-16'),
+]
+
+
+def _normalize(encoding):
+    return codecs.lookup(encoding).name
+
+
+def detect_encoding(path, prefix_size=DETECT_PREFIX_SIZE):
+    """
+    Guesses the encoding of path from at most prefix_size bytes: a BOM
+    wins, then UTF-8 if the prefix decodes cleanly, then a multi-byte
+    encoding reported by charset_normalizer or chardet when installed, and
+    finally cp1252/latin-1.
+    """
+    with open(path, 'rb') as f:
+        prefix = f.read(prefix_size)
+    for bom, encoding in _BOMS:
+        if prefix.startswith(bom):
+            return encoding
+    try:
+        # final=False tolerates a multi-byte sequence cut off at the end of the prefix
+        codecs.getincrementaldecoder('utf-8')().decode(prefix, final=False)
+        return 'utf-8'
+    except UnicodeDecodeError:
+        pass
+    guess = _guess_with_library(prefix)
+    if guess and not _is_single_byte(guess):
+        return guess
+    # Single-byte text fits most legacy code pages about equally well, and
+    # cp1252 is by far the most common of them.
+    try:
+        prefix.decode('cp1252')
+        return 'cp1252'
+    except UnicodeDecodeError:
+        return guess or 'latin-1'
+
+
+def _is_single_byte(encoding):
+    try:
+        return len(bytes(range(0x80, 0x100)).decode(encoding, 'replace')) == 0x80
+    except LookupError:
+        return False
+
+
+def _guess_with_library(prefix):
+    try:
+        from charset_normalizer import from_bytes
+        best = from_bytes(prefix).best()
+        return best.encoding if best else None
+    except ImportError:
+        pass
+    try:
+        import chardet
+        result = chardet.detect(prefix)
+        if result.get('encoding') and result.get('confidence', 0) >= 0.5:
+            return result['encoding']
+    except ImportError:
+        pass
+    return None
+
+
+def kernel_copy(input_path, output_path):
+    """Copies input_path to output_path in kernel space where the OS allows it."""
+    with open(input_path, 'rb') as fin, open(output_path, 'wb') as fout:
+        remaining = os.fstat(fin.fileno()).st_size
+        copy_file_range = getattr(os, 'copy_file_range', None)
+        sendfile = getattr(os, 'sendfile', None)
+        # A size of 0 is not trusted (procfs and some FUSE files report it), so those are read
+        for copy in (copy_file_range, sendfile) if remaining else ():
+            if copy is None:
+                continue
+            try:
+                while remaining > 0:
+                    if copy is copy_file_range:
+                        sent = copy(fin.fileno(), fout.fileno(), min(remaining, 1 << 30))
+                    else:
+                        sent = copy(fout.fileno(), fin.fileno(), None, min(remaining, 1 << 30))
+                    if sent == 0:
+                        break
+                    remaining -= sent
+            except OSError:
+                pass
+            if remaining == 0:
+                return
+            # Not supported between these files, or stopped short; continue from the current offsets
+        shutil.copyfileobj(fin, fout, CHUNK_SIZE)
+
+
+def transcode(input_path, output_path, source_encoding, target_encoding, errors='replace'):
+    decoder = codecs.getincrementaldecoder(source_encoding)(errors=errors)
+    encoder = codecs.getincrementalencoder(target_encoding)(errors=errors)
+    with open(input_path, 'rb') as fin, open(output_path, 'wb') as fout:
+        while True:
+            chunk = fin.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            fout.write(encoder.encode(decoder.decode(chunk)))
+        fout.write(encoder.encode(decoder.decode(b'', final=True), final=True))
+
+
+def convert_text(input_path, output_path, options=None):
+    options = options or {}
+    target_encoding = options.get('text_encoding') or DEFAULT_OUTPUT_ENCODING
+    source_encoding = options.get('text_source_encoding') or detect_encoding(input_path)
+    source = _normalize(source_encoding)
+    target = _normalize(target_encoding)
+    # ASCII and BOM-prefixed UTF-8 are already valid UTF-8 (the BOM is kept as-is)
+    if source == target or (target == 'utf-8' and source in ('utf-8-sig', 'ascii')):
+        with stage('write'):
+            kernel_copy(input_path, output_path)
+    else:
+        transcode(input_path, output_path, source_encoding, target_encoding,
+                  options.get('text_errors', 'replace'))
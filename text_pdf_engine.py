@@ -0,0 +1,348 @@
+"""
+Streaming text-to-PDF engine.
+
+Pages are laid out with cached font metrics and written to the output
+file as soon as they are full. Each page is one text object with one
+content stream, so neither memory nor per-call overhead grows with the
+document. Large inputs in an ASCII-compatible encoding can be split at
+line boundaries into byte ranges that are rendered in parallel and
+stitched back together in order. Each range starts on a new page.
+
+The PDF objects are written directly. reportlab is used only for the
+metrics of the standard Type 1 fonts, so nothing needs embedding.
+"""
+import multiprocessing
+import os
+import zlib
+from array import array
+from bisect import bisect_right
+from concurrent.futures import ProcessPoolExecutor
+from itertools import accumulate
+from conversion_metrics import progress_enabled, report_progress, stage
+
+PAGE_WIDTH, PAGE_HEIGHT = 612.0, 792.0  # US Letter, as reportlab.lib.pagesizes.letter
+MARGIN = 72
+FONT_SIZE = 12
+LEADING = 16
+TAB_SIZE = 4
+
+# Resource name -> base-14 font. Text is encoded as WinAnsi (cp1252).
+FONTS = {'F1': 'Helvetica', 'F2': 'Helvetica-Bold', 'F3': 'Helvetica-Oblique'}
+
+DEFAULT_COMPRESS_LEVEL = 6
+DEFAULT_PARALLEL_THRESHOLD = 32 * 1024 * 1024
+DEFAULT_RANGE_SIZE = 16 * 1024 * 1024
+# Lines read between two progress reports of a serial conversion
+PROGRESS_LINES = 4096
+
+
+def escape(text):
+    """Escapes text for use in a PDF literal string."""
+    if '\\' in text:
+        text = text.replace('\\', '\\\\')
+    if '(' in text or ')' in text:
+        text = text.replace('(', '\\(').replace(')', '\\)')
+    if '\r' in text:
+        text = text.replace('\r', '')
+    return text
+
+
+class FontMetrics:
+    """
+    Per-character advance widths of one font at one size, filled on
+    demand. Widths are kept as integer glyph-space units (1/1000 em), which
+    sum faster than floats; width() and wrap() take and return points.
+    """
+
+    _cache = {}
+
+    @classmethod
+    def get(cls, font_name, size):
+        key = (font_name, size)
+        if key not in cls._cache:
+            cls._cache[key] = cls(font_name, size)
+        return cls._cache[key]
+
+    def __init__(self, font_name, size):
+        from reportlab.pdfbase.pdfmetrics import stringWidth
+        self._string_width = stringWidth
+        self.font_name = font_name
+        self.size = size
+        self.widths = {}
+        # Widest glyph in WinAnsi; lines shorter than max_width / this never need measuring
+        self.max_char_width = max(self._measure(chr(code)) for code in range(32, 256)
+                                  if _encodable(chr(code))) * size / 1000
+
+    def _measure(self, ch):
+        if not _encodable(ch):
+            ch = '?'
+        return round(self._string_width(ch, self.font_name, 1000))
+
+    def _char_widths(self, text):
+        widths = self.widths
+        missing = set(text).difference(widths)
+        for ch in missing:
+            widths[ch] = self._measure(ch)
+        return map(widths.__getitem__, text)
+
+    def width(self, text):
+        return sum(self._char_widths(text)) * self.size / 1000
+
+    def wrap(self, text, max_width):
+        if len(text) * self.max_char_width <= max_width:
+            return [text]
+        max_units = max_width * 1000 / self.size
+        edges = list(accumulate(self._char_widths(text)))
+        if edges[-1] <= max_units:
+            return [text]
+        lines = []
+        start, offset, end = 0, 0, len(text)
+        while start < end:
+            fit = bisect_right(edges, offset + max_units, start)
+            if fit >= end:
+                lines.append(text[start:])
+                break
+            fit = max(fit, start + 1)
+            cut = text.rfind(' ', start, fit + 1)
+            if cut <= start:
+                cut = fit
+            lines.append(text[start:cut].rstrip())
+            start = cut
+            while start < end and text[start] == ' ':
+                start += 1
+            offset = edges[start - 1]
+        return lines
+
+
+def _encodable(ch):
+    try:
+        ch.encode('cp1252')
+        return True
+    except UnicodeEncodeError:
+        return False
+
+
+class PDFStreamWriter:
+    """
+    Minimal incremental PDF writer. Objects 1-2 are the catalog and page
+    tree, followed by one object per font; each page then adds a content
+    stream and a page object, written immediately.
+    """
+
+    def __init__(self, fileobj, compress_level=DEFAULT_COMPRESS_LEVEL):
+        self.file = fileobj
+        self.compress_level = compress_level
+        self.offsets = array('Q', [0, 0, 0])  # index = object number; 1 and 2 are written last
+        self.page_count = 0
+        self.file.write(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+        self.font_refs = []
+        for resource_name, base_font in FONTS.items():
+            number = self._write_object(
+                f'<< /Type /Font /Subtype /Type1 /BaseFont /{base_font} '
+                f'/Encoding /WinAnsiEncoding >>'.encode('ascii'))
+            self.font_refs.append(f'/{resource_name} {number} 0 R')
+        self.resources = f"<< /Font << {' '.join(self.font_refs)} >> >>"
+
+    def _write_object(self, body):
+        number = len(self.offsets)
+        with stage('write'):
+            self.offsets.append(self.file.tell())
+            self.file.write(f'{number} 0 obj\n'.encode('ascii'))
+            self.file.write(body)
+            self.file.write(b'\nendobj\n')
+        return number
+
+    def compress(self, content):
+        return zlib.compress(content, self.compress_level) if self.compress_level else content
+
+    def add_page(self, content, compressed=False):
+        """Writes one page; content is its raw (or already compressed) content stream."""
+        if not compressed:
+            content = self.compress(content)
+        flate = ' /Filter /FlateDecode' if self.compress_level else ''
+        number = self._write_object(
+            f'<< /Length {len(content)}{flate} >>\nstream\n'.encode('ascii') + content + b'\nendstream')
+        self._write_object(
+            f'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {PAGE_WIDTH:g} {PAGE_HEIGHT:g}] '
+            f'/Resources {self.resources} /Contents {number} 0 R >>'.encode('ascii'))
+        self.page_count += 1
+
+    def close(self):
+        if self.page_count == 0:
+            self.add_page(b'')
+        first_page = len(FONTS) + 4  # page objects follow each content stream
+        kids = ' '.join(f'{first_page + 2 * i} 0 R' for i in range(self.page_count))
+        self.offsets[2] = self.file.tell()
+        self.file.write(f'2 0 obj\n<< /Type /Pages /Count {self.page_count} /Kids [{kids}] >>\nendobj\n'.encode('ascii'))
+        self.offsets[1] = self.file.tell()
+        self.file.write(b'1 0 obj\n<< /Type /Catalog /Pages 2 0 R >>\nendobj\n')
+        xref_offset = self.file.tell()
+        self.file.write(f'xref\n0 {len(self.offsets)}\n0000000000 65535 f \n'.encode('ascii'))
+        self.file.write(b''.join(b'%010d 00000 n \n' % offset for offset in self.offsets[1:]))
+        self.file.write(f'trailer\n<< /Size {len(self.offsets)} /Root 1 0 R >>\n'
+                        f'startxref\n{xref_offset}\n%%EOF\n'.encode('ascii'))
+
+
+class TextPageBuilder:
+    """
+    Places lines top to bottom and hands every finished page's content
+    stream to sink(content). Lines never wrap here; callers wrap them with
+    FontMetrics.wrap first.
+    """
+
+    def __init__(self, sink, margin=MARGIN, header=None):
+        self.sink = sink
+        self.margin = margin
+        self.header = header
+        self.parts = []
+        self.font = None
+        self.y = PAGE_HEIGHT - margin
+
+    @property
+    def text_width(self):
+        return PAGE_WIDTH - 2 * self.margin
+
+    def add_line(self, text, font='F1', size=FONT_SIZE, leading=LEADING, indent=0):
+        self._new_line()
+        self._place(text, font, size, indent)
+        self.y -= leading
+
+    def add_row(self, columns, column_width, font='F1', size=FONT_SIZE, leading=LEADING, indent=0):
+        """Lays out side-by-side columns, each a list of already wrapped lines."""
+        for index in range(max((len(lines) for lines in columns), default=0)):
+            self._new_line()
+            for column, lines in enumerate(columns):
+                if index < len(lines) and lines[index]:
+                    self._place(lines[index], font, size, indent + column * column_width)
+            self.y -= leading
+
+    def _new_line(self):
+        if self.y < self.margin:
+            self.finish_page()
+        if not self.parts:
+            self._start_page()
+
+    def _place(self, text, font, size, indent):
+        if (font, size) != self.font:
+            self.parts.append(f'/{font} {size:g} Tf')
+            self.font = (font, size)
+        self.parts.append(f'1 0 0 1 {self.margin + indent:g} {self.y:g} Tm ({escape(text)}) Tj')
+
+    def add_space(self, height):
+        self.y -= height
+
+    def _start_page(self):
+        self.parts.append('BT')
+        self.font = None
+        if self.header:
+            self.parts.append(f'/F3 9 Tf 1 0 0 1 {self.margin:g} {PAGE_HEIGHT - self.margin / 2:g} Tm '
+                              f'({escape(self.header)}) Tj')
+
+    def finish_page(self):
+        if not self.parts:
+            self._start_page()
+        self.parts.append('ET')
+        self.sink('\n'.join(self.parts).encode('cp1252', 'replace'))
+        self.parts = []
+        self.font = None
+        self.y = PAGE_HEIGHT - self.margin
+
+    def close(self):
+        if self.parts:
+            self.finish_page()
+
+
+def _ascii_compatible(encoding):
+    try:
+        return '\n'.encode(encoding) == b'\n' and 'A'.encode(encoding) == b'A'
+    except LookupError:
+        return False
+
+
+def iter_lines(path, encoding, start=0, end=None, report=False):
+    if not _ascii_compatible(encoding):
+        with open(path, 'r', encoding=encoding, errors='replace', newline=None) as f:
+            yield from f
+        return
+    size = os.path.getsize(path) if report else 0
+    with open(path, 'rb') as f:
+        f.seek(start)
+        position = start
+        for count, raw in enumerate(f, start=1):
+            if end is not None and position >= end:
+                break
+            position += len(raw)
+            yield raw.decode(encoding, 'replace')
+            if size and count % PROGRESS_LINES == 0:
+                report_progress(position / size)
+
+
+def _layout_lines(lines, builder):
+    metrics = FontMetrics.get(FONTS['F1'], FONT_SIZE)
+    max_width = builder.text_width
+    for line in lines:
+        line = line.rstrip().expandtabs(TAB_SIZE)
+        for piece in metrics.wrap(line, max_width):
+            builder.add_line(piece)
+    builder.close()
+
+
+def _render_range(path, encoding, start, end, compress_level):
+    pages = []
+    sink = (lambda content: pages.append(zlib.compress(content, compress_level))) if compress_level \
+        else pages.append
+    _layout_lines(iter_lines(path, encoding, start, end), TextPageBuilder(sink))
+    return pages
+
+
+def _split_ranges(path, range_size):
+    size = os.path.getsize(path)
+    offsets = [0]
+    with open(path, 'rb') as f:
+        while offsets[-1] + range_size < size:
+            f.seek(offsets[-1] + range_size)
+            f.readline()
+            if f.tell() >= size:
+                break
+            offsets.append(f.tell())
+    offsets.append(size)
+    return list(zip(offsets[:-1], offsets[1:]))
+
+
+def convert_text_to_pdf(input_path, output_path, options=None):
+    from text_engine import detect_encoding
+    options = options or {}
+    encoding = options.get('text_source_encoding') or detect_encoding(input_path)
+    compress_level = int(options.get('pdf_compress_level', DEFAULT_COMPRESS_LEVEL))
+    workers = int(options.get('text_pdf_workers') or os.cpu_count() or 1)
+    threshold = int(options.get('text_pdf_parallel_threshold', DEFAULT_PARALLEL_THRESHOLD))
+    range_size = int(options.get('text_pdf_range_size', DEFAULT_RANGE_SIZE))
+
+    with open(output_path, 'wb') as out:
+        writer = PDFStreamWriter(out, compress_level)
+        if workers > 1 and _ascii_compatible(encoding) and os.path.getsize(input_path) > threshold:
+            ranges = _split_ranges(input_path, range_size)
+            range_count = len(ranges)
+            context = multiprocessing.get_context('spawn')
+            with ProcessPoolExecutor(max_workers=min(workers, len(ranges)), mp_context=context) as executor:
+                # Keep a bounded window of ranges in flight and write them back in order
+                pending = []
+                ranges = iter(ranges)
+                for start, end in ranges:
+                    pending.append(executor.submit(_render_range, input_path, encoding, start, end, compress_level))
+                    if len(pending) >= workers * 2:
+                        break
+                written = 0
+                while pending:
+                    for content in pending.pop(0).result():
+                        writer.add_page(content, compressed=True)
+                    written += 1
+                    report_progress(written / range_count)
+                    next_range = next(ranges, None)
+                    if next_range is not None:
+                        pending.append(executor.submit(_render_range, input_path, encoding,
+                                                       *next_range, compress_level))
+        else:
+            _layout_lines(iter_lines(input_path, encoding, report=progress_enabled()),
+                          TextPageBuilder(writer.add_page))
+        writer.close()
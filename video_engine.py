@@ -0,0 +1,253 @@
+"""
+Video conversion engine.
+
+The source is probed first. If every stream's codec can be stored in the
+target container, the file is remuxed with stream copy, which is fast and
+lossless. Otherwise only the streams that need it are transcoded. The
+video stream is split at keyframes into segments, the segments are
+encoded in parallel ffmpeg processes, and the encoded segments are
+concatenated and muxed with the (copied or re-encoded) audio. Sources with
+more than one audio track, or with subtitles, are transcoded in one pass
+instead.
+
+convert_video_many() serves several targets from one ffmpeg process with
+one output per target, so the source is read and decoded once. Targets
+that would take the segmented path are still converted on their own.
+"""
+import os
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from conversion_metrics import progress_span, report_progress, stage
+from ffmpeg_tools import probe, progress_duration, run_ffmpeg, streams_of_type
+
+DEFAULT_SEGMENT_SECONDS = 30
+# Below this duration the split/concat overhead outweighs the parallelism
+MIN_PARALLEL_SECONDS = 60
+
+# Codecs each container can hold without re-encoding. None means "anything".
+CONTAINER_CODECS = {
+    '.mp4': {
+        'video': {'h264', 'hevc', 'mpeg4', 'av1', 'vp9', 'mpeg2video'},
+        'audio': {'aac', 'mp3', 'ac3', 'eac3', 'opus', 'alac', 'flac'},
+    },
+    '.mov': {
+        'video': {'h264', 'hevc', 'mpeg4', 'prores', 'mjpeg', 'mpeg2video'},
+        'audio': {'aac', 'mp3', 'ac3', 'alac', 'pcm_s16le', 'pcm_s24le'},
+    },
+    '.avi': {
+        'video': {'mpeg4', 'h264', 'mjpeg', 'msmpeg4v3', 'mpeg2video', 'rawvideo', 'huffyuv'},
+        'audio': {'mp3', 'ac3', 'pcm_s16le', 'pcm_u8', 'aac'},
+    },
+    '.mkv': {'video': None, 'audio': None},
+}
+
+# Encoders used when a stream has to be transcoded for the target container
+TARGET_ENCODERS = {
+    '.mp4': ('libx264', 'aac'),
+    '.mov': ('libx264', 'aac'),
+    '.avi': ('mpeg4', 'libmp3lame'),
+    '.mkv': ('libx264', 'aac'),
+}
+
+
+def _compatible(streams, allowed):
+    return allowed is None or all(stream.get('codec_name') in allowed for stream in streams)
+
+
+def _segmentable(info):
+    """
+    Segmenting encodes one video stream and muxes one audio stream back in,
+    so sources with more streams than that are transcoded in a single pass.
+    """
+    streams = info.get('streams', [])
+    return (len(streams_of_type(info, 'video')) == 1 and len(streams_of_type(info, 'audio')) <= 1
+            and all(stream.get('codec_type') in ('video', 'audio') for stream in streams))
+
+
+def plan(info, output_ext):
+    """
+    Returns (copy_video, copy_audio) for converting a source described by
+    ffprobe info into output_ext.
+    """
+    allowed = CONTAINER_CODECS.get(output_ext, {'video': None, 'audio': None})
+    video_streams = streams_of_type(info, 'video')
+    audio_streams = streams_of_type(info, 'audio')
+    return (_compatible(video_streams[:1], allowed['video']),
+            _compatible(audio_streams[:1], allowed['audio']))
+
+
+def convert_video(input_path, output_path, options=None):
+    options = options or {}
+    output_ext = os.path.splitext(output_path)[1].lower()
+    video_encoder, audio_encoder = TARGET_ENCODERS.get(output_ext, ('libx264', 'aac'))
+    info = probe(input_path)
+    # Only set when someone follows the job's progress (see ffmpeg_tools.progress_duration)
+    tracked_duration = progress_duration(input_path)
+
+    if info is None:
+        # Without ffprobe the codecs are unknown: try a remux and fall back to a full transcode
+        try:
+            _remux(input_path, output_path, tracked_duration)
+        except RuntimeError:
+            _transcode(input_path, output_path, video_encoder, audio_encoder, options, tracked_duration)
+        return
+
+    copy_video, copy_audio = plan(info, output_ext)
+    has_audio = bool(streams_of_type(info, 'audio'))
+    if copy_video and copy_audio:
+        try:
+            _remux(input_path, output_path, tracked_duration)
+            return
+        except RuntimeError:
+            # The probe can pass codecs the muxer still rejects (odd timestamps, unusual tags)
+            copy_video = copy_audio = False
+
+    duration = float(info.get('format', {}).get('duration') or 0)
+    workers = int(options.get('video_workers') or os.cpu_count() or 1)
+    segment_seconds = float(options.get('video_segment_seconds') or DEFAULT_SEGMENT_SECONDS)
+    if copy_video or workers < 2 or duration < MIN_PARALLEL_SECONDS or not _segmentable(info):
+        _transcode(input_path, output_path,
+                   'copy' if copy_video else video_encoder,
+                   'copy' if copy_audio or not has_audio else audio_encoder,
+                   options, tracked_duration)
+        return
+    _transcode_segmented(input_path, output_path, video_encoder,
+                         'copy' if copy_audio else audio_encoder,
+                         has_audio, workers, segment_seconds, options, tracked_duration)
+
+
+def _output_args(info, output_path, options):
+    """Returns the ffmpeg output arguments for output_path, or None if it should be segmented."""
+    output_ext = os.path.splitext(output_path)[1].lower()
+    video_encoder, audio_encoder = TARGET_ENCODERS.get(output_ext, ('libx264', 'aac'))
+    copy_video, copy_audio = plan(info, output_ext)
+    has_audio = bool(streams_of_type(info, 'audio'))
+    duration = float(info.get('format', {}).get('duration') or 0)
+    workers = int(options.get('video_workers') or os.cpu_count() or 1)
+    if not copy_video and workers >= 2 and duration >= MIN_PARALLEL_SECONDS and _segmentable(info):
+        return None
+    return [*_video_args('copy' if copy_video else video_encoder, options),
+            '-c:a', 'copy' if copy_audio or not has_audio else audio_encoder, output_path]
+
+
+def convert_video_many(input_path, output_paths, options=None):
+    """
+    Converts one source to several targets and returns one exception (or
+    None) per output path.
+    """
+    options = options or {}
+    errors = [None] * len(output_paths)
+    info = probe(input_path)
+    tracked_duration = progress_duration(input_path)
+    if info is None:
+        # Without ffprobe, try one remux for every target first, like convert_video does for one
+        try:
+            with stage('write'):
+                run_ffmpeg('-i', input_path, *(arg for output_path in output_paths
+                                               for arg in ('-vcodec', 'copy', '-acodec', 'copy', output_path)),
+                           duration=tracked_duration)
+            return errors
+        except RuntimeError:
+            pass
+    shared = []
+    single = []
+    for number, output_path in enumerate(output_paths):
+        args = _output_args(info, output_path, options) if info is not None else None
+        if args is None:
+            single.append(number)
+        else:
+            shared.append((number, args))
+    # Every ffmpeg run below gets an equal share of the job's progress
+    runs = len(single) + (1 if shared else 0)
+    for position, number in enumerate(single):
+        try:
+            with progress_span(position / runs, (position + 1) / runs):
+                convert_video(input_path, output_paths[number], options)
+        except Exception as e:
+            errors[number] = e
+    if shared:
+        try:
+            with progress_span(len(single) / runs, 1.0):
+                run_ffmpeg('-i', input_path, *(arg for _, args in shared for arg in args),
+                           duration=tracked_duration)
+        except RuntimeError:
+            # One rejected output fails the whole run; convert_video falls back to a transcode per target
+            for position, (number, _) in enumerate(shared):
+                try:
+                    with progress_span((len(single) + position / len(shared)) / runs,
+                                       (len(single) + (position + 1) / len(shared)) / runs):
+                        convert_video(input_path, output_paths[number], options)
+                except Exception as e:
+                    errors[number] = e
+    return errors
+
+
+def _remux(input_path, output_path, tracked_duration=None):
+    with stage('write'):
+        run_ffmpeg('-i', input_path, '-vcodec', 'copy', '-acodec', 'copy', output_path, duration=tracked_duration)
+
+
+def _video_args(encoder, options, threads=None):
+    args = ['-c:v', encoder]
+    if encoder == 'copy':
+        return args
+    if options.get('video_preset') and encoder == 'libx264':
+        args += ['-preset', str(options['video_preset'])]
+    if options.get('video_crf') is not None and encoder == 'libx264':
+        args += ['-crf', str(options['video_crf'])]
+    if threads:
+        args += ['-threads', str(threads)]
+    return args
+
+
+def _transcode(input_path, output_path, video_encoder, audio_encoder, options, tracked_duration=None):
+    run_ffmpeg('-i', input_path, *_video_args(video_encoder, options), '-c:a', audio_encoder, output_path,
+               duration=tracked_duration)
+
+
+def _transcode_segmented(input_path, output_path, video_encoder, audio_encoder,
+                         has_audio, workers, segment_seconds, options, tracked_duration=None):
+    # Segments sit next to the output under this worker's pid, where a cancelled job's leftovers are looked for
+    work_dir = tempfile.mkdtemp(prefix=f'.pxconvert-{os.getpid()}-',
+                                dir=os.path.dirname(os.path.abspath(output_path)))
+    try:
+        # 1. Split the video stream at keyframes without re-encoding
+        with stage('decode'), progress_span(0.0, 0.1):
+            run_ffmpeg('-i', input_path, '-map', '0:v:0', '-c', 'copy', '-f', 'segment',
+                       '-segment_time', str(segment_seconds), '-reset_timestamps', '1',
+                       os.path.join(work_dir, 'source_%05d.mkv'), duration=tracked_duration)
+        sources = sorted(name for name in os.listdir(work_dir) if name.startswith('source_'))
+        if not sources:
+            raise RuntimeError("FFmpeg produced no video segments.")
+
+        # 2. Encode the segments in parallel; each process gets an equal share of the cores
+        parallel = min(workers, len(sources))
+        threads = max(1, (os.cpu_count() or 1) // parallel)
+        output_ext = os.path.splitext(output_path)[1].lower()
+        encoded = [os.path.join(work_dir, f"encoded_{index:05d}{output_ext}") for index in range(len(sources))]
+
+        def encode(index):
+            run_ffmpeg('-i', os.path.join(work_dir, sources[index]),
+                       *_video_args(video_encoder, options, threads), '-an', encoded[index])
+
+        with ThreadPoolExecutor(max_workers=parallel) as executor, progress_span(0.1, 0.9):
+            futures = [executor.submit(encode, index) for index in range(len(sources))]
+            for done, future in enumerate(as_completed(futures), start=1):
+                future.result()
+                report_progress(done / len(futures))
+
+        # 3. Concatenate the encoded segments and mux the audio from the original
+        list_path = os.path.join(work_dir, 'segments.txt')
+        with open(list_path, 'w', encoding='utf-8') as f:
+            for path in encoded:
+                escaped = path.replace("'", "'\\''")
+                f.write(f"file '{escaped}'\n")
+        args = ['-f', 'concat', '-safe', '0', '-i', list_path]
+        if has_audio:
+            args += ['-i', input_path, '-map', '0:v:0', '-map', '1:a:0', '-c:a', audio_encoder]
+        args += ['-c:v', 'copy', output_path]
+        with stage('write'), progress_span(0.9, 1.0):
+            run_ffmpeg(*args, duration=tracked_duration)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)